@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+# Record a plugin's parameter automation in the background (eg. while its editor is shown), and replay it into a render.
+#
+# An AutomationRecorder samples every parameter on a background thread at a fixed rate, using a ParameterLayout so
+# that each sample is a single vectorised capture. Only the parameters that changed since the previous sample are
+# stored, as (time, parameter index, value) entries in preallocated NumPy ring buffers, so recording allocates next
+# to nothing and the thread spends almost all of its time asleep (without holding the GIL). If the ring buffer fills
+# up, the oldest changes are folded into the lane's initial values rather than lost.
+#
+# The recording is exported as an AutomationLane: the initial values plus the list of changes, saved as a compact
+# .npz file. render_with_automation replays a lane sample-accurately, by rendering the audio in segments between the
+# sample positions where parameters change (continuing the plugin's state across segments with reset=False), and
+# applying the changes between segments.
+#
+# Example usage:
+#   with AutomationRecorder(synth_plugin, rate=200) as recorder:
+#       synth_plugin.show_editor()
+#   lane = recorder.lane()
+#   lane.save('automation.npz')
+#   audio = render_with_automation(synth_plugin, lane, midi_events, duration=4.0, sample_rate=44100, num_channels=2)
+#
+#   python automation_recorder.py automation.npz --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --show-editor
+#   python automation_recorder.py automation.npz --plugin builtin:Reverb --sweep room_size --render automated.wav
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from parameter_snapshot import ParameterLayout
+from rendering import midi_event_positions, render_midi_segment
+
+DEFAULT_RATE = 100.0
+DEFAULT_CAPACITY = 65536
+
+
+class AutomationLane:
+    """
+    Recorded parameter automation: the initial parameter values, and every change after them.
+
+    Args:
+      keys (tuple): The parameter keys, in layout order.
+      initial (numpy.ndarray): The float32 initial value of each parameter.
+      times (numpy.ndarray): The float64 time of each change, in seconds from the start of the recording.
+      indices (numpy.ndarray): The int32 parameter (layout) index of each change.
+      values (numpy.ndarray): The float32 new value of each change.
+    """
+
+    def __init__(self, keys, initial, times, indices, values):
+        self.keys = tuple(keys)
+        self.initial = initial
+        self.times = times
+        self.indices = indices
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def save(self, path):
+        """
+        Save the lane as a compressed .npz file.
+        """
+        np.savez_compressed(
+            path,
+            keys=np.array(self.keys),
+            initial=self.initial,
+            times=self.times,
+            indices=self.indices,
+            values=self.values,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a lane saved with save.
+        """
+        with np.load(path) as data:
+            return cls(
+                data['keys'].tolist(),
+                data['initial'],
+                data['times'],
+                data['indices'],
+                data['values'],
+            )
+
+    def changes(self):
+        """
+        Returns:
+          list: (time, key, value) tuples for each change.
+        """
+        return [
+            (time, self.keys[index], value)
+            for time, index, value in zip(self.times.tolist(), self.indices.tolist(), self.values.tolist())
+        ]
+
+
+class AutomationRecorder:
+    """
+    Records the changes to a plugin's parameters on a background thread.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin to record the parameters of.
+      rate (float): The number of times per second to sample the parameters.
+      capacity (int): The number of changes the ring buffer holds.
+      keys (list, optional): The parameter keys to record. Defaults to all of them.
+      tolerance (float): Changes of this size or smaller are ignored.
+    """
+
+    def __init__(self, plugin, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY, keys=None, tolerance=0.0):
+        self.layout = ParameterLayout(plugin, keys)
+        self.period = 1.0 / rate
+        self.capacity = capacity
+        self.tolerance = tolerance
+
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._indices = np.zeros(capacity, dtype=np.int32)
+        self._values = np.zeros(capacity, dtype=np.float32)
+        self._count = 0
+        self._initial = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+        self.num_samples = 0
+        self.num_late_samples = 0
+        self.sample_seconds_total = 0.0
+        self.sample_seconds_max = 0.0
+
+    def start(self):
+        """
+        Capture the initial values, and start sampling on a background (daemon) thread.
+        """
+        if self._thread is not None:
+            raise RuntimeError("The recorder has already been started.")
+        self._initial = self.layout.capture().values.copy()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='AutomationRecorder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling (after taking one last sample), and wait for the background thread to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        previous = self._initial.copy()
+        next_sample = self._started + self.period
+        while True:
+            stopping = self._stop.wait(max(0.0, next_sample - time.perf_counter()))
+
+            sampled = time.perf_counter()
+            values = self.layout.capture().values
+            if self.tolerance:
+                changed = np.flatnonzero(np.abs(values - previous) > self.tolerance)
+            else:
+                changed = np.flatnonzero(values != previous)
+            if len(changed):
+                previous[changed] = values[changed]
+                self._append(sampled - self._started, changed, values[changed])
+
+            sample_seconds = time.perf_counter() - sampled
+            self.num_samples += 1
+            self.sample_seconds_total += sample_seconds
+            self.sample_seconds_max = max(self.sample_seconds_max, sample_seconds)
+            if stopping:
+                return
+
+            next_sample += self.period
+            if next_sample < time.perf_counter():
+                # Skip the samples we've missed, rather than trying to catch up with them
+                self.num_late_samples += 1
+                next_sample = time.perf_counter() + self.period
+
+    def _append(self, sample_time, indices, values):
+        with self._lock:
+            # Fold the (oldest) changes that are about to be overwritten into the initial values, in order
+            num_stored = min(self._count, self.capacity)
+            num_lost = min(num_stored, max(0, num_stored + len(indices) - self.capacity))
+            if num_lost:
+                oldest = self._count % self.capacity if self._count >= self.capacity else 0
+                lost = (oldest + np.arange(num_lost)) % self.capacity
+                self._initial[self._indices[lost]] = self._values[lost]
+            num_kept = min(len(indices), self.capacity)
+            if num_kept < len(indices):
+                self._initial[indices[:-num_kept]] = values[:-num_kept]
+
+            slots = (self._count + len(indices) - num_kept + np.arange(num_kept)) % self.capacity
+            self._times[slots] = sample_time
+            self._indices[slots] = indices[-num_kept:]
+            self._values[slots] = values[-num_kept:]
+            self._count += len(indices)
+
+    @property
+    def num_changes(self):
+        return self._count
+
+    @property
+    def num_dropped(self):
+        """
+        The number of changes that have been folded into the initial values, because the ring buffer was full.
+        """
+        return max(0, self._count - self.capacity)
+
+    def lane(self):
+        """
+        Export the recording so far.
+
+        Returns:
+          AutomationLane: The recorded automation.
+        """
+        if self._initial is None:
+            raise RuntimeError("The recorder hasn't been started.")
+        with self._lock:
+            if self._count <= self.capacity:
+                order = np.arange(self._count)
+            else:
+                order = np.roll(np.arange(self.capacity), -(self._count % self.capacity))
+            return AutomationLane(
+                self.layout.keys,
+                self._initial.copy(),
+                self._times[order],
+                self._indices[order],
+                self._values[order],
+            )
+
+    def stats(self):
+        """
+        Returns:
+          dict: The number of samples taken (and how many were late), the changes recorded (and dropped), and the
+            time spent taking each sample.
+        """
+        return {
+            'samples': self.num_samples,
+            'late_samples': self.num_late_samples,
+            'changes': self.num_changes,
+            'dropped': self.num_dropped,
+            'sample_seconds_mean': self.sample_seconds_total / self.num_samples if self.num_samples else 0.0,
+            'sample_seconds_max': self.sample_seconds_max,
+        }
+
+
+def render_with_automation(
+    plugin,
+    lane,
+    midi_events,
+    duration,
+    sample_rate,
+    num_channels,
+    buffer_size=8192,
+    reset=True,
+    time_offset=0.0,
+):
+    """
+    Render some MIDI through a plugin, replaying an automation lane sample-accurately.
+
+    The lane's initial values are applied first, and each change is applied at the sample position of its time
+    (truncated, like MIDI event times). The audio is rendered in segments between those positions, with the plugin's
+    state carried across segments.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin (with the same parameter keys as the lane) to render with.
+      lane (AutomationLane): The automation to replay.
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      duration (float): The number of seconds of audio to render.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      buffer_size (int): The (maximum) buffer size the plugin processes audio in.
+      reset (bool): Whether to reset the plugin before rendering.
+      time_offset (float): The lane time that lines up with the start of the render.
+
+    Returns:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples).
+    """
+    layout = ParameterLayout(plugin, lane.keys)
+    num_samples = int(duration * sample_rate)
+    change_positions = np.maximum(((lane.times - time_offset) * sample_rate).astype(np.int64), 0)
+    event_positions = midi_event_positions(midi_events, sample_rate)
+
+    # Everything up to (and including) the first sample is applied before rendering
+    values = lane.initial.copy()
+    first = np.searchsorted(change_positions, 0, side='right')
+    values[lane.indices[:first]] = lane.values[:first]
+    layout.apply(values)
+
+    boundaries = np.unique(change_positions[(change_positions > 0) & (change_positions < num_samples)])
+    segment_starts = np.concatenate(([0], boundaries)).tolist()
+    segment_ends = np.concatenate((boundaries, [num_samples])).tolist()
+
+    output = np.zeros((num_channels, num_samples), dtype=np.float32)
+    for segment_start, segment_end in zip(segment_starts, segment_ends):
+        if segment_start:
+            changes = slice(
+                np.searchsorted(change_positions, segment_start, side='left'),
+                np.searchsorted(change_positions, segment_start, side='right'),
+            )
+            # Applied in order, so a parameter changed more than once at the same position ends on its last value
+            for index, value in zip(lane.indices[changes].tolist(), lane.values[changes].tolist()):
+                values[index] = value
+            layout.apply(values, indices=np.unique(lane.indices[changes]).tolist())
+        segment = render_midi_segment(
+            plugin,
+            midi_events,
+            event_positions,
+            segment_start,
+            segment_end - segment_start,
+            sample_rate,
+            num_channels,
+            buffer_size=buffer_size,
+            reset=reset and segment_start == 0,
+        )
+        output[:, segment_start:segment_start + segment.shape[-1]] = segment[:, :segment_end - segment_start]
+    return output
+
+
+def _sweep(plugin, key, seconds, stop):
+    # Move a parameter back and forth from another thread, eg. to test recording without a GUI
+    low, high = 0.0, 1.0
+    started = time.perf_counter()
+    while not stop.is_set():
+        phase = ((time.perf_counter() - started) / seconds) % 1.0
+        setattr(plugin, key, low + (high - low) * (1.0 - abs(2.0 * phase - 1.0)))
+        time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a plugin's parameter automation, and replay it into a render.")
+    parser.add_argument('lane_path', help="The .npz automation lane file to write.")
+    parser.add_argument(
+        '--plugin',
+        default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
+        help="Plugin path, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Samples per second. [Default: %(default)s]")
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="Ring buffer size. [Default: %(default)s]")
+    parser.add_argument('--show-editor', action='store_true', help="Record while the plugin's editor is shown.")
+    parser.add_argument(
+        '--sweep',
+        default=None,
+        help="Instead of showing the editor, record a parameter (attribute) being swept from another thread.",
+    )
+    parser.add_argument('--seconds', type=float, default=2.0, help="How long to record a --sweep for. [Default: %(default)s]")
+    parser.add_argument('--render', default=None, help="Also replay the lane into a render, written to this audio file.")
+    parser.add_argument('--midi', default=None, help="MIDI file to render. [Default: a middle C held for the lane]")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="[Default: %(default)s]")
+    parser.add_argument('--num-channels', type=int, default=2, help="[Default: %(default)s]")
+    args = parser.parse_args()
+
+    if not args.show_editor and not args.sweep:
+        parser.error("one of --show-editor or --sweep is required")
+
+    from helpers import load_plugin_from_spec
+    from rendering import load_midi, note_events
+
+    plugin = load_plugin_from_spec(args.plugin)
+    with AutomationRecorder(plugin, rate=args.rate, capacity=args.capacity) as recorder:
+        if args.show_editor:
+            plugin.show_editor()
+        else:
+            stop = threading.Event()
+            sweeper = threading.Thread(target=_sweep, args=(plugin, args.sweep, args.seconds / 2, stop), daemon=True)
+            sweeper.start()
+            time.sleep(args.seconds)
+            stop.set()
+            sweeper.join()
+
+    lane = recorder.lane()
+    lane.save(args.lane_path)
+    stats = recorder.stats()
+    print(
+        f"Recorded {len(lane)} changes over {lane.duration:.2f}s to {args.lane_path} "
+        f"({stats['samples']} samples, {stats['late_samples']} late, {stats['dropped']} dropped, "
+        f"{stats['sample_seconds_mean'] * 1e6:.1f}us mean / {stats['sample_seconds_max'] * 1e6:.1f}us max per sample)"
+    )
+
+    if args.render:
+        from pedalboard.io import AudioFile
+
+        duration = max(lane.duration, 1.0)
+        midi_events = load_midi(args.midi) if args.midi else note_events([[60, 100, 0.0, duration]])
+        audio = render_with_automation(plugin, lane, midi_events, duration, args.sample_rate, args.num_channels)
+        with AudioFile(args.render, 'w', args.sample_rate, args.num_channels) as f:
+            f.write(audio)
+        print(f"Rendered {audio.shape[-1]} samples with the automation to {args.render}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Batch offline rendering of (preset, MIDI) jobs through a plugin, fanned out over a process pool.
+#
+# Each worker process loads the plugin once into a plugin_pool.PluginPool and reuses it for every job it is given,
+# with the pool restoring the plugin's initial state before each job so that presets don't leak between them. MIDI
+# files are compiled once per worker (and cached on disk across runs) by a midi_compiler.MidiCompiler, so clips that
+# are shared between jobs aren't re-parsed. With --render-cache-dir, renders are also memoized in a
+# render_cache.RenderCache (shared by every worker), so re-rendering the same preset, MIDI and render settings just
+# copies the cached audio to the job's output.
+#
+# The manifest is a JSON Lines file with one job per line, eg.
+#   {"id": "pluck-c4", "preset": "presets/pluck.bin", "midi": "clips/c4.mid", "duration": 2.0}
+#   {"id": "pad-chord", "midi": [[60, 100, 0.0, 1.5], [64, 100, 0.0, 1.5]], "output": "renders/pad-chord.wav"}
+#
+#   midi:     a path to a .mid file, or a list of [note, velocity, start_seconds, end_seconds] notes
+#   preset:   optional; a raw_state .bin file, a parameter_presets.ParameterPreset (.json or .npz), or a .json dict of
+#             parameter names to values (see rendering.apply_preset)
+#   duration: optional; defaults to --duration
+#   output:   optional; defaults to <--output-dir>/<id>.wav
+#
+# Example usage:
+#   python batch_render.py jobs.jsonl --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --workers 8
+#   python batch_render.py jobs.jsonl --plugin builtin:Reverb --no-midi-cache
+#   python batch_render.py jobs.jsonl --plugin builtin:Reverb --render-cache-dir ~/.cache/poc-audio-pedalboard/renders
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from midi_compiler import DEFAULT_CACHE_DIR as DEFAULT_MIDI_CACHE_DIR, MidiCompiler
+from plugin_pool import PluginPool
+from rendering import load_midi, apply_preset, render_midi, render_midi_to_file
+
+# Per-worker process state, set up once by _init_worker
+_worker = {}
+
+
+def read_manifest(manifest_path):
+    """
+    Read the render jobs from a JSON Lines manifest.
+
+    Args:
+      manifest_path (str): The path to the manifest file.
+
+    Returns:
+      list: The job dicts, each with an 'id' (defaulting to its line number).
+    """
+    jobs = []
+    with open(manifest_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            job = json.loads(line)
+            job.setdefault('id', str(line_number))
+            jobs.append(job)
+    return jobs
+
+
+def _init_worker(plugin_spec, plugin_name, render_options):
+    pool = PluginPool(max_idle_per_key=1)
+    pool.preload(plugin_spec, plugin_name)
+    _worker['pool'] = pool
+    _worker['plugin_key'] = (plugin_spec, plugin_name)
+    _worker['render_options'] = render_options
+    _worker['midi_compiler'] = MidiCompiler(cache_dir=render_options['midi_cache_dir'])
+    if render_options['render_cache_dir']:
+        from render_cache import RenderCache
+
+        _worker['render_cache'] = RenderCache(render_options['render_cache_dir'])
+
+
+def _render_job(job):
+    options = _worker['render_options']
+    started = time.perf_counter()
+    result = {'id': job['id'], 'pid': os.getpid()}
+    try:
+        with _worker['pool'].checkout(*_worker['plugin_key']) as plugin:
+            output_path, num_samples = _render_job_with(plugin, job, options)
+        result.update(status='ok', output=output_path, num_samples=num_samples)
+    except Exception as e:
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def _load_job_midi(midi, sample_rate):
+    if isinstance(midi, str) and 'midi_compiler' in _worker:
+        return _worker['midi_compiler'].compile(midi, sample_rate).to_midi_events()
+    return load_midi(midi)
+
+
+def _render_job_with(plugin, job, options):
+    if job.get('preset'):
+        apply_preset(plugin, job['preset'])
+
+    output_path = job.get('output') or os.path.join(options['output_dir'], f"{job['id']}.wav")
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    render_args = dict(
+        duration=job.get('duration', options['duration']),
+        sample_rate=options['sample_rate'],
+        num_channels=options['num_channels'],
+        buffer_size=options['buffer_size'],
+    )
+    midi_events = _load_job_midi(job['midi'], options['sample_rate'])
+    if options['block_size']:
+        num_samples = render_midi_to_file(
+            plugin,
+            midi_events,
+            output_path,
+            block_size=options['block_size'],
+            **render_args
+        )
+    elif 'render_cache' in _worker:
+        audio = _worker['render_cache'].render(plugin, midi_events, plugin_spec=_worker['plugin_key'][0], **render_args)
+        _write_audio(output_path, audio, options['sample_rate'])
+        num_samples = audio.shape[-1]
+    else:
+        audio = render_midi(plugin, midi_events, **render_args)
+        _write_audio(output_path, audio, options['sample_rate'])
+        num_samples = audio.shape[-1]
+
+    return output_path, num_samples
+
+
+def _write_audio(output_path, audio, sample_rate):
+    from pedalboard.io import AudioFile
+
+    with AudioFile(output_path, 'w', sample_rate, audio.shape[0]) as f:
+        f.write(audio)
+
+
+def batch_render(
+    jobs,
+    plugin_spec,
+    plugin_name=None,
+    output_dir='renders',
+    results_path=None,
+    workers=None,
+    duration=1.0,
+    sample_rate=44100,
+    num_channels=2,
+    buffer_size=8192,
+    block_size=None,
+    chunksize=1,
+    midi_cache_dir=DEFAULT_MIDI_CACHE_DIR,
+    render_cache_dir=None,
+):
+    """
+    Render a batch of jobs over a pool of worker processes, each of which loads the plugin once.
+
+    Results are yielded (and optionally streamed to a JSON Lines results file) as each job completes.
+
+    Args:
+      jobs (list): The job dicts, as returned by read_manifest.
+      plugin_spec (str): The plugin path or 'builtin:<Name>' spec (see helpers.load_plugin_from_spec).
+      plugin_name (str, optional): The plugin name to load from a plugin file containing multiple plugins.
+      output_dir (str): The directory to write renders to for jobs without an explicit 'output'.
+      results_path (str, optional): A JSON Lines file to append each job's result to.
+      workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+      duration (float): The default render duration in seconds.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      buffer_size (int): The buffer size the plugin processes audio in.
+      block_size (int, optional): If set, stream each render to disk in blocks of this many samples (a multiple of
+        buffer_size) rather than rendering it in one go (see rendering.render_midi_to_file).
+      chunksize (int): The number of jobs handed to a worker at a time.
+      midi_cache_dir (str, optional): The directory to cache compiled MIDI files in. None disables the disk cache.
+      render_cache_dir (str, optional): If set, memoize renders in a render_cache.RenderCache in this directory (not
+        used with block_size).
+
+    Yields:
+      dict: The result of each job, in completion order.
+    """
+    render_options = {
+        'output_dir': output_dir,
+        'duration': duration,
+        'sample_rate': sample_rate,
+        'num_channels': num_channels,
+        'buffer_size': buffer_size,
+        'block_size': block_size,
+        'midi_cache_dir': midi_cache_dir,
+        'render_cache_dir': render_cache_dir,
+    }
+    workers = workers or os.cpu_count() or 1
+
+    results_file = open(results_path, 'a') if results_path else None
+    try:
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(plugin_spec, plugin_name, render_options),
+        ) as pool:
+            for result in pool.imap_unordered(_render_job, jobs, chunksize=chunksize):
+                if results_file:
+                    results_file.write(json.dumps(result) + '\n')
+                    results_file.flush()
+                yield result
+    finally:
+        if results_file:
+            results_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch render (preset, MIDI) jobs through a plugin.")
+    parser.add_argument('manifest', help="JSON Lines file with one render job per line.")
+    parser.add_argument(
+        '--plugin',
+        default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
+        help="Plugin path, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
+    parser.add_argument('--plugin-name', default=None, help="Plugin name within a multi-plugin file.")
+    parser.add_argument('--output-dir', default='renders', help="Output directory. [Default: %(default)s]")
+    parser.add_argument(
+        '--results',
+        default=None,
+        help="JSON Lines file to stream per-job results to. [Default: <output-dir>/results.jsonl]",
+    )
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes. [Default: CPU count]")
+    parser.add_argument('--duration', type=float, default=1.0, help="Default duration in seconds. [Default: %(default)s]")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="[Default: %(default)s]")
+    parser.add_argument('--num-channels', type=int, default=2, help="[Default: %(default)s]")
+    parser.add_argument('--buffer-size', type=int, default=8192, help="[Default: %(default)s]")
+    parser.add_argument(
+        '--block-size',
+        type=int,
+        default=None,
+        help="Stream renders to disk in blocks of this many samples, to bound memory use on long renders.",
+    )
+    parser.add_argument('--chunksize', type=int, default=1, help="Jobs per worker dispatch. [Default: %(default)s]")
+    parser.add_argument(
+        '--midi-cache-dir',
+        default=DEFAULT_MIDI_CACHE_DIR,
+        help="Directory to cache compiled MIDI files in. [Default: %(default)s]",
+    )
+    parser.add_argument('--no-midi-cache', action='store_true', help="Don't cache compiled MIDI files on disk.")
+    parser.add_argument(
+        '--render-cache-dir',
+        default=None,
+        help="Memoize renders in this directory, so repeated (preset, MIDI) jobs aren't rendered again. [Default: off]",
+    )
+    args = parser.parse_args()
+    if args.render_cache_dir and args.block_size:
+        parser.error("--render-cache-dir can't be used with --block-size")
+
+    jobs = read_manifest(args.manifest)
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = args.results or os.path.join(args.output_dir, 'results.jsonl')
+
+    print(f"Rendering {len(jobs)} jobs with {args.plugin} ({args.workers or os.cpu_count()} workers)..")
+    started = time.perf_counter()
+    num_ok = num_failed = 0
+    for result in batch_render(
+        jobs,
+        args.plugin,
+        plugin_name=args.plugin_name,
+        output_dir=args.output_dir,
+        results_path=results_path,
+        workers=args.workers,
+        duration=args.duration,
+        sample_rate=args.sample_rate,
+        num_channels=args.num_channels,
+        buffer_size=args.buffer_size,
+        block_size=args.block_size,
+        chunksize=args.chunksize,
+        midi_cache_dir=None if args.no_midi_cache else args.midi_cache_dir,
+        render_cache_dir=args.render_cache_dir,
+    ):
+        if result['status'] == 'ok':
+            num_ok += 1
+        else:
+            num_failed += 1
+            print(f"  Job {result['id']} failed: {result['error']}")
+    elapsed = time.perf_counter() - started
+
+    print(f"Rendered {num_ok} jobs ({num_failed} failed) in {elapsed:.2f}s")
+    print(f"  Throughput: {(num_ok + num_failed) / elapsed:.2f} renders/sec")
+    print(f"  Results written to {results_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# A repeatable benchmark suite for the plugin hot paths:
+#   - load_plugin
+#   - reading every parameter's value (per-key lookups, as in synth_vst_loader.py, vs. a ParameterSnapshot)
+#   - getting and setting raw_state (external plugins only)
+#   - writing every parameter's value (without show_editor)
+#   - rendering MIDI at different buffer sizes and durations
+#
+# Each benchmark runs some untimed warmup iterations, then reports percentiles over the timed ones, and the peak
+# Python memory allocated during one extra (separately traced) iteration. The process's max RSS (a peak since startup,
+# so not attributable to any one benchmark) is reported once for the whole suite. Results are saved as JSON, and can
+# be compared against an earlier results file to flag regressions.
+#
+# By default the suite runs against pedalboard's built-in plugins, so that it works on headless Linux.
+#
+# Example usage:
+#   python benchmarks.py --output bench-baseline.json
+#   python benchmarks.py --output bench-new.json --compare bench-baseline.json
+#   python benchmarks.py --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --repeat 50
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from helpers import load_plugin_from_spec
+from parameter_snapshot import ParameterLayout
+from profiling import max_rss_bytes
+from rendering import note_events, render_midi
+
+DEFAULT_PLUGINS = ['builtin:Reverb', 'builtin:Gain']
+DEFAULT_BUFFER_SIZES = [128, 512, 2048, 8192]
+DEFAULT_DURATIONS = [1.0, 5.0]
+SAMPLE_RATE = 44100
+NUM_CHANNELS = 2
+
+
+def _percentile(sorted_values, percent):
+    return float(np.percentile(sorted_values, percent))
+
+
+def _calibrate(fn, min_sample_seconds):
+    # Like timeit's autorange: the number of calls per timed sample, so that fast calls aren't lost in timer noise
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_sample_seconds:
+            return number
+        number *= 2
+
+
+def run_benchmark(fn, warmup=3, repeat=20, min_sample_seconds=0.005):
+    """
+    Time a function, after some warmup calls.
+
+    Args:
+      fn (callable): The function to benchmark (called with no arguments).
+      warmup (int): The number of untimed calls first.
+      repeat (int): The number of timed samples.
+      min_sample_seconds (float): Fast functions are called repeatedly within each sample, until it takes this long.
+
+    Returns:
+      dict: Per-call timing percentiles (in seconds), and the peak traced allocation of one call.
+    """
+    for _ in range(warmup):
+        fn()
+    number = _calibrate(fn, min_sample_seconds)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    timings.sort()
+
+    # Memory is traced in a separate call, so that tracemalloc's overhead doesn't skew the timings
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_allocated = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'number': number,
+        'min': timings[0],
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'p50': _percentile(timings, 50),
+        'p90': _percentile(timings, 90),
+        'p99': _percentile(timings, 99),
+        'max': timings[-1],
+        'peak_allocated_bytes': peak_allocated,
+    }
+
+
+def plugin_benchmarks(plugin_spec, buffer_sizes=DEFAULT_BUFFER_SIZES, durations=DEFAULT_DURATIONS):
+    """
+    Build the benchmarks for a plugin.
+
+    Returns:
+      list: (name, fn, repeat_scale) tuples, where repeat_scale scales down the repeats for the slow benchmarks.
+    """
+    plugin = load_plugin_from_spec(plugin_spec)
+    layout = ParameterLayout(plugin)
+    values = layout.capture().values
+    benchmarks = [
+        ('load_plugin', lambda: load_plugin_from_spec(plugin_spec), 1.0),
+        ('parameter_layout', lambda: ParameterLayout(plugin), 1.0),
+        ('parameters_snapshot', layout.capture, 1.0),
+        ('parameters_write_all', lambda: layout.apply(values), 1.0),
+    ]
+
+    if layout.is_external:
+        benchmarks.append((
+            'parameters_read_per_key',
+            lambda: {key: plugin.parameters[key].raw_value for key in plugin.parameters.keys()},
+            1.0,
+        ))
+        raw_state = plugin.raw_state
+        benchmarks.append(('raw_state_get', lambda: plugin.raw_state, 1.0))
+        benchmarks.append(('raw_state_set', lambda: setattr(plugin, 'raw_state', raw_state), 1.0))
+    else:
+        benchmarks.append(('parameters_read_per_key', lambda: {key: getattr(plugin, key) for key in layout.keys}, 1.0))
+
+    midi_events = note_events([[60, 100, 0.0, 0.5], [64, 100, 0.25, 0.75], [67, 100, 0.5, 1.0]])
+    for duration in durations:
+        for buffer_size in buffer_sizes:
+            benchmarks.append((
+                f"render_{duration:g}s_buffer_{buffer_size}",
+                lambda duration=duration, buffer_size=buffer_size: render_midi(
+                    plugin, midi_events, duration, SAMPLE_RATE, NUM_CHANNELS, buffer_size=buffer_size
+                ),
+                0.25,
+            ))
+    return benchmarks
+
+
+def run_suite(plugin_specs, warmup=3, repeat=20, buffer_sizes=DEFAULT_BUFFER_SIZES, durations=DEFAULT_DURATIONS):
+    """
+    Run every benchmark for each plugin.
+
+    Returns:
+      dict: The results, with 'meta' describing the environment (and the process's max RSS over the suite), and
+        'results' keyed by '<plugin>::<benchmark>'.
+    """
+    import pedalboard
+
+    results = {}
+    for plugin_spec in plugin_specs:
+        print(f"Benchmarking {plugin_spec}..")
+        for name, fn, repeat_scale in plugin_benchmarks(plugin_spec, buffer_sizes, durations):
+            result = run_benchmark(fn, warmup=warmup, repeat=max(3, int(repeat * repeat_scale)))
+            results[f"{plugin_spec}::{name}"] = result
+            print(
+                f"  {name:<32} p50 {result['p50'] * 1e6:11.1f}us  p90 {result['p90'] * 1e6:11.1f}us  "
+                f"p99 {result['p99'] * 1e6:11.1f}us  peak alloc {result['peak_allocated_bytes'] / 1024:9.1f}KiB"
+            )
+    print(f"Process max RSS: {max_rss_bytes() / 1024 ** 2:.1f}MiB")
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'pedalboard': getattr(pedalboard, '__version__', None),
+            'plugins': list(plugin_specs),
+            'warmup': warmup,
+            'repeat': repeat,
+            # The peak over the whole suite (and anything the process did before it)
+            'process_max_rss_bytes': max_rss_bytes(),
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.1, metric='p50'):
+    """
+    Compare two sets of results, flagging benchmarks that got slower by more than a threshold.
+
+    Args:
+      baseline (dict): The earlier results (as returned by run_suite).
+      current (dict): The new results.
+      threshold (float): The relative slowdown that counts as a regression (eg. 0.1 for 10%).
+      metric (str): The timing to compare.
+
+    Returns:
+      list: (name, baseline_seconds, current_seconds, relative_change, is_regression) tuples for the common benchmarks.
+    """
+    comparisons = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name][metric]
+        after = result[metric]
+        change = (after - before) / before if before else 0.0
+        comparisons.append((name, before, after, change, change > threshold))
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plugin hot paths.")
+    parser.add_argument(
+        '--plugin',
+        action='append',
+        default=None,
+        help="Plugin path or 'builtin:<Name>' to benchmark (may be repeated). [Default: %s]" % ', '.join(DEFAULT_PLUGINS),
+    )
+    parser.add_argument('--warmup', type=int, default=3, help="Untimed iterations per benchmark. [Default: %(default)s]")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed iterations per benchmark. [Default: %(default)s]")
+    parser.add_argument('--buffer-sizes', type=int, nargs='+', default=DEFAULT_BUFFER_SIZES)
+    parser.add_argument('--durations', type=float, nargs='+', default=DEFAULT_DURATIONS)
+    parser.add_argument('--output', default=None, help="JSON file to save the results to.")
+    parser.add_argument('--compare', default=None, help="Earlier results JSON file to compare against.")
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help="Relative p50 slowdown flagged as a regression. [Default: %(default)s]",
+    )
+    args = parser.parse_args()
+
+    results = run_suite(
+        args.plugin or DEFAULT_PLUGINS,
+        warmup=args.warmup,
+        repeat=args.repeat,
+        buffer_sizes=args.buffer_sizes,
+        durations=args.durations,
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparisons = compare_results(baseline, results, threshold=args.threshold)
+        regressions = [comparison for comparison in comparisons if comparison[4]]
+        print(f"Compared against {args.compare} (p50, threshold {args.threshold:.0%}):")
+        for name, before, after, change, is_regression in comparisons:
+            flag = 'REGRESSION' if is_regression else ''
+            print(f"  {name:<56} {before * 1e6:11.1f}us -> {after * 1e6:11.1f}us  {change:+7.1%}  {flag}")
+        if regressions:
+            print(f"{len(regressions)} regression(s) found.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
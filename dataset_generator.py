@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+# A resumable, sharded generator of (synth parameters, rendered audio) datasets, eg. for AI patch generation:
+#   https://gist.github.com/0xdevalias/5a06349b376d01b2a76ad27a86b08c1b#generating-synth-patches-with-ai
+#
+# Each example samples a random value for every parameter, applies them to the plugin, and renders a MIDI phrase.
+# External plugins' parameters are sampled over their full raw (0..1) range, and built-in plugins' over the ranges in
+# helpers.BUILTIN_PARAMETER_RANGES, unless a --range is given.
+# Examples are grouped into fixed-size shards, which are generated over a process pool (each worker keeps its plugin
+# warm in a plugin_pool.PluginPool) and written as .npz files holding:
+#   audio:    float32 (examples, channels, samples)
+#   params:   float32 (examples, parameters), in the order of manifest.json's 'parameter_keys'
+#   examples: int64 (examples,), the global example indices
+#
+# An example whose parameters can't be applied, or that fails to render, is left silent and recorded (with its error)
+# in its shard's 'failed' list in manifest.json, rather than stopping the run.
+#
+# Every shard's random parameters are derived from (seed, shard index), so shards are reproducible on their own.
+# manifest.json records the config and every completed shard, so a crashed run that is started again with the same
+# arguments only generates the shards that are missing. Throughput (examples/sec) is recorded for every run, and
+# --scaling measures how it scales with the number of worker processes.
+#
+# Example usage:
+#   python dataset_generator.py dataset --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --num-examples 1000000
+#   python dataset_generator.py dataset --plugin builtin:Reverb --num-examples 2000 --shard-size 100
+#   python dataset_generator.py --plugin builtin:Reverb --scaling 1,2,4,8
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from parameter_snapshot import ParameterLayout
+from plugin_pool import PluginPool
+from rendering import load_midi, render_midi
+
+MANIFEST_VERSION = 1
+
+# The MIDI phrase rendered for every example unless --midi is given: a C major triad, then a held C5
+DEFAULT_PHRASE = [[60, 100, 0.0, 0.5], [64, 100, 0.0, 0.5], [67, 100, 0.0, 0.5], [72, 100, 0.5, 1.5]]
+
+# Per-worker process state, set up once by _init_worker
+_worker = {}
+
+
+def _config_from_args(args):
+    return {
+        'plugin': args.plugin,
+        'plugin_name': args.plugin_name,
+        'parameter_keys': args.params,
+        'parameter_ranges': dict(_parse_range(r) for r in args.range),
+        'midi': args.midi or DEFAULT_PHRASE,
+        'duration': args.duration,
+        'sample_rate': args.sample_rate,
+        'num_channels': args.num_channels,
+        'num_examples': args.num_examples,
+        'shard_size': args.shard_size,
+        'seed': args.seed,
+    }
+
+
+def _parse_range(parameter_range):
+    # key=low:high
+    key, _, bounds = parameter_range.partition('=')
+    low, _, high = bounds.partition(':')
+    return key, [float(low), float(high)]
+
+
+def _init_worker(config):
+    pool = PluginPool(max_idle_per_key=1)
+    pool.preload(config['plugin'], config['plugin_name'])
+    _worker['pool'] = pool
+    _worker['config'] = config
+    _worker['midi_events'] = load_midi(config['midi'])
+
+
+def _parameter_bounds(config, layout):
+    # The full raw range for external plugins' parameters, and the known (or --range) ranges for built-in plugins'
+    from helpers import get_builtin_parameter_range
+
+    low = np.zeros(len(layout), dtype=np.float32)
+    high = np.ones(len(layout), dtype=np.float32)
+    unknown = []
+    for i, key in enumerate(layout.keys):
+        bounds = config['parameter_ranges'].get(key)
+        if bounds is None and not layout.is_external:
+            bounds = get_builtin_parameter_range(layout.plugin, key)
+            if bounds is None:
+                unknown.append(key)
+                continue
+        if bounds is not None:
+            low[i], high[i] = bounds
+    if unknown:
+        raise ValueError(
+            f"The value ranges of {type(layout.plugin).__name__}'s {unknown} aren't known. Pass a --range for each."
+        )
+    return low, high
+
+
+def _generate_shard(task):
+    shard_index, shard_path = task
+    config = _worker['config']
+    started = time.perf_counter()
+
+    first_example = shard_index * config['shard_size']
+    num_examples = min(config['shard_size'], config['num_examples'] - first_example)
+    num_samples = int(config['duration'] * config['sample_rate'])
+
+    with _worker['pool'].checkout(config['plugin'], config['plugin_name']) as plugin:
+        layout = ParameterLayout(plugin, config['parameter_keys'])
+        low, high = _parameter_bounds(config, layout)
+        rng = np.random.default_rng([config['seed'], shard_index])
+        params = rng.uniform(low, high, size=(num_examples, len(layout))).astype(np.float32)
+        audio = np.zeros((num_examples, config['num_channels'], num_samples), dtype=np.float32)
+
+        failed = []
+        for i in range(num_examples):
+            try:
+                layout.apply(params[i])
+                rendered = render_midi(
+                    plugin,
+                    _worker['midi_events'],
+                    duration=config['duration'],
+                    sample_rate=config['sample_rate'],
+                    num_channels=config['num_channels'],
+                )
+            except Exception as e:
+                # Left silent, and recorded in the manifest
+                failed.append({'example': first_example + i, 'error': f"{type(e).__name__}: {e}"})
+                continue
+            audio[i, :, :rendered.shape[-1]] = rendered[:, :num_samples]
+
+    # Written to a temporary file first, so that a crash never leaves a partial shard behind
+    temp_path = f"{shard_path}.tmp.npz"
+    np.savez(temp_path, audio=audio, params=params, examples=np.arange(first_example, first_example + num_examples))
+    os.replace(temp_path, shard_path)
+
+    return {
+        'shard': shard_index,
+        'file': os.path.basename(shard_path),
+        'num_examples': num_examples,
+        'failed': failed,
+        'seconds': time.perf_counter() - started,
+        'pid': os.getpid(),
+    }
+
+
+def _write_manifest(manifest_path, manifest):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def _resolve_parameter_keys(config):
+    # Resolve (and record) the parameter keys up front, so that every shard uses the same columns
+    from helpers import load_plugin_from_spec
+
+    plugin = load_plugin_from_spec(config['plugin'], plugin_name=config['plugin_name'])
+    layout = ParameterLayout(plugin, config['parameter_keys'])
+    # Checked here too, so that missing ranges fail before any worker is started
+    _parameter_bounds(config, layout)
+    return list(layout.keys)
+
+
+def generate_dataset(output_dir, config, workers=None, force=False):
+    """
+    Generate (or resume generating) a sharded dataset.
+
+    Args:
+      output_dir (str): The directory the shards and manifest.json are written to.
+      config (dict): The dataset config (see _config_from_args).
+      workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+      force (bool): Start over if output_dir holds a dataset with a different config.
+
+    Returns:
+      dict: The throughput of this run: examples and shards generated, seconds, workers and examples/sec.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        previous_config = dict(manifest['config'])
+        if config['parameter_keys'] is None:
+            # The recorded keys were resolved from the plugin when the dataset was started
+            previous_config['parameter_keys'] = None
+        if manifest.get('version') != MANIFEST_VERSION or previous_config != config:
+            if not force:
+                raise ValueError(f"{output_dir} holds a dataset with a different config. Use --force to start over.")
+            manifest = None
+    if manifest is None:
+        config = dict(config, parameter_keys=_resolve_parameter_keys(config))
+        manifest = {'version': MANIFEST_VERSION, 'config': config, 'shards': {}, 'runs': []}
+        _write_manifest(manifest_path, manifest)
+    config = manifest['config']
+
+    num_shards = -(-config['num_examples'] // config['shard_size'])
+    pending = [
+        (shard_index, os.path.join(output_dir, f"shard-{shard_index:06d}.npz"))
+        for shard_index in range(num_shards)
+        if not (
+            str(shard_index) in manifest['shards']
+            and os.path.exists(os.path.join(output_dir, manifest['shards'][str(shard_index)]['file']))
+        )
+    ]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending) or 1))
+
+    print(f"Generating {len(pending)} of {num_shards} shards with {workers} workers..")
+    started = time.perf_counter()
+    num_examples = 0
+    if pending:
+        with multiprocessing.Pool(processes=workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for shard in pool.imap_unordered(_generate_shard, pending):
+                num_examples += shard['num_examples']
+                manifest['shards'][str(shard['shard'])] = shard
+                _write_manifest(manifest_path, manifest)
+                elapsed = time.perf_counter() - started
+                failed = f", {len(shard['failed'])} failed (eg. {shard['failed'][0]['error']})" if shard['failed'] else ''
+                print(
+                    f"  Shard {shard['shard']} done ({len(manifest['shards'])}/{num_shards}), "
+                    f"{num_examples / elapsed:.1f} examples/sec{failed}"
+                )
+    elapsed = time.perf_counter() - started
+
+    run = {
+        'started': time.time() - elapsed,
+        'workers': workers,
+        'num_shards': len(pending),
+        'num_examples': num_examples,
+        'seconds': elapsed,
+        'examples_per_second': num_examples / elapsed if elapsed else 0.0,
+    }
+    manifest['runs'].append(run)
+    _write_manifest(manifest_path, manifest)
+    return run
+
+
+def measure_scaling(config, worker_counts, num_shards=None):
+    """
+    Measure how dataset generation throughput scales with the number of worker processes.
+
+    Each worker count generates the same shards from scratch into a temporary directory.
+
+    Args:
+      config (dict): The dataset config (see _config_from_args).
+      worker_counts (list): The worker counts to measure.
+      num_shards (int, optional): The number of shards to generate per measurement. Defaults to twice the largest
+        worker count.
+
+    Returns:
+      list: One dict per worker count with its examples/sec, speedup and parallel efficiency relative to the first.
+    """
+    num_shards = num_shards or 2 * max(worker_counts)
+    config = dict(config, num_examples=num_shards * config['shard_size'])
+    results = []
+    for workers in worker_counts:
+        output_dir = tempfile.mkdtemp(prefix='dataset-scaling-')
+        try:
+            run = generate_dataset(output_dir, config, workers=workers)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        baseline = results[0] if results else None
+        speedup = run['examples_per_second'] / baseline['examples_per_second'] if baseline else 1.0
+        results.append({
+            'workers': workers,
+            'examples_per_second': run['examples_per_second'],
+            'speedup': speedup,
+            'efficiency': speedup * (baseline['workers'] if baseline else workers) / workers,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a sharded (synth parameters, rendered audio) dataset.")
+    parser.add_argument(
+        'output_dir',
+        nargs='?',
+        help="Dataset directory (re-run with the same arguments to resume). Not needed with --scaling.",
+    )
+    parser.add_argument(
+        '--plugin',
+        default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
+        help="Plugin path, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
+    parser.add_argument('--plugin-name', default=None, help="Plugin name within a multi-plugin file.")
+    parser.add_argument('--params', nargs='+', default=None, help="Parameter keys to sample. [Default: all]")
+    parser.add_argument(
+        '--range',
+        action='append',
+        default=[],
+        help="Sampling range for a parameter as key=low:high (may be repeated). [Default: the full raw range (0:1) for "
+        "external plugins, and helpers.BUILTIN_PARAMETER_RANGES for built-in plugins]",
+    )
+    parser.add_argument('--midi', default=None, help="MIDI file to render for each example. [Default: a short phrase]")
+    parser.add_argument('--duration', type=float, default=2.0, help="[Default: %(default)s]")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="[Default: %(default)s]")
+    parser.add_argument('--num-channels', type=int, default=2, help="[Default: %(default)s]")
+    parser.add_argument('--num-examples', type=int, default=1000, help="[Default: %(default)s]")
+    parser.add_argument('--shard-size', type=int, default=256, help="Examples per shard. [Default: %(default)s]")
+    parser.add_argument('--seed', type=int, default=0, help="[Default: %(default)s]")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes. [Default: CPU count]")
+    parser.add_argument('--force', action='store_true', help="Start over if the config has changed.")
+    parser.add_argument(
+        '--scaling',
+        default=None,
+        help="Instead of generating the dataset, measure throughput for these worker counts (eg. 1,2,4,8).",
+    )
+    args = parser.parse_args()
+
+    config = _config_from_args(args)
+    if args.scaling:
+        print(f"{'workers':>8} {'examples/sec':>14} {'speedup':>8} {'efficiency':>11}")
+        for result in measure_scaling(config, [int(workers) for workers in args.scaling.split(',')]):
+            print(
+                f"{result['workers']:>8} {result['examples_per_second']:>14.1f} "
+                f"{result['speedup']:>8.2f} {result['efficiency']:>10.0%}"
+            )
+        return
+
+    if not args.output_dir:
+        parser.error("the output_dir argument is required (unless --scaling is given)")
+    run = generate_dataset(args.output_dir, config, workers=args.workers, force=args.force)
+    print(
+        f"Generated {run['num_examples']} examples in {run['seconds']:.2f}s with {run['workers']} workers: "
+        f"{run['examples_per_second']:.1f} examples/sec"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,15 @@
 from pprint import pprint, pformat
 
-from pedalboard import load_plugin, VST3Plugin, AudioUnitPlugin
+import pedalboard
+from pedalboard import load_plugin, VST3Plugin
+
+try:
+    from pedalboard import AudioUnitPlugin
+except ImportError:
+    # AudioUnit plugins are only supported on macOS
+    AudioUnitPlugin = None
+
+BUILTIN_PLUGIN_PREFIX = 'builtin:'
 
 
 def pprint_with_indent(data, indent=4):
@@ -11,23 +20,36 @@ def pprint_with_indent(data, indent=4):
 
 # Filter the locally installed audio plugins by the provided names
 #
+# If a plugin_index.PluginIndex is provided, it is queried instead of enumerating the installed plugins from scratch.
+#
 # Example usage:
 #   filter_installed_plugins_by_names(
 #     ['Vital', 'Serum']
 #    )
-def filter_installed_plugins_by_names(filters):
+def filter_installed_plugins_by_names(filters, plugin_index=None):
     print("Showing installed VST/AU plugins, filtered by names:")
 
-    plugins_filter = {name.lower() for name in filters}
-    filtered_vst3_plugins = [
-        plugin_path for plugin_path in VST3Plugin.installed_plugins
-        if any(plugin_name in plugin_path.lower() for plugin_name in plugins_filter)
-    ]
+    if plugin_index is not None:
+        # The filters match anywhere in a plugin's path (as below), which the index's sorted name lookup can't answer,
+        # so this scans the indexed plugins (O(n), but without walking the plugin directories)
+        def filter_plugins(plugin_format):
+            return sorted({
+                entry['path'] for name in filters for entry in plugin_index.search(name, plugin_format=plugin_format)
+            })
+
+        filtered_vst3_plugins = filter_plugins('VST3')
+        filtered_au_plugins = filter_plugins('AudioUnit')
+    else:
+        plugins_filter = {name.lower() for name in filters}
+        filtered_vst3_plugins = [
+            plugin_path for plugin_path in VST3Plugin.installed_plugins
+            if any(plugin_name in plugin_path.lower() for plugin_name in plugins_filter)
+        ]
 
-    filtered_au_plugins = [
-        plugin_path for plugin_path in AudioUnitPlugin.installed_plugins
-        if any(plugin_name in plugin_path.lower() for plugin_name in plugins_filter)
-    ]
+        filtered_au_plugins = [
+            plugin_path for plugin_path in (AudioUnitPlugin.installed_plugins if AudioUnitPlugin else [])
+            if any(plugin_name in plugin_path.lower() for plugin_name in plugins_filter)
+        ]
 
     print(f"Plugin filters: {filters}")
 
@@ -67,6 +89,32 @@ def compare_plugin_parameters(vst3_path, au_path):
     print("  Parameters in both:", in_both)
 
 
+# The properties of an AudioProcessorParameter, as shown by print_parameter_properties (and recorded by
+# schema_extractor.py)
+PARAMETER_PROPERTIES = [
+    'index',
+    'name',
+    'python_name',
+    'string_value',
+    'raw_value',
+    'default_raw_value',
+    'range',
+    'max_value',
+    'min_value',
+    'step_size',
+    'approximate_step_size',
+    'num_steps',
+    'type',
+    'units',
+    'label',
+    'is_discrete',
+    'is_boolean',
+    'is_orientation_inverted',
+    'is_automatable',
+    'is_meta_parameter',
+]
+
+
 # Example usage:
 # Assuming synth_plugin.parameters['verb_wet'] is your parameter:
 #   verb_wet = synth_plugin.parameters['verb_wet']
@@ -80,32 +128,8 @@ def print_parameter_properties(parameter):
 
     See: https://github.com/spotify/pedalboard/blob/f2c2ccd64e78abaf9b87bc2c59097965c8b92fe5/pedalboard/ExternalPlugin.h#L1307-L1310
     """
-    # List of property names to display
-    properties = [
-        'index',
-        'name',
-        'python_name',
-        'string_value',
-        'raw_value',
-        'default_raw_value',
-        'range',
-        'max_value',
-        'min_value',
-        'step_size',
-        'approximate_step_size',
-        'num_steps',
-        'type',
-        'units',
-        'label',
-        'is_discrete',
-        'is_boolean',
-        'is_orientation_inverted',
-        'is_automatable',
-        'is_meta_parameter',
-    ]
-
     # Iterate over the property names
-    for property_name in properties:
+    for property_name in PARAMETER_PROPERTIES:
         try:
             # Access the property value
             property_value = getattr(parameter, property_name)
@@ -144,12 +168,146 @@ def extract_vst3_xml(raw_state):
 
     Returns:
       str or None: The extracted XML content if valid, otherwise None.
+
+    See also: vst3_state.iter_vst3_xml_parameters, to parse the XML without decoding it to a str.
     """
     if is_vst3_xml(raw_state):
         try:
-            # Extract the bytes between the 8-byte header and the null byte
-            xml_part = raw_state[8:-1].decode('utf-8')
+            # Decode the bytes between the 8-byte header and the null byte (via a memoryview, to avoid copying them first)
+            xml_part = str(memoryview(raw_state)[8:-1], 'utf-8')
             return xml_part
         except UnicodeDecodeError:
             pass
     return None
+
+
+# Load a plugin from a path, or one of pedalboard's built-in plugins via a 'builtin:<Name>' spec
+#
+# The built-in plugins make it possible to stand in for a real synth when no VST3/AU is available (eg. on headless Linux)
+#
+# Example usage:
+#   load_plugin_from_spec("/Library/Audio/Plug-Ins/VST3/Vital.vst3")
+#   load_plugin_from_spec("builtin:Reverb")
+def load_plugin_from_spec(plugin_spec, plugin_name=None):
+    """
+    Load a plugin from either a plugin path or a 'builtin:<Name>' spec.
+
+    Args:
+      plugin_spec (str): The plugin file path, or 'builtin:' followed by the name of a pedalboard plugin class.
+      plugin_name (str, optional): The plugin name to load from a plugin file containing multiple plugins.
+
+    Returns:
+      pedalboard.Plugin: The loaded plugin instance.
+    """
+    if plugin_spec.startswith(BUILTIN_PLUGIN_PREFIX):
+        class_name = plugin_spec[len(BUILTIN_PLUGIN_PREFIX):]
+        plugin_class = getattr(pedalboard, class_name, None)
+        if not isinstance(plugin_class, type) or not issubclass(plugin_class, pedalboard.Plugin):
+            raise ValueError(f"Unknown built-in pedalboard plugin: {class_name}")
+        return plugin_class()
+    return load_plugin(plugin_spec, plugin_name=plugin_name)
+
+
+# Useful (and valid) value ranges for the numeric properties of built-in pedalboard plugins, which (unlike external
+# plugins' parameters) don't expose their ranges. Some are bounded further than the plugin would accept, eg. cutoff
+# frequencies to the audible range.
+BUILTIN_PARAMETER_RANGES = {
+    'Bitcrush': {'bit_depth': (1.0, 16.0)},
+    'Chorus': {
+        'centre_delay_ms': (1.0, 30.0), 'depth': (0.0, 1.0), 'feedback': (0.0, 0.9), 'mix': (0.0, 1.0),
+        'rate_hz': (0.1, 10.0),
+    },
+    'Clipping': {'threshold_db': (-60.0, 0.0)},
+    'Compressor': {
+        'attack_ms': (0.1, 100.0), 'ratio': (1.0, 20.0), 'release_ms': (10.0, 1000.0), 'threshold_db': (-60.0, 0.0),
+    },
+    'Delay': {'delay_seconds': (0.0, 2.0), 'feedback': (0.0, 0.9), 'mix': (0.0, 1.0)},
+    'Distortion': {'drive_db': (0.0, 40.0)},
+    'Gain': {'gain_db': (-24.0, 24.0)},
+    'HighpassFilter': {'cutoff_frequency_hz': (20.0, 20000.0)},
+    'HighShelfFilter': {'cutoff_frequency_hz': (20.0, 20000.0), 'gain_db': (-24.0, 24.0), 'q': (0.1, 10.0)},
+    'LadderFilter': {'cutoff_hz': (20.0, 20000.0), 'drive': (1.0, 10.0), 'resonance': (0.0, 1.0)},
+    'Limiter': {'release_ms': (10.0, 1000.0), 'threshold_db': (-60.0, 0.0)},
+    'LowpassFilter': {'cutoff_frequency_hz': (20.0, 20000.0)},
+    'LowShelfFilter': {'cutoff_frequency_hz': (20.0, 20000.0), 'gain_db': (-24.0, 24.0), 'q': (0.1, 10.0)},
+    'MP3Compressor': {'vbr_quality': (0.0, 9.9)},
+    'NoiseGate': {
+        'attack_ms': (0.1, 100.0), 'ratio': (1.0, 20.0), 'release_ms': (10.0, 1000.0), 'threshold_db': (-100.0, 0.0),
+    },
+    'PeakFilter': {'cutoff_frequency_hz': (20.0, 20000.0), 'gain_db': (-24.0, 24.0), 'q': (0.1, 10.0)},
+    'Phaser': {
+        'centre_frequency_hz': (100.0, 5000.0), 'depth': (0.0, 1.0), 'feedback': (0.0, 0.9), 'mix': (0.0, 1.0),
+        'rate_hz': (0.1, 10.0),
+    },
+    'PitchShift': {'semitones': (-12.0, 12.0)},
+    'Resample': {'target_sample_rate': (8000.0, 48000.0)},
+    'Reverb': {
+        'damping': (0.0, 1.0), 'dry_level': (0.0, 1.0), 'freeze_mode': (0.0, 1.0), 'room_size': (0.0, 1.0),
+        'wet_level': (0.0, 1.0), 'width': (0.0, 1.0),
+    },
+}
+
+
+def get_builtin_parameter_range(plugin, name):
+    """
+    Get the value range of a built-in pedalboard plugin's parameter (property).
+
+    Args:
+      plugin (pedalboard.Plugin): The built-in plugin instance.
+      name (str): The parameter (property) name.
+
+    Returns:
+      tuple or None: (low, high), or None if the range isn't known.
+    """
+    return BUILTIN_PARAMETER_RANGES.get(type(plugin).__name__, {}).get(name)
+
+
+def get_builtin_parameter_names(plugin):
+    """
+    List the numeric parameters exposed as properties by a built-in pedalboard plugin.
+
+    Args:
+      plugin (pedalboard.Plugin): The built-in plugin instance.
+
+    Returns:
+      list: The sorted parameter (property) names.
+    """
+    return sorted(
+        name for name, value in vars(type(plugin)).items()
+        if isinstance(value, property)
+        and name not in ('is_effect', 'is_instrument')
+        and isinstance(getattr(plugin, name), (int, float))
+    )
+
+
+def capture_plugin_state(plugin):
+    """
+    Capture the state of a plugin so that it can be restored later.
+
+    External plugins are captured via their raw_state, while built-in plugins (which have no raw_state) are
+    captured as a dict of their parameter values.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin to capture the state of.
+
+    Returns:
+      bytes or dict: The captured state.
+    """
+    if hasattr(plugin, 'raw_state'):
+        return plugin.raw_state
+    return {name: getattr(plugin, name) for name in get_builtin_parameter_names(plugin)}
+
+
+def restore_plugin_state(plugin, state):
+    """
+    Restore a state previously returned by capture_plugin_state.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin to restore the state of.
+      state (bytes or dict): The state to restore.
+    """
+    if isinstance(state, dict):
+        for name, value in state.items():
+            setattr(plugin, name, value)
+    else:
+        plugin.raw_state = state
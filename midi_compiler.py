@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+# Compile MIDI files into compact, sorted NumPy event arrays with sample offsets, and render many of them back to back.
+#
+# Loading a MIDI file with mido (see rendering.load_midi_file) builds a Python Message for every event and converts
+# each delta time to seconds through the tempo map, every time the file is rendered. A MidiCompiler does that once
+# per file: the channel messages of the chosen tracks are collected with their absolute ticks, the tempo map is applied
+# to all of them at once with NumPy, and the result is stored as a structured array:
+#   sample:      int64, the sample offset of the event (truncated, the same as pedalboard does)
+#   time:        float64, the time of the event in seconds
+#   tick_tempo:  int64, the time of the event as the sum of its ticks times their tempo (microseconds per beat), ie.
+#                exactly time * ticks_per_beat * 1e6
+#   size:        uint8, the number of MIDI bytes
+#   data:        uint8 (3,), the MIDI bytes (padded with zeros)
+#
+# The sample offsets are computed from tick_tempo in integer arithmetic rather than from the float seconds, so an
+# event that falls exactly on a sample boundary is always placed on that sample, rather than sometimes one sample
+# early through float rounding.
+#
+# Compiled files are cached by the sha1 of their contents, in memory (LRU) and on disk (as .npz files), so a clip that
+# is rendered again (or by another process) never touches mido. System exclusive messages are skipped.
+#
+# Example usage:
+#   compiler = MidiCompiler()
+#   sequences = [compiler.compile(path, sample_rate=44100) for path in clip_paths]
+#   for audio in render_sequences(synth_plugin, sequences, sample_rate=44100, num_channels=2, tail=1.0):
+#       ...
+#
+#   python midi_compiler.py clips/*.mid --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --output-dir renders
+#   python midi_compiler.py clips/*.mid --compile-only
+
+import argparse
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rendering import render_midi
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'poc-audio-pedalboard', 'midi')
+DEFAULT_TEMPO = 500000  # Microseconds per beat (120 BPM)
+CACHE_VERSION = 2
+
+EVENT_DTYPE = np.dtype([
+    ('sample', np.int64),
+    ('time', np.float64),
+    ('tick_tempo', np.int64),
+    ('size', np.uint8),
+    ('data', np.uint8, (3,)),
+])
+
+
+class CompiledMidi:
+    """
+    A compiled MIDI sequence.
+
+    Args:
+      events (numpy.ndarray): The events, as an EVENT_DTYPE array sorted by time.
+      duration (float): The length of the sequence in seconds (up to the end of its longest track).
+      sample_rate (int): The sample rate the sample offsets are for.
+      ticks_per_beat (int): The MIDI file's ticks per beat (which the events' tick_tempo values are scaled by).
+      digest (str, optional): The sha1 of the MIDI file the sequence was compiled from.
+    """
+
+    def __init__(self, events, duration, sample_rate, ticks_per_beat, digest=None):
+        self.events = events
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.ticks_per_beat = ticks_per_beat
+        self.digest = digest
+        self._midi_events = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def with_sample_rate(self, sample_rate):
+        """
+        Returns:
+          CompiledMidi: The same sequence, with the sample offsets for another sample rate.
+        """
+        events = self.events.copy()
+        events['sample'] = _sample_offsets(events['tick_tempo'], self.ticks_per_beat, sample_rate)
+        return CompiledMidi(events, self.duration, sample_rate, self.ticks_per_beat, self.digest)
+
+    def to_midi_events(self):
+        """
+        Get the events in the form that pedalboard (and the rendering helpers) accept. The list is built once, and
+        reused by every later call.
+
+        Returns:
+          list: A sorted list of (midi_bytes, timestamp_in_seconds) tuples. Each timestamp is a quarter sample past its
+            sample offset, so that it lands on exactly that sample regardless of float rounding.
+        """
+        if self._midi_events is None:
+            times = ((self.events['sample'] + 0.25) / self.sample_rate).tolist()
+            data = self.events['data'].tobytes()
+            sizes = self.events['size'].tolist()
+            self._midi_events = [(data[3 * i:3 * i + size], times[i]) for i, size in enumerate(sizes)]
+        return self._midi_events
+
+
+def _tempo_map_tick_tempo(ticks, tempo_changes):
+    # Convert absolute ticks to the sum of ticks times their tempo (seconds * ticks_per_beat * 1e6), for all of them at
+    # once and exactly (in integers)
+    tempo_changes = sorted(tempo_changes, key=lambda change: change[0])
+    if not tempo_changes or tempo_changes[0][0] > 0:
+        tempo_changes.insert(0, (0, DEFAULT_TEMPO))
+    change_ticks = np.array([tick for tick, _ in tempo_changes], dtype=np.int64)
+    change_tempos = np.array([tempo for _, tempo in tempo_changes], dtype=np.int64)
+    change_tick_tempos = np.concatenate(([0], np.cumsum(np.diff(change_ticks) * change_tempos[:-1])))
+
+    segment = np.searchsorted(change_ticks, ticks, side='right') - 1
+    return change_tick_tempos[segment] + (ticks - change_ticks[segment]) * change_tempos[segment]
+
+
+def _sample_offsets(tick_tempo, ticks_per_beat, sample_rate):
+    # floor(seconds * sample_rate), in integers. Split with divmod so the products stay well within int64.
+    divisor = ticks_per_beat * 1000000
+    whole, remainder = np.divmod(tick_tempo, divisor)
+    return whole * sample_rate + remainder * sample_rate // divisor
+
+
+def compile_midi_file(midi_file, sample_rate, tracks=None):
+    """
+    Compile a mido.MidiFile into a CompiledMidi.
+
+    Args:
+      midi_file (mido.MidiFile): The MIDI file.
+      sample_rate (int): The sample rate to compute the sample offsets for.
+      tracks (list, optional): The indices of the tracks to include. Defaults to all of them. The tempo map is always
+        taken from every track.
+
+    Returns:
+      CompiledMidi: The compiled sequence.
+    """
+    included = set(range(len(midi_file.tracks)) if tracks is None else tracks)
+    event_ticks = []
+    event_bytes = []
+    tempo_changes = []
+    end_tick = 0
+    for track_index, track in enumerate(midi_file.tracks):
+        tick = 0
+        for message in track:
+            tick += message.time
+            if message.is_meta:
+                if message.type == 'set_tempo':
+                    tempo_changes.append((tick, message.tempo))
+            elif track_index in included and message.type != 'sysex':
+                event_ticks.append(tick)
+                event_bytes.append(message.bytes())
+        end_tick = max(end_tick, tick)
+
+    events = np.zeros(len(event_ticks), dtype=EVENT_DTYPE)
+    for i, midi_bytes in enumerate(event_bytes):
+        events['size'][i] = len(midi_bytes)
+        events['data'][i, :len(midi_bytes)] = midi_bytes
+
+    ticks = np.array(event_ticks + [end_tick], dtype=np.int64)
+    tick_tempo = _tempo_map_tick_tempo(ticks, tempo_changes)
+    seconds = tick_tempo / (midi_file.ticks_per_beat * 1e6)
+    events['time'] = seconds[:-1]
+    events['tick_tempo'] = tick_tempo[:-1]
+    # A stable sort, so that events at the same tick keep their track order (as with mido's merged tracks)
+    events = events[np.argsort(ticks[:-1], kind='stable')]
+    events['sample'] = _sample_offsets(events['tick_tempo'], midi_file.ticks_per_beat, sample_rate)
+    return CompiledMidi(events, float(seconds[-1]), sample_rate, midi_file.ticks_per_beat)
+
+
+class MidiCompiler:
+    """
+    Compiles MIDI files, caching the results by file contents in memory and on disk.
+
+    Args:
+      cache_dir (str, optional): The directory to cache compiled files in. None disables the disk cache.
+      max_cached (int): The number of compiled sequences to keep in memory.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_cached=256):
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._path_digests = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _digest(self, midi_path):
+        # Files are only re-hashed when their mtime or size changes
+        stat = os.stat(midi_path)
+        cached = self._path_digests.get(midi_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2], None
+        with open(midi_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        self._path_digests[midi_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest, data
+
+    def _cache_path(self, digest, tracks):
+        tracks_suffix = '' if tracks is None else '-t' + '.'.join(str(track) for track in tracks)
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}{tracks_suffix}.npz")
+
+    def compile(self, midi_path, sample_rate, tracks=None):
+        """
+        Compile a MIDI file (or get it from the cache).
+
+        Args:
+          midi_path (str): The path to the .mid file.
+          sample_rate (int): The sample rate to compute the sample offsets for.
+          tracks (list, optional): The indices of the tracks to include. Defaults to all of them.
+
+        Returns:
+          CompiledMidi: The compiled sequence. It is shared with later calls, so shouldn't be modified.
+        """
+        tracks = None if tracks is None else tuple(tracks)
+        digest, data = self._digest(midi_path)
+        key = (digest, tracks, sample_rate)
+        compiled = self._cache.get(key)
+        if compiled is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+        compiled = self._load_cached(digest, tracks, sample_rate)
+        if compiled is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            from mido import MidiFile
+
+            if data is None:
+                with open(midi_path, 'rb') as f:
+                    data = f.read()
+            compiled = compile_midi_file(MidiFile(file=io.BytesIO(data)), sample_rate, tracks)
+            compiled.digest = digest
+            self._save_cached(compiled, tracks)
+
+        self._cache[key] = compiled
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return compiled
+
+    def _load_cached(self, digest, tracks, sample_rate):
+        if self.cache_dir is None:
+            return None
+        cache_path = self._cache_path(digest, tracks)
+        if not os.path.exists(cache_path):
+            return None
+        with np.load(cache_path) as cached:
+            if int(cached['version']) != CACHE_VERSION:
+                return None
+            compiled = CompiledMidi(
+                cached['events'], float(cached['duration']), sample_rate, int(cached['ticks_per_beat']), digest
+            )
+        if compiled.events.dtype != EVENT_DTYPE:
+            return None
+        # The sample offsets are cheap to recompute, so the disk cache is shared by every sample rate
+        compiled.events['sample'] = _sample_offsets(compiled.events['tick_tempo'], compiled.ticks_per_beat, sample_rate)
+        return compiled
+
+    def _save_cached(self, compiled, tracks):
+        if self.cache_dir is None:
+            return
+        cache_path = self._cache_path(compiled.digest, tracks)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Written to a temporary file first, so that concurrent processes never read a partial file
+        temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp_path,
+            version=CACHE_VERSION,
+            events=compiled.events,
+            duration=compiled.duration,
+            ticks_per_beat=compiled.ticks_per_beat,
+        )
+        os.replace(temp_path, cache_path)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'cached': len(self._cache),
+        }
+
+
+def render_sequences(plugin, sequences, sample_rate, num_channels, buffer_size=8192, tail=0.0, durations=None):
+    """
+    Render compiled sequences back to back through one plugin instance, resetting it (and so silencing any voices
+    still sounding) before each one.
+
+    Args:
+      plugin (pedalboard.Plugin): An instrument plugin, or an effect plugin to run a sine tone of the notes through.
+      sequences (iterable): The CompiledMidi sequences (compiled for sample_rate).
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      buffer_size (int): The buffer size the plugin processes audio in.
+      tail (float): Extra seconds to render after the end of each sequence (eg. for release and reverb tails).
+      durations (list, optional): The number of seconds to render for each sequence, instead of its duration + tail.
+
+    Yields:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples) for each sequence.
+    """
+    for i, sequence in enumerate(sequences):
+        if sequence.sample_rate != sample_rate:
+            sequence = sequence.with_sample_rate(sample_rate)
+        yield render_midi(
+            plugin,
+            sequence.to_midi_events(),
+            duration=durations[i] if durations is not None else sequence.duration + tail,
+            sample_rate=sample_rate,
+            num_channels=num_channels,
+            buffer_size=buffer_size,
+            reset=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile MIDI files, and render them back to back through a plugin.")
+    parser.add_argument('midi_paths', nargs='+', help="The .mid files.")
+    parser.add_argument(
+        '--plugin',
+        default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
+        help="Plugin path, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
+    parser.add_argument('--output-dir', default='renders', help="[Default: %(default)s]")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="[Default: %(default)s]")
+    parser.add_argument('--no-cache', action='store_true', help="Don't use the disk cache.")
+    parser.add_argument('--tracks', type=int, nargs='+', default=None, help="Track indices to include. [Default: all]")
+    parser.add_argument('--compile-only', action='store_true', help="Only compile the files (eg. to warm the cache).")
+    parser.add_argument('--tail', type=float, default=1.0, help="Seconds to render past each file's end. [Default: %(default)s]")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="[Default: %(default)s]")
+    parser.add_argument('--num-channels', type=int, default=2, help="[Default: %(default)s]")
+    parser.add_argument('--buffer-size', type=int, default=8192, help="[Default: %(default)s]")
+    args = parser.parse_args()
+
+    compiler = MidiCompiler(cache_dir=None if args.no_cache else args.cache_dir)
+    started = time.perf_counter()
+    sequences = [compiler.compile(path, args.sample_rate, tracks=args.tracks) for path in args.midi_paths]
+    elapsed = time.perf_counter() - started
+    print(
+        f"Compiled {len(sequences)} files ({sum(len(sequence) for sequence in sequences)} events) in {elapsed:.3f}s: "
+        f"{compiler.stats()}"
+    )
+    if args.compile_only:
+        return
+
+    from pedalboard.io import AudioFile
+
+    from helpers import load_plugin_from_spec
+
+    plugin = load_plugin_from_spec(args.plugin)
+    os.makedirs(args.output_dir, exist_ok=True)
+    started = time.perf_counter()
+    for path, audio in zip(
+        args.midi_paths,
+        render_sequences(plugin, sequences, args.sample_rate, args.num_channels, args.buffer_size, tail=args.tail),
+    ):
+        output_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + '.wav')
+        with AudioFile(output_path, 'w', args.sample_rate, args.num_channels) as f:
+            f.write(audio)
+    elapsed = time.perf_counter() - started
+    print(f"Rendered {len(sequences)} sequences to {args.output_dir} in {elapsed:.2f}s ({len(sequences) / elapsed:.1f}/sec)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Bulk save/load of plugin parameter values, applying only what changed.
+#
+# A ParameterPreset holds a plugin's parameter values as one float32 array (raw 0..1 values for external plugins, like
+# a parameter_snapshot.ParameterSnapshot), saved either as compact JSON or as a binary .npz. This is the JSON
+# serialisation discussed in https://github.com/spotify/pedalboard/issues/187, minus the per-parameter metadata, which
+# schema_extractor.py records separately.
+#
+# Setting a synth's parameters one at a time through plugin.parameters is slow (Vital has 775 of them). A
+# PresetApplier keeps a snapshot of what it last wrote to the plugin, so applying a preset only writes the parameters
+# whose values differ from it. For a sweep of presets that differ in a handful of parameters, each application costs
+# a handful of writes rather than one per parameter. The changed parameters are written in dependency order:
+# switches and mode/type/sync selectors first (they can change what the other parameters mean, or their values), then
+# other discrete parameters, then continuous ones. If any switches or selectors were written, the other parameters
+# are re-read before deciding which of them still need writing.
+#
+# Example usage:
+#   preset = ParameterPreset.capture(synth_plugin)
+#   preset.save('pluck.json')   # or 'pluck.npz'
+#
+#   applier = PresetApplier(synth_plugin)
+#   for preset in applier.iter_apply(ParameterPreset.load(path) for path in preset_paths):
+#       audio = render_midi(synth_plugin, midi_events, duration=2.0, sample_rate=44100, num_channels=2)
+#
+#   python parameter_presets.py capture pluck.json --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3 --state pluck.bin
+#   python parameter_presets.py convert pluck.json pluck.npz
+
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from parameter_snapshot import ParameterLayout
+
+PRESET_FORMAT = 'pedalboard-parameters'
+PRESET_VERSION = 1
+
+# Parameters written before any others, as they can change the meaning (or range) of other parameters
+DEPENDENT_KEY_PATTERN = re.compile(
+    r'(^|_)(switch|on|enable|enabled|bypass|mode|type|style|model|sync|oversampling|voices|polyphony)($|_)'
+)
+
+
+class ParameterPreset:
+    """
+    A plugin's parameter values.
+
+    Args:
+      keys (list): The parameter keys.
+      values (numpy.ndarray): The float32 values, in the same order (raw values if raw is True).
+      raw (bool): Whether the values are raw (normalised 0..1) values, as for external plugins.
+      plugin (str, optional): The name of the plugin the values were captured from.
+    """
+
+    def __init__(self, keys, values, raw=True, plugin=None):
+        self.keys = tuple(keys)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.raw = raw
+        self.plugin = plugin
+        if len(self.keys) != len(self.values):
+            raise ValueError(f"Got {len(self.values)} values for {len(self.keys)} keys")
+
+    @classmethod
+    def capture(cls, plugin, layout=None):
+        """
+        Capture the current parameter values of a plugin.
+
+        Args:
+          plugin (pedalboard.Plugin): The plugin.
+          layout (parameter_snapshot.ParameterLayout, optional): The plugin's layout, if one already exists.
+
+        Returns:
+          ParameterPreset: The preset.
+        """
+        layout = layout or ParameterLayout(plugin)
+        snapshot = layout.capture()
+        return cls(layout.keys, snapshot.values, raw=layout.is_external, plugin=getattr(plugin, 'name', None))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_dict(self):
+        return dict(zip(self.keys, self.values.tolist()))
+
+    def save(self, path):
+        """
+        Save the preset, as compact JSON if the path ends in '.json', otherwise as a binary .npz.
+        """
+        temp_path = f"{path}.tmp"
+        if path.endswith('.json'):
+            with open(temp_path, 'w') as f:
+                json.dump({
+                    'format': PRESET_FORMAT,
+                    'version': PRESET_VERSION,
+                    'plugin': self.plugin,
+                    'raw': self.raw,
+                    'parameters': self.to_dict(),
+                }, f, separators=(',', ':'))
+        else:
+            with open(temp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    version=PRESET_VERSION,
+                    plugin=self.plugin or '',
+                    raw=self.raw,
+                    keys=np.array(self.keys, dtype=str),
+                    values=self.values,
+                )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Create a preset from the data of a saved JSON preset.
+        """
+        if not is_preset_json(data):
+            raise ValueError("Not a parameter preset")
+        if data['version'] != PRESET_VERSION:
+            raise ValueError(f"Unsupported parameter preset version: {data['version']}")
+        parameters = data['parameters']
+        return cls(parameters.keys(), list(parameters.values()), raw=data['raw'], plugin=data.get('plugin'))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a preset saved by save.
+
+        Returns:
+          ParameterPreset: The preset.
+        """
+        if path.endswith('.json'):
+            with open(path) as f:
+                return cls.from_json(json.load(f))
+        with np.load(path) as data:
+            if int(data['version']) != PRESET_VERSION:
+                raise ValueError(f"Unsupported parameter preset version: {int(data['version'])}")
+            return cls(data['keys'].tolist(), data['values'], raw=bool(data['raw']), plugin=str(data['plugin']) or None)
+
+
+def is_preset_json(data):
+    """
+    Whether some loaded JSON is a saved ParameterPreset (rather than eg. a plain dict of parameter values).
+    """
+    return isinstance(data, dict) and data.get('format') == PRESET_FORMAT
+
+
+def _write_priorities(layout):
+    # 0: switches and selectors, 1: other discrete parameters, 2: continuous parameters
+    priorities = np.full(len(layout), 2, dtype=np.int8)
+    parameters = layout.plugin.parameters if layout.is_external else {}
+    for i, key in enumerate(layout.keys):
+        if DEPENDENT_KEY_PATTERN.search(key):
+            priorities[i] = 0
+        elif key in parameters:
+            parameter = parameters[key]
+            if getattr(parameter, 'is_boolean', False) or getattr(parameter, 'is_discrete', False):
+                priorities[i] = 1
+    return priorities
+
+
+class PresetApplier:
+    """
+    Applies presets to one plugin instance, writing only the parameters that differ from what it last wrote.
+
+    The applier assumes it's the only thing changing the plugin's parameters. If anything else does (eg. the plugin's
+    editor, or a raw_state being restored), call resync before applying the next preset.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin to apply presets to.
+      tolerance (float): Differences of this size or smaller are not written.
+    """
+
+    def __init__(self, plugin, tolerance=0.0):
+        self.plugin = plugin
+        self.tolerance = tolerance
+        self.layout = ParameterLayout(plugin)
+        self._priorities = _write_priorities(self.layout)
+        # Preset keys -> their positions in the layout (presets in a sweep almost always share their keys)
+        self._indices_cache = {}
+        self.writes = 0
+        self.skipped = 0
+        self.resync()
+
+    def resync(self):
+        """
+        Re-read the plugin's current parameter values (after something other than this applier changed them).
+        """
+        self.current = self.layout.capture().values.copy()
+
+    def _indices(self, preset):
+        indices = self._indices_cache.get(preset.keys)
+        if indices is None:
+            unknown = [key for key in preset.keys if key not in self.layout.index]
+            if unknown:
+                raise ValueError(f"The preset has parameters the plugin doesn't: {unknown[:10]}")
+            indices = self._indices_cache[preset.keys] = np.array(
+                [self.layout.index[key] for key in preset.keys], dtype=np.intp
+            )
+        return indices
+
+    def apply(self, preset):
+        """
+        Apply a preset, writing only the parameters whose values differ from the plugin's current ones.
+
+        Args:
+          preset (ParameterPreset): The preset. It may hold only some of the plugin's parameters.
+
+        Returns:
+          int: The number of parameters written.
+        """
+        if preset.raw != self.layout.is_external:
+            raise ValueError(
+                f"The preset holds {'raw' if preset.raw else 'plain'} values, "
+                f"but the plugin takes {'raw' if self.layout.is_external else 'plain'} ones"
+            )
+        indices = self._indices(preset)
+        changed = self._changed(preset, indices)
+        changed_indices = indices[changed]
+        priorities = self._priorities[changed_indices]
+
+        written = 0
+        if (priorities == 0).any():
+            # Switches and selectors first. They can change the plugin's other parameter values (eg. a filter type
+            # resetting its cutoff range), so the rest are re-read and diffed afterwards.
+            first = changed[priorities == 0]
+            written += self._write(indices[first], preset.values[first])
+            self.resync()
+            rest = np.flatnonzero(self._priorities[indices] != 0)
+            changed = rest[self._changed(preset, indices, rest)]
+            changed_indices = indices[changed]
+            priorities = self._priorities[changed_indices]
+
+        # Stable, so parameters of the same priority are written in layout order
+        order = np.argsort(priorities, kind='stable')
+        written += self._write(changed_indices[order], preset.values[changed[order]])
+
+        self.writes += written
+        self.skipped += len(indices) - written
+        return written
+
+    def _changed(self, preset, indices, positions=None):
+        # The positions (in the preset) of the values that differ from the plugin's current ones
+        values, indices = (preset.values, indices) if positions is None else (preset.values[positions], indices[positions])
+        difference = np.abs(values - self.current[indices])
+        return np.flatnonzero(difference > self.tolerance if self.tolerance else difference != 0)
+
+    def _write(self, indices, values):
+        self.current[indices] = values
+        try:
+            self.layout.apply(self.current, indices)
+        except Exception:
+            # Some of the parameters may have been written before the failure
+            self.resync()
+            raise
+        return len(indices)
+
+    def iter_apply(self, presets):
+        """
+        Apply presets one after another, eg. for a preset sweep.
+
+        Args:
+          presets (iterable): The ParameterPresets.
+
+        Yields:
+          ParameterPreset: Each preset, once it has been applied (and before the next one is).
+        """
+        for preset in presets:
+            self.apply(preset)
+            yield preset
+
+    def stats(self):
+        """
+        Returns:
+          dict: The number of parameter writes made and skipped (as unchanged) so far.
+        """
+        return {'writes': self.writes, 'skipped': self.skipped}
+
+
+def apply_parameter_preset(plugin, preset):
+    """
+    Apply a preset to a plugin once (use a PresetApplier to apply several to the same instance).
+
+    Returns:
+      int: The number of parameters written.
+    """
+    return PresetApplier(plugin).apply(preset)
+
+
+def capture_command(args):
+    from helpers import load_plugin_from_spec
+    from rendering import apply_preset
+
+    plugin = load_plugin_from_spec(args.plugin, args.plugin_name)
+    if args.state:
+        apply_preset(plugin, args.state)
+    preset = ParameterPreset.capture(plugin)
+    preset.save(args.output)
+    print(f"Saved {len(preset)} parameters to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+def convert_command(args):
+    preset = ParameterPreset.load(args.input)
+    preset.save(args.output)
+    print(f"Converted {len(preset)} parameters to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+def show_command(args):
+    preset = ParameterPreset.load(args.input)
+    print(f"{len(preset)} {'raw' if preset.raw else 'plain'} parameter values for {preset.plugin or 'an unknown plugin'}")
+    for key, value in preset.to_dict().items():
+        print(f"  {key}: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Save, convert and inspect parameter presets.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    capture_parser = subparsers.add_parser('capture', help="Save a plugin's parameter values as a preset.")
+    capture_parser.add_argument('output', help="The preset to write (.json, or .npz for binary).")
+    capture_parser.add_argument(
+        '--plugin',
+        default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
+        help="Plugin path, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
+    capture_parser.add_argument('--plugin-name', default=None, help="Plugin name within a multi-plugin file.")
+    capture_parser.add_argument('--state', default=None, help="Raw state (.bin) or preset to apply before capturing.")
+    capture_parser.set_defaults(handler=capture_command)
+
+    convert_parser = subparsers.add_parser('convert', help="Convert a preset between JSON and binary.")
+    convert_parser.add_argument('input', help="The preset to read.")
+    convert_parser.add_argument('output', help="The preset to write (.json, or .npz for binary).")
+    convert_parser.set_defaults(handler=convert_command)
+
+    show_parser = subparsers.add_parser('show', help="Show the values in a preset.")
+    show_parser.add_argument('input', help="The preset to read.")
+    show_parser.set_defaults(handler=show_command)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
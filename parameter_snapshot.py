@@ -0,0 +1,184 @@
+# Array-backed snapshots of a plugin's parameter values.
+#
+# A ParameterLayout resolves the plugin's parameter objects (and the key -> index mapping) once, after which each
+# snapshot is captured in a single pass into a NumPy float32 array, and two snapshots are diffed with vectorised
+# comparisons rather than key by key.
+#
+# For external plugins the snapshot holds each parameter's raw_value (normalised to 0..1). Built-in pedalboard
+# plugins have no .parameters, so their numeric properties are captured instead.
+#
+# Example usage:
+#   layout = ParameterLayout(synth_plugin)
+#   before = layout.capture()
+#   synth_plugin.show_editor()
+#   after = layout.capture()
+#   diff = before.diff(after, tolerance=1e-6)
+#   for key, old_value, new_value in diff.changes():
+#       print(key, old_value, new_value)
+
+from operator import attrgetter
+
+import numpy as np
+
+from helpers import get_builtin_parameter_names
+
+_get_raw_value = attrgetter('raw_value')
+
+
+class ParameterLayout:
+    """
+    The parameter keys of a plugin, and their positions in a ParameterSnapshot's values array.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin whose parameters to capture.
+      keys (list, optional): The parameter keys to capture (and their order). Defaults to all of them.
+    """
+
+    def __init__(self, plugin, keys=None):
+        self.plugin = plugin
+        self.is_external = hasattr(plugin, 'parameters')
+        if self.is_external:
+            parameters = plugin.parameters
+            self.keys = tuple(parameters.keys() if keys is None else keys)
+            self._parameters = [parameters[key] for key in self.keys]
+        else:
+            self.keys = tuple(get_builtin_parameter_names(plugin) if keys is None else keys)
+            self._getter = attrgetter(*self.keys) if self.keys else None
+        self.index = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def capture(self):
+        """
+        Capture the current values of the plugin's parameters.
+
+        Returns:
+          ParameterSnapshot: The snapshot.
+        """
+        if self.is_external:
+            values = np.fromiter(map(_get_raw_value, self._parameters), dtype=np.float32, count=len(self.keys))
+        elif len(self.keys) == 1:
+            values = np.array([self._getter(self.plugin)], dtype=np.float32)
+        elif self.keys:
+            values = np.array(self._getter(self.plugin), dtype=np.float32)
+        else:
+            values = np.empty(0, dtype=np.float32)
+        return ParameterSnapshot(self, values)
+
+    def apply(self, values, indices=None):
+        """
+        Set the plugin's parameters from an array of values in layout order (the inverse of capture).
+
+        Args:
+          values (numpy.ndarray): The values to set (raw values for external plugins).
+          indices (list, optional): Only set the parameters at these layout positions, in this order, taking their
+            values from the same positions in values.
+        """
+        indices = range(len(self.keys)) if indices is None else indices
+        if self.is_external:
+            for i in indices:
+                self._parameters[i].raw_value = float(values[i])
+        else:
+            for i in indices:
+                setattr(self.plugin, self.keys[i], float(values[i]))
+
+
+class ParameterSnapshot:
+    """
+    The values of a plugin's parameters at a point in time.
+
+    Args:
+      layout (ParameterLayout): The layout the values were captured with.
+      values (numpy.ndarray): The float32 parameter values, in layout order.
+    """
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+
+    @classmethod
+    def capture(cls, plugin):
+        """
+        Capture a one-off snapshot of a plugin's parameters. Prefer ParameterLayout.capture when snapshotting the
+        same plugin repeatedly.
+        """
+        return ParameterLayout(plugin).capture()
+
+    @property
+    def keys(self):
+        return self.layout.keys
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        return float(self.values[self.layout.index[key]])
+
+    def to_dict(self):
+        return dict(zip(self.layout.keys, self.values.tolist()))
+
+    def diff(self, other, tolerance=0.0):
+        """
+        Compare this snapshot against a later one.
+
+        Args:
+          other (ParameterSnapshot): The snapshot to compare against.
+          tolerance (float): Changes of this size or smaller are ignored.
+
+        Returns:
+          ParameterDiff: The differences between the snapshots.
+        """
+        if other.layout.keys == self.layout.keys:
+            before, after = self.values, other.values
+            keys = self.layout.keys
+            missing_in_other, missing_in_self = set(), set()
+        else:
+            other_keys = set(other.layout.keys)
+            keys = tuple(key for key in self.layout.keys if key in other_keys)
+            before = self.values[[self.layout.index[key] for key in keys]]
+            after = other.values[[other.layout.index[key] for key in keys]]
+            missing_in_other = set(self.layout.keys) - other_keys
+            missing_in_self = other_keys - set(self.layout.keys)
+
+        if tolerance:
+            changed = np.flatnonzero(np.abs(after - before) > tolerance)
+        else:
+            changed = np.flatnonzero(after != before)
+        return ParameterDiff(
+            [keys[i] for i in changed],
+            before[changed],
+            after[changed],
+            missing_in_other,
+            missing_in_self,
+        )
+
+
+class ParameterDiff:
+    """
+    The parameters that changed between two snapshots.
+
+    Attributes:
+      keys (list): The keys of the changed parameters.
+      before (numpy.ndarray): Their values in the first snapshot.
+      after (numpy.ndarray): Their values in the second snapshot.
+      missing_in_after (set): Keys only in the first snapshot.
+      missing_in_before (set): Keys only in the second snapshot.
+    """
+
+    def __init__(self, keys, before, after, missing_in_after, missing_in_before):
+        self.keys = keys
+        self.before = before
+        self.after = after
+        self.missing_in_after = missing_in_after
+        self.missing_in_before = missing_in_before
+
+    def __len__(self):
+        return len(self.keys)
+
+    def changes(self):
+        """
+        Returns:
+          list: (key, before, after) tuples for each changed parameter.
+        """
+        return list(zip(self.keys, self.before.tolist(), self.after.tolist()))
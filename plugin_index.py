@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# A persistent on-disk index of the locally installed VST3/AU plugins.
+#
+# Reading VST3Plugin.installed_plugins / AudioUnitPlugin.installed_plugins walks every plugin directory on every run.
+# Instead, this index records each plugin bundle's metadata (read from the bundle's moduleinfo.json / Info.plist,
+# without loading the plugin) along with the mtime of every directory it scanned. On refresh, only directories whose
+# mtime has changed are rescanned, and name/prefix queries are answered from an in-memory sorted index.
+#
+# Example usage:
+#   python plugin_index.py Vital Serum
+#   python plugin_index.py --prefix Val
+#   python plugin_index.py --rescan --plugin-dir ./fake-plugins
+
+import argparse
+import json
+import os
+import plistlib
+import sys
+import time
+from bisect import bisect_left
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'poc-audio-pedalboard', 'plugin_index.json')
+
+PLUGIN_EXTENSIONS = {
+    '.vst3': 'VST3',
+    '.component': 'AudioUnit',
+}
+
+INDEX_VERSION = 1
+
+
+def default_plugin_dirs():
+    """
+    The standard VST3/AU plugin directories for the current platform.
+
+    Returns:
+      list: The plugin directories (which may not all exist).
+    """
+    home = os.path.expanduser('~')
+    if sys.platform == 'darwin':
+        return [
+            '/Library/Audio/Plug-Ins/VST3',
+            os.path.join(home, 'Library/Audio/Plug-Ins/VST3'),
+            '/Library/Audio/Plug-Ins/Components',
+            os.path.join(home, 'Library/Audio/Plug-Ins/Components'),
+        ]
+    if sys.platform == 'win32':
+        return [os.path.join(os.environ.get('COMMONPROGRAMFILES', r'C:\Program Files\Common Files'), 'VST3')]
+    return [
+        os.path.join(home, '.vst3'),
+        '/usr/lib/vst3',
+        '/usr/local/lib/vst3',
+    ]
+
+
+def _read_json_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_plist_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return plistlib.load(f)
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return None
+
+
+def _vendor_from_bundle_identifier(bundle_identifier):
+    # eg. com.tytel.vital -> tytel
+    parts = (bundle_identifier or '').split('.')
+    return parts[1] if len(parts) > 2 else None
+
+
+def read_plugin_metadata(plugin_path):
+    """
+    Read the metadata of a plugin bundle from its moduleinfo.json / Info.plist, without loading the plugin.
+
+    Args:
+      plugin_path (str): The path to the .vst3 / .component bundle.
+
+    Returns:
+      dict: The plugin's path, format, name, vendor, is_instrument and mtime.
+    """
+    plugin_format = PLUGIN_EXTENSIONS[os.path.splitext(plugin_path)[1].lower()]
+    entry = {
+        'path': plugin_path,
+        'format': plugin_format,
+        'name': os.path.splitext(os.path.basename(plugin_path))[0],
+        'vendor': None,
+        'is_instrument': None,
+        'mtime': os.stat(plugin_path).st_mtime,
+    }
+
+    info_plist = _read_plist_file(os.path.join(plugin_path, 'Contents', 'Info.plist')) or {}
+    entry['vendor'] = _vendor_from_bundle_identifier(info_plist.get('CFBundleIdentifier'))
+
+    if plugin_format == 'VST3':
+        module_info = _read_json_file(os.path.join(plugin_path, 'Contents', 'Resources', 'moduleinfo.json')) or {}
+        entry['vendor'] = module_info.get('Factory Info', {}).get('Vendor') or entry['vendor']
+        for plugin_class in module_info.get('Classes', []):
+            if plugin_class.get('Category') == 'Audio Module Class':
+                entry['name'] = plugin_class.get('Name') or entry['name']
+                entry['vendor'] = plugin_class.get('Vendor') or entry['vendor']
+                entry['is_instrument'] = 'Instrument' in plugin_class.get('Sub Categories', [])
+                break
+    else:
+        for component in info_plist.get('AudioComponents', []):
+            # AudioUnit component names look like "Vendor: Name"
+            vendor, _, name = component.get('name', '').rpartition(': ')
+            entry['name'] = name or entry['name']
+            entry['vendor'] = vendor or component.get('manufacturer') or entry['vendor']
+            entry['is_instrument'] = component.get('type') == 'aumu'
+            break
+
+    return entry
+
+
+class PluginIndex:
+    """
+    A persistent index of the installed plugins, refreshed incrementally by directory mtime.
+
+    Args:
+      index_path (str): The JSON file the index is persisted to.
+      plugin_dirs (list, optional): The directories to index. Defaults to default_plugin_dirs().
+    """
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, plugin_dirs=None):
+        self.index_path = index_path
+        self.plugin_dirs = [os.path.abspath(d) for d in (plugin_dirs or default_plugin_dirs())]
+        # Scanned directory -> {'mtime': ..., 'plugins': [entry, ...], 'subdirs': [...]}
+        self.dirs = {}
+        self._load()
+        self._build_lookup()
+
+    def _load(self):
+        data = _read_json_file(self.index_path)
+        if data and data.get('version') == INDEX_VERSION:
+            self.dirs = data['dirs']
+
+    def save(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'dirs': self.dirs}, f)
+        os.replace(temp_path, self.index_path)
+
+    def refresh(self, force=False):
+        """
+        Rescan any plugin directories whose mtime has changed since they were last indexed, and save the index.
+
+        Args:
+          force (bool): Rescan every directory regardless of its mtime.
+
+        Returns:
+          int: The number of directories (and plugins updated in place) that were rescanned.
+        """
+        previous_dirs = self.dirs
+        self.dirs = {}
+        num_rescanned = 0
+        pending = list(self.plugin_dirs)
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+
+            scanned = previous_dirs.get(directory)
+            if force or not scanned or scanned['mtime'] != mtime:
+                scanned = self._scan_dir(directory, mtime)
+                num_rescanned += 1
+            else:
+                # Plugins updated in place don't change their parent directory's mtime
+                num_rescanned += self._refresh_plugins(scanned)
+            self.dirs[directory] = scanned
+            pending.extend(scanned['subdirs'])
+
+        if num_rescanned or previous_dirs.keys() != self.dirs.keys():
+            self.save()
+        self._build_lookup()
+        return num_rescanned
+
+    @staticmethod
+    def _scan_dir(directory, mtime):
+        plugins = []
+        subdirs = []
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                if os.path.splitext(dir_entry.name)[1].lower() in PLUGIN_EXTENSIONS:
+                    # Usually a bundle directory, but older Windows VST3s can be a single file
+                    try:
+                        plugins.append(read_plugin_metadata(dir_entry.path))
+                    except OSError:
+                        # eg. removed mid-scan, or a broken symlink
+                        continue
+                elif dir_entry.is_dir():
+                    # eg. vendor folders within the VST3 directory
+                    subdirs.append(dir_entry.path)
+        return {'mtime': mtime, 'plugins': plugins, 'subdirs': sorted(subdirs)}
+
+    @staticmethod
+    def _refresh_plugins(scanned):
+        num_changed = 0
+        for i, entry in enumerate(scanned['plugins']):
+            try:
+                if os.stat(entry['path']).st_mtime != entry['mtime']:
+                    scanned['plugins'][i] = read_plugin_metadata(entry['path'])
+                    num_changed += 1
+            except OSError:
+                pass
+        return num_changed
+
+    def _build_lookup(self):
+        self.plugins = sorted(
+            (entry for scanned in self.dirs.values() for entry in scanned['plugins']),
+            key=lambda entry: (entry['name'].lower(), entry['path']),
+        )
+        self._sorted_names = [entry['name'].lower() for entry in self.plugins]
+
+    def __len__(self):
+        return len(self.plugins)
+
+    def find(self, name, plugin_format=None):
+        """
+        Find the plugins with exactly the given name (case insensitive).
+        """
+        return self.find_prefix(name, plugin_format, exact=True)
+
+    def find_prefix(self, prefix, plugin_format=None, exact=False):
+        """
+        Find the plugins whose names start with the given prefix (case insensitive).
+
+        Args:
+          prefix (str): The name prefix.
+          plugin_format (str, optional): Only return plugins of this format ('VST3' or 'AudioUnit').
+          exact (bool): Only return plugins whose name is exactly the prefix.
+
+        Returns:
+          list: The matching plugin entries.
+        """
+        prefix = prefix.lower()
+        start = bisect_left(self._sorted_names, prefix)
+        end = bisect_left(self._sorted_names, prefix + '\uffff', lo=start)
+        return [
+            entry for name, entry in zip(self._sorted_names[start:end], self.plugins[start:end])
+            if (not exact or name == prefix) and (plugin_format is None or entry['format'] == plugin_format)
+        ]
+
+    def search(self, substring, plugin_format=None):
+        """
+        Find the plugins whose path contains the given substring (case insensitive), like a filter over
+        VST3Plugin.installed_plugins / AudioUnitPlugin.installed_plugins. Unlike find / find_prefix, this scans every
+        plugin in the index (O(n)).
+        """
+        substring = substring.lower()
+        return [
+            entry for entry in self.plugins
+            if substring in entry['path'].lower() and (plugin_format is None or entry['format'] == plugin_format)
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query (and incrementally refresh) the installed plugin index.")
+    parser.add_argument('names', nargs='*', help="Plugin names to search for (substring match on the plugin path).")
+    parser.add_argument('--prefix', default=None, help="List the plugins whose name starts with this prefix.")
+    parser.add_argument('--index-path', default=DEFAULT_INDEX_PATH, help="[Default: %(default)s]")
+    parser.add_argument(
+        '--plugin-dir',
+        action='append',
+        default=None,
+        help="Plugin directory to index (may be repeated). [Default: the standard plugin directories]",
+    )
+    parser.add_argument('--rescan', action='store_true', help="Rescan every directory, ignoring mtimes.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    plugin_index = PluginIndex(args.index_path, args.plugin_dir)
+    num_rescanned = plugin_index.refresh(force=args.rescan)
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(plugin_index)} plugins ({num_rescanned} directories rescanned) in {elapsed * 1000:.1f}ms")
+
+    if args.prefix is not None:
+        matches = plugin_index.find_prefix(args.prefix)
+    elif args.names:
+        matches = [entry for name in args.names for entry in plugin_index.search(name)]
+    else:
+        matches = plugin_index.plugins
+    for entry in matches:
+        instrument = {True: 'instrument', False: 'effect', None: 'unknown'}[entry['is_instrument']]
+        print(f"  [{entry['format']}] {entry['name']} ({entry['vendor'] or 'unknown vendor'}, {instrument}): {entry['path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# A pool of warm (already loaded) plugin instances, keyed by plugin path and plugin name.
+#
+# Loading a large synth can take hundreds of milliseconds to seconds, so rather than calling load_plugin for every
+# job, instances are checked out of the pool and returned to it afterwards. Each checkout is guaranteed a clean state:
+# the state captured when the instance was first loaded is restored, and its voices are reset. If restoring the state
+# can't be validated (the plugin's parameters don't match the ones captured at load), the instance is reloaded.
+#
+# Example usage:
+#   pool = PluginPool()
+#   with pool.checkout("/Library/Audio/Plug-Ins/VST3/Vital.vst3") as synth_plugin:
+#       audio = synth_plugin(midi_messages, duration=1, sample_rate=44100)
+#   print(pool.stats())
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from helpers import load_plugin_from_spec, capture_plugin_state, restore_plugin_state
+from parameter_snapshot import ParameterLayout
+
+
+class _PooledPlugin:
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.baseline_state = capture_plugin_state(plugin)
+        self.parameter_layout = ParameterLayout(plugin)
+        self.baseline_parameters = self.parameter_layout.capture()
+        # Whether the plugin may have been modified since its state was last restored
+        self.dirty = False
+
+
+class PluginPool:
+    """
+    A thread-safe pool of warm plugin instances.
+
+    Args:
+      max_idle_per_key (int): The maximum number of idle instances kept per (plugin path, plugin name).
+      validate_restore (bool): Check that the baseline parameter values were actually restored on each checkout,
+        reloading the plugin if they weren't.
+      validate_tolerance (float): The largest parameter difference still considered restored.
+      loader (callable, optional): Loads a plugin given (plugin_spec, plugin_name). Defaults to
+        helpers.load_plugin_from_spec.
+    """
+
+    def __init__(
+        self,
+        max_idle_per_key=4,
+        validate_restore=True,
+        validate_tolerance=1e-6,
+        loader=load_plugin_from_spec,
+    ):
+        self.max_idle_per_key = max_idle_per_key
+        self.validate_restore = validate_restore
+        self.validate_tolerance = validate_tolerance
+        self.loader = loader
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'restores': 0,
+            'restore_failures': 0,
+            'reloads': 0,
+            'discarded': 0,
+            'checkout_seconds_total': 0.0,
+            'checkout_seconds_max': 0.0,
+            'load_seconds_total': 0.0,
+        }
+
+    def _load(self, key):
+        started = time.perf_counter()
+        plugin = self.loader(*key)
+        pooled = _PooledPlugin(plugin)
+        with self._lock:
+            self._metrics['load_seconds_total'] += time.perf_counter() - started
+        return pooled
+
+    def _restore(self, pooled):
+        restore_plugin_state(pooled.plugin, pooled.baseline_state)
+        pooled.plugin.reset()
+        with self._lock:
+            self._metrics['restores'] += 1
+        if not self.validate_restore:
+            return True
+        # The raw_state blob itself isn't compared, as some plugins embed volatile data (eg. editor sizes) in it
+        parameters = pooled.parameter_layout.capture()
+        return not len(pooled.baseline_parameters.diff(parameters, tolerance=self.validate_tolerance))
+
+    def acquire(self, plugin_spec, plugin_name=None):
+        """
+        Check a plugin instance out of the pool, loading one if there are none idle.
+
+        Returns:
+          _PooledPlugin: The pooled instance, to be passed back to release(). Its .plugin is in its baseline state.
+        """
+        started = time.perf_counter()
+        key = (plugin_spec, plugin_name)
+        with self._lock:
+            idle = self._idle[key]
+            pooled = idle.pop() if idle else None
+            self._metrics['hits' if pooled else 'misses'] += 1
+
+        if pooled is None:
+            pooled = self._load(key)
+        elif pooled.dirty and not self._restore(pooled):
+            with self._lock:
+                self._metrics['restore_failures'] += 1
+                self._metrics['reloads'] += 1
+            pooled = self._load(key)
+
+        pooled.dirty = True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._metrics['checkout_seconds_total'] += elapsed
+            self._metrics['checkout_seconds_max'] = max(self._metrics['checkout_seconds_max'], elapsed)
+        return pooled
+
+    def release(self, plugin_spec, pooled, plugin_name=None, discard=False):
+        """
+        Return a plugin instance to the pool.
+
+        Args:
+          plugin_spec (str): The plugin spec it was acquired with.
+          pooled (_PooledPlugin): The instance returned by acquire().
+          plugin_name (str, optional): The plugin name it was acquired with.
+          discard (bool): Drop the instance rather than keeping it warm (eg. if it's known to be broken).
+        """
+        key = (plugin_spec, plugin_name)
+        with self._lock:
+            if discard or len(self._idle[key]) >= self.max_idle_per_key:
+                self._metrics['discarded'] += 1
+            else:
+                self._idle[key].append(pooled)
+
+    @contextmanager
+    def checkout(self, plugin_spec, plugin_name=None):
+        """
+        Check out a plugin instance in a clean state for the duration of a with block.
+
+        The instance goes back to the pool even if the with block raises (eg. for a bad preset path): it's restored and
+        validated on its next checkout like any other, and only reloaded if that fails.
+
+        Args:
+          plugin_spec (str): The plugin path or 'builtin:<Name>' spec (see helpers.load_plugin_from_spec).
+          plugin_name (str, optional): The plugin name to load from a plugin file containing multiple plugins.
+
+        Yields:
+          pedalboard.Plugin: The plugin instance.
+        """
+        pooled = self.acquire(plugin_spec, plugin_name)
+        try:
+            yield pooled.plugin
+        finally:
+            self.release(plugin_spec, pooled, plugin_name)
+
+    def preload(self, plugin_spec, plugin_name=None, count=1):
+        """
+        Load instances ahead of time so that the first checkouts are warm.
+        """
+        loaded = [self._load((plugin_spec, plugin_name)) for _ in range(count)]
+        with self._lock:
+            self._idle[(plugin_spec, plugin_name)].extend(loaded)
+
+    def stats(self):
+        """
+        Returns:
+          dict: The hit/miss/restore/reload counts and checkout latencies so far.
+        """
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['idle'] = sum(len(idle) for idle in self._idle.values())
+        checkouts = stats['hits'] + stats['misses']
+        stats['checkout_seconds_mean'] = stats['checkout_seconds_total'] / checkouts if checkouts else 0.0
+        return stats
@@ -0,0 +1,260 @@
+# Low-overhead, phase-level profiling, eg. for synth_vst_loader.py --profile.
+#
+# A Profiler times named phases (and any functions wrapped with it), recording for each phase its wall time, CPU time
+# and number of calls, and optionally the memory it allocated (via tracemalloc). A cProfile of the whole run can also
+# be captured. Phases can be nested, and are keyed by their path (eg. 'load_plugin/helpers.load_plugin_from_spec').
+#
+# The report is a JSON-serialisable dict, including metadata about the host, so that reports from many machines can be
+# aggregated.
+#
+# Only the standard library modules that every run needs are imported up front, so that importing this module (and
+# using a disabled Profiler) adds next to nothing to a script's startup time.
+#
+# Example usage:
+#   profiler = Profiler()
+#   profiler.start(trace_memory=True)
+#   with profiler.phase('load_plugin'):
+#       plugin = load_plugin(path)
+#   profiler.wrap_module(helpers)
+#   profiler.write_report('profile.json')
+
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+REPORT_VERSION = 1
+
+
+class _Frame:
+    __slots__ = ('start_current', 'peak')
+
+    def __init__(self, start_current):
+        self.start_current = start_current
+        self.peak = start_current
+
+
+class Profiler:
+    """
+    Times named phases of a run.
+
+    Args:
+      enabled (bool): When False, phases and wrapped functions run without being timed.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        self.metadata = {}
+        self._stack = []
+        self._memory_frames = []
+        self._trace_memory = False
+        self._cprofile = None
+        self._started_wall = time.perf_counter()
+        self._started_cpu = time.process_time()
+        self._started_time = time.time()
+
+    def start(self, trace_memory=False, cprofile=False):
+        """
+        Start the optional (and more expensive) memory tracing and cProfile capture.
+
+        Args:
+          trace_memory (bool): Record the memory allocated by each phase with tracemalloc.
+          cprofile (bool): Capture a cProfile of everything until the report is made.
+        """
+        if not self.enabled:
+            return
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._trace_memory = True
+        if cprofile:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the run. Phases entered within another phase are recorded under its path.
+
+        Args:
+          name (str): The name of the phase.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        if self._trace_memory:
+            self._enter_memory_frame()
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - started_wall
+            cpu = time.process_time() - started_cpu
+            self._stack.pop()
+
+            phase = self.phases.get(path)
+            if phase is None:
+                phase = self.phases[path] = {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'max_wall_seconds': 0.0}
+            phase['calls'] += 1
+            phase['wall_seconds'] += wall
+            phase['cpu_seconds'] += cpu
+            phase['max_wall_seconds'] = max(phase['max_wall_seconds'], wall)
+            if self._trace_memory:
+                allocated, peak = self._exit_memory_frame()
+                phase['allocated_bytes'] = phase.get('allocated_bytes', 0) + allocated
+                phase['peak_allocated_bytes'] = max(phase.get('peak_allocated_bytes', 0), peak)
+
+    def _enter_memory_frame(self):
+        current, peak = tracemalloc.get_traced_memory()
+        # Resetting the peak would lose the enclosing phases' peaks, so fold it into them first
+        for frame in self._memory_frames:
+            frame.peak = max(frame.peak, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._memory_frames.append(_Frame(current))
+
+    def _exit_memory_frame(self):
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self._memory_frames.pop()
+        frame.peak = max(frame.peak, peak)
+        if self._memory_frames:
+            self._memory_frames[-1].peak = max(self._memory_frames[-1].peak, frame.peak)
+        return current - frame.start_current, frame.peak - frame.start_current
+
+    def wrap(self, fn, name=None):
+        """
+        Wrap a function so that each call is timed as a phase.
+
+        Args:
+          fn (callable): The function to wrap.
+          name (str, optional): The phase name. Defaults to '<module>.<function name>'.
+
+        Returns:
+          callable: The wrapped function.
+        """
+        name = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+
+        wrapper.__wrapped_by_profiler__ = True
+        return wrapper
+
+    def wrap_module(self, module, names=None):
+        """
+        Replace a module's functions with wrapped ones, so that calls to them (including from within the module) are
+        timed. Names imported from the module before this is called still refer to the unwrapped functions.
+
+        Args:
+          module (module): The module to instrument (eg. helpers).
+          names (list, optional): The function names to wrap. Defaults to the module's public functions.
+        """
+        if not self.enabled:
+            return
+        if names is None:
+            names = [
+                name for name, value in vars(module).items()
+                if callable(value) and getattr(value, '__module__', None) == module.__name__
+                and not name.startswith('_') and not isinstance(value, type)
+            ]
+        for name in names:
+            fn = getattr(module, name)
+            if not getattr(fn, '__wrapped_by_profiler__', False):
+                setattr(module, name, self.wrap(fn))
+
+    def report(self, top_functions=30):
+        """
+        Build the profiling report.
+
+        Args:
+          top_functions (int): The number of functions (by cumulative time) to include from the cProfile, if captured.
+            Capturing the cProfile stops when the report is made.
+
+        Returns:
+          dict: The JSON-serialisable report.
+        """
+        report = {
+            'version': REPORT_VERSION,
+            'host': _host_metadata(),
+            'started': self._started_time,
+            'wall_seconds': time.perf_counter() - self._started_wall,
+            'cpu_seconds': time.process_time() - self._started_cpu,
+            'max_rss_bytes': max_rss_bytes(),
+            'metadata': self.metadata,
+            'phases': self.phases,
+        }
+        if self._cprofile is not None:
+            import pstats
+
+            self._cprofile.disable()
+            stats = pstats.Stats(self._cprofile).stats
+            functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top_functions]
+            report['cprofile'] = [
+                {
+                    'function': f"{filename}:{line}({function_name})",
+                    'calls': calls,
+                    'total_seconds': total_time,
+                    'cumulative_seconds': cumulative_time,
+                }
+                for (filename, line, function_name), (_, calls, total_time, cumulative_time, _) in functions
+            ]
+        return report
+
+    def write_report(self, path, top_functions=30):
+        """
+        Write the profiling report to a JSON file, and stop any memory tracing.
+
+        Args:
+          path (str): The path to write the report to.
+          top_functions (int): See report.
+        """
+        report = self.report(top_functions=top_functions)
+        if self._trace_memory:
+            tracemalloc.stop()
+            self._trace_memory = False
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+def _host_metadata():
+    import platform
+    import socket
+
+    pedalboard = sys.modules.get('pedalboard')
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'pid': os.getpid(),
+        'argv': sys.argv,
+        'pedalboard': getattr(pedalboard, '__version__', None) if pedalboard else None,
+    }
+
+
+def max_rss_bytes():
+    """
+    Returns:
+      int or None: The peak resident set size of this process, in bytes (None where unsupported, eg. Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, but kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# A memoizing, size-bounded on-disk cache of rendered audio.
+#
+# A render is keyed on everything that determines its output: the plugin (its path or spec, plus its identifier and
+# version where available), a hash of its state (raw_state, or the parameter values of a built-in plugin), a hash of
+# the MIDI events, and the sample rate, channel count, duration and buffer size. Each result is stored as a .npy file
+# which is memory-mapped on a hit, so a cache hit returns a (read-only) zero-copy array without running the plugin.
+#
+# Entries are evicted least recently used first (using file mtimes, which are bumped on every hit) once the cache
+# grows past max_bytes, so several processes can share one cache directory.
+#
+# Layout:
+#   <cache_dir>/<key[:2]>/<key>.npy
+#
+# Example usage:
+#   cache = RenderCache(max_bytes=4 * 1024 ** 3)
+#   audio = cache.render(synth_plugin, midi_events, duration=2.0, sample_rate=44100, num_channels=2,
+#                        plugin_spec='/Library/Audio/Plug-Ins/VST3/Vital.vst3')
+#   print(cache.stats())
+#
+#   python batch_render.py jobs.jsonl --plugin builtin:Reverb --render-cache-dir ~/.cache/poc-audio-pedalboard/renders
+#   python render_cache.py --stats
+#   python render_cache.py --clear
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from helpers import BUILTIN_PLUGIN_PREFIX, capture_plugin_state
+from rendering import render_midi
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'poc-audio-pedalboard', 'renders')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def plugin_state_digest(plugin):
+    """
+    Hash the current state of a plugin (its raw_state, or a built-in plugin's parameter values).
+
+    Returns:
+      str: The SHA-256 hex digest.
+    """
+    state = capture_plugin_state(plugin)
+    if isinstance(state, dict):
+        state = json.dumps(state, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(state).hexdigest()
+
+
+def midi_digest(midi_events):
+    """
+    Hash some MIDI events.
+
+    Args:
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+
+    Returns:
+      str: The SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    for midi_bytes, time in midi_events:
+        digest.update(struct.pack('<dB', time, len(midi_bytes)))
+        digest.update(midi_bytes)
+    return digest.hexdigest()
+
+
+def plugin_identity(plugin, plugin_spec=None):
+    """
+    Describe which plugin (and version of it) rendered something.
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin.
+      plugin_spec (str, optional): The plugin's path (or 'builtin:<Name>' spec).
+
+    Returns:
+      dict: The spec, class, and (for external plugins) identifier and version.
+    """
+    return {
+        'spec': plugin_spec or BUILTIN_PLUGIN_PREFIX + type(plugin).__name__,
+        'class': type(plugin).__name__,
+        'identifier': getattr(plugin, 'identifier', None),
+        'version': getattr(plugin, 'version', None),
+    }
+
+
+class RenderCache:
+    """
+    A size-bounded on-disk cache of rendered audio, evicting the least recently used renders first.
+
+    Args:
+      cache_dir (str): The directory to store renders in.
+      max_bytes (int): The total size of the renders to keep.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._scan())
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _scan(self):
+        # (mtime, path, size) of every entry
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.npy'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def key(self, plugin, midi_events, duration, sample_rate, num_channels, buffer_size=8192, plugin_spec=None):
+        """
+        Compute the cache key for rendering some MIDI through a plugin in its current state.
+
+        Returns:
+          str: The key (a SHA-256 hex digest).
+        """
+        description = {
+            'plugin': plugin_identity(plugin, plugin_spec),
+            'state': plugin_state_digest(plugin),
+            'midi': midi_digest(midi_events),
+            'duration': float(duration),
+            'sample_rate': int(sample_rate),
+            'num_channels': int(num_channels),
+            'buffer_size': int(buffer_size),
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached render.
+
+        Args:
+          key (str): The cache key.
+
+        Returns:
+          numpy.ndarray or None: A read-only, memory-mapped float32 array of shape (num_channels, num_samples), or None
+            if the render isn't cached.
+        """
+        path = self._path(key)
+        try:
+            audio = np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            # eg. evicted by another process since it was mapped (the mapping stays valid), or a read-only cache
+            pass
+        self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        """
+        Store a render, evicting older renders if the cache has grown past max_bytes.
+
+        Args:
+          key (str): The cache key.
+          audio (numpy.ndarray): The rendered audio.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # Overwriting an existing entry replaces its bytes rather than adding to them
+            self.total_bytes -= os.path.getsize(path)
+        except OSError:
+            pass
+        # Written to a temporary file first, so that other processes never map a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(audio, dtype=np.float32))
+        os.replace(temp_path, path)
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self, max_bytes=None):
+        """
+        Delete the least recently used renders until the cache is no larger than max_bytes.
+
+        Args:
+          max_bytes (int, optional): The size to shrink to. Defaults to the cache's max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        # Rescanned, as other processes may have added (or removed) entries
+        entries = sorted(self._scan())
+        self.total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def render(
+        self,
+        plugin,
+        midi_events,
+        duration,
+        sample_rate,
+        num_channels,
+        buffer_size=8192,
+        plugin_spec=None,
+    ):
+        """
+        Render some MIDI through a plugin (see rendering.render_midi), or return the cached render.
+
+        Args:
+          plugin (pedalboard.Plugin): The plugin, with its preset already applied.
+          midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+          duration (float): The number of seconds of audio to render.
+          sample_rate (int): The sample rate.
+          num_channels (int): The number of output channels.
+          buffer_size (int): The buffer size the plugin processes audio in.
+          plugin_spec (str, optional): The plugin's path (or 'builtin:<Name>' spec), to key the render on.
+
+        Returns:
+          numpy.ndarray: A float32 array of shape (num_channels, num_samples). Cache hits are read-only memory maps.
+        """
+        key = self.key(plugin, midi_events, duration, sample_rate, num_channels, buffer_size, plugin_spec)
+        audio = self.get(key)
+        if audio is None:
+            audio = render_midi(plugin, midi_events, duration, sample_rate, num_channels, buffer_size=buffer_size)
+            self.put(key, audio)
+        return audio
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'total_bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the on-disk render cache.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="[Default: %(default)s]")
+    parser.add_argument('--stats', action='store_true', help="Show the number and total size of the cached renders.")
+    parser.add_argument('--evict-to', type=int, default=None, help="Evict the least recently used renders down to this many bytes.")
+    parser.add_argument('--clear', action='store_true', help="Delete every cached render.")
+    args = parser.parse_args()
+
+    cache = RenderCache(args.cache_dir)
+    if args.clear:
+        cache.evict(max_bytes=0)
+    elif args.evict_to is not None:
+        cache.evict(max_bytes=args.evict_to)
+    if cache.evictions or args.clear or args.evict_to is not None:
+        print(f"Evicted {cache.evictions} renders")
+    if args.stats:
+        entries = cache._scan()
+        print(f"{len(entries)} renders, {cache.total_bytes / 1024 ** 2:.1f} MiB in {args.cache_dir}")
+    elif not (args.clear or args.evict_to is not None):
+        parser.print_usage()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+
+# A long-running local render service, holding warm plugin instances between requests.
+#
+# Starting a fresh process per job pays interpreter startup and load_plugin every time. Instead, this serves
+# newline-delimited JSON requests over a Unix socket (or localhost TCP), rendering with instances held in a
+# plugin_pool.PluginPool. Requests for each plugin go through a bounded queue: when it's full, the service stops
+# reading from the connections feeding it, so clients are pushed back on rather than the service buffering without
+# limit. Each plugin's dispatcher drains whatever is queued (up to max_batch, waiting up to batch_window for more)
+# and runs it as one batch on one checked-out instance, only restoring the instance's state between requests that
+# changed it. Every response carries the request's queue/run/total latency, and the 'stats' request aggregates them.
+#
+# Requests (one JSON object per line; 'id' is echoed back, and responses may arrive out of order):
+#   {"id": 1, "op": "render", "plugin": "builtin:Reverb", "midi": [[60, 100, 0.0, 1.0]], "duration": 2.0}
+#     optional: plugin_name, preset (path), state (base64 raw_state), parameters ({name: value}), sample_rate,
+#     num_channels, buffer_size, output (an audio file to write, rather than returning base64 float32 audio)
+#     preset: a raw_state .bin file, a parameter_presets.ParameterPreset (.json or .npz), or a .json dict of parameter
+#     names to values (see rendering.apply_preset)
+#   {"id": 2, "op": "state", "plugin": "...", "parameters": {...}}   -> the state (base64 raw_state, or a dict)
+#   {"id": 3, "op": "parameters", "plugin": "...", "preset": "..."} -> {parameter: value}
+#   {"id": 4, "op": "stats"} / {"id": 5, "op": "ping"}
+#
+# Responses:
+#   {"id": 1, "ok": true, "result": {...}, "timing": {"queue_seconds": ..., "run_seconds": ..., "total_seconds": ...,
+#    "batch_size": ...}}
+#   {"id": 1, "ok": false, "error": "ValueError: ..."}
+#
+# Example usage:
+#   python render_service.py serve --preload builtin:Reverb
+#   python render_service.py request '{"op": "render", "plugin": "builtin:Reverb", "midi": [[60, 100, 0, 1]], "output": "out.wav"}'
+#   python render_service.py request '{"op": "stats"}'
+#
+#   with RenderClient() as client:
+#       audio = client.render('/Library/Audio/Plug-Ins/VST3/Vital.vst3', [[60, 100, 0.0, 1.0]], preset='preset.bin')
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'poc-audio-pedalboard', 'render_service.sock')
+
+# Requests (and responses holding base64 audio) can be far longer than asyncio's default 64KiB line limit
+MAX_LINE_BYTES = 256 * 1024 * 1024
+
+QUEUED_OPS = ('render', 'state', 'parameters')
+
+
+def _percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': ordered[-1],
+    }
+
+
+class RenderService:
+    """
+    Serves render/state/parameter requests with warm plugin instances, micro-batching the requests for each plugin.
+
+    Args:
+      pool (plugin_pool.PluginPool, optional): The pool to check plugin instances out of.
+      max_batch (int): The most requests for one plugin run as a single batch.
+      batch_window (float): Seconds a dispatcher waits for more requests to join a batch once it has one.
+      queue_size (int): The most requests queued per plugin before the service stops reading more.
+      workers_per_plugin (int): The number of batches that may run at once for each plugin (each on its own
+        instance).
+      max_latency_samples (int): The number of recent latencies kept per op for the stats.
+    """
+
+    def __init__(
+        self,
+        pool=None,
+        max_batch=8,
+        batch_window=0.002,
+        queue_size=64,
+        workers_per_plugin=1,
+        max_latency_samples=10000,
+    ):
+        from midi_compiler import MidiCompiler
+        from plugin_pool import PluginPool
+
+        self.pool = pool or PluginPool()
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.queue_size = queue_size
+        self.workers_per_plugin = workers_per_plugin
+        self.midi_compiler = MidiCompiler()
+        self._midi_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(thread_name_prefix='render-service')
+        self._queues = {}
+        # Plugins known to load, and ones being loaded for the first time (before their queue is created)
+        self._loaded = set()
+        self._loading = {}
+        self._dispatchers = []
+        self._latencies = defaultdict(lambda: deque(maxlen=max_latency_samples))
+        self._queue_latencies = defaultdict(lambda: deque(maxlen=max_latency_samples))
+        self._metrics = {'requests': 0, 'errors': 0, 'batches': 0, 'batched_requests': 0, 'connections': 0}
+        self._started = time.time()
+
+    def preload(self, plugin_spec, plugin_name=None, count=1):
+        """
+        Load instances of a plugin ahead of time, so that the first requests for it are warm.
+        """
+        self.pool.preload(plugin_spec, plugin_name, count=count)
+        self._loaded.add((plugin_spec, plugin_name))
+
+    async def _queue(self, key):
+        queue = self._queues.get(key)
+        if queue is not None:
+            return queue
+        if key not in self._loaded:
+            # Load the plugin once before creating its queue (and dispatchers), so that requests for plugins that
+            # can't be loaded (eg. typos) fail without leaving a queue behind. Concurrent first requests share the load.
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.preload, *key
+                )
+            try:
+                await loading
+            finally:
+                self._loading.pop(key, None)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(maxsize=self.queue_size)
+            for _ in range(self.workers_per_plugin):
+                self._dispatchers.append(asyncio.get_running_loop().create_task(self._dispatch(key, queue)))
+        return queue
+
+    async def _dispatch(self, key, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(queue.get_nowait())
+
+            self._metrics['batches'] += 1
+            self._metrics['batched_requests'] += len(batch)
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self._run_batch, key, [r for r, _, _ in batch])
+            except Exception as e:
+                results = [(None, f"{type(e).__name__}: {e}", 0.0)] * len(batch)
+            for (request, future, received), (result, error, run_seconds) in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, error, {
+                        'queue_seconds': started - received,
+                        'run_seconds': run_seconds,
+                        'batch_size': len(batch),
+                    }))
+            for _ in batch:
+                queue.task_done()
+
+    def _run_batch(self, key, requests):
+        plugin_spec, plugin_name = key
+        results = []
+        pooled = self.pool.acquire(plugin_spec, plugin_name)
+        modified = False
+        try:
+            for request in requests:
+                if modified:
+                    # Get a clean instance for the next request (usually this one, restored to its baseline state and
+                    # validated, and only reloaded if that fails)
+                    self.pool.release(plugin_spec, pooled, plugin_name)
+                    pooled = None
+                    pooled = self.pool.acquire(plugin_spec, plugin_name)
+                started = time.perf_counter()
+                try:
+                    result, modified = self._execute(pooled, request)
+                    results.append((result, None, time.perf_counter() - started))
+                except Exception as e:
+                    results.append((None, f"{type(e).__name__}: {e}", time.perf_counter() - started))
+                    # The instance may be in any state after a failure (eg. a preset half applied)
+                    modified = True
+        except Exception as e:
+            # No clean instance could be acquired, so fail the rest of the batch (keeping the results that ran)
+            error = f"{type(e).__name__}: {e}"
+            results.extend((None, error, 0.0) for _ in requests[len(results):])
+        finally:
+            if pooled is not None:
+                self.pool.release(plugin_spec, pooled, plugin_name)
+        return results
+
+    def _load_midi(self, midi, sample_rate):
+        from rendering import load_midi
+
+        if isinstance(midi, str):
+            with self._midi_lock:
+                return self.midi_compiler.compile(midi, sample_rate).to_midi_events()
+        return load_midi(midi)
+
+    def _execute(self, pooled, request):
+        from helpers import capture_plugin_state, restore_plugin_state
+        from rendering import apply_preset, render_midi
+
+        plugin = pooled.plugin
+        modified = False
+        if request.get('preset'):
+            apply_preset(plugin, request['preset'])
+            modified = True
+        if request.get('state'):
+            restore_plugin_state(plugin, base64.b64decode(request['state']))
+            modified = True
+        if request.get('parameters'):
+            restore_plugin_state(plugin, request['parameters'])
+            modified = True
+
+        op = request['op']
+        if op == 'state':
+            state = capture_plugin_state(plugin)
+            if isinstance(state, bytes):
+                return {'raw_state': base64.b64encode(state).decode('ascii')}, modified
+            return {'parameters': state}, modified
+        if op == 'parameters':
+            return pooled.parameter_layout.capture().to_dict(), modified
+
+        sample_rate = int(request.get('sample_rate', 44100))
+        num_channels = int(request.get('num_channels', 2))
+        audio = render_midi(
+            plugin,
+            self._load_midi(request['midi'], sample_rate),
+            duration=float(request.get('duration', 1.0)),
+            sample_rate=sample_rate,
+            num_channels=num_channels,
+            buffer_size=int(request.get('buffer_size', 8192)),
+        )
+        if request.get('output'):
+            from pedalboard.io import AudioFile
+
+            with AudioFile(request['output'], 'w', sample_rate, audio.shape[0]) as f:
+                f.write(audio)
+            return {'output': request['output'], 'num_samples': audio.shape[-1]}, modified
+        return {
+            'audio': base64.b64encode(audio.astype('float32', copy=False).tobytes()).decode('ascii'),
+            'shape': list(audio.shape),
+            'dtype': 'float32',
+        }, modified
+
+    async def _respond(self, writer, write_lock, request_id, op, received, future):
+        result, error, timing = await future
+        timing['total_seconds'] = time.perf_counter() - received
+        if op in QUEUED_OPS:
+            self._latencies[op].append(timing['total_seconds'])
+            if 'queue_seconds' in timing:
+                self._queue_latencies[op].append(timing['queue_seconds'])
+        if error is None:
+            response = {'id': request_id, 'ok': True, 'result': result, 'timing': timing}
+        else:
+            self._metrics['errors'] += 1
+            response = {'id': request_id, 'ok': False, 'error': error, 'timing': timing}
+        async with write_lock:
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        pending = set()
+        self._metrics['connections'] += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                received = time.perf_counter()
+                self._metrics['requests'] += 1
+                future = loop.create_future()
+                request_id = None
+                op = 'invalid'
+                try:
+                    request = json.loads(line)
+                    request_id = request.get('id')
+                    op = request.get('op')
+                    if op == 'ping':
+                        future.set_result(({'pong': True}, None, {}))
+                    elif op == 'stats':
+                        future.set_result((self.stats(), None, {}))
+                    elif op in QUEUED_OPS:
+                        if op == 'render' and 'midi' not in request:
+                            raise ValueError("render requests need 'midi'")
+                        # Waits (and so stops reading this connection) while the plugin's queue is full
+                        queue = await self._queue((request['plugin'], request.get('plugin_name')))
+                        await queue.put((request, future, received))
+                    else:
+                        raise ValueError(f"Unknown op: {op!r}")
+                except Exception as e:
+                    # Invalid requests, and plugins that can't be loaded
+                    future.set_result((None, f"{type(e).__name__}: {e}", {}))
+                task = loop.create_task(self._respond(writer, write_lock, request_id, op, received, future))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stats(self):
+        """
+        Returns:
+          dict: Request, batch and error counts, per-op latency percentiles (total and queued), queue depths, and the
+            plugin pool's stats.
+        """
+        stats = dict(self._metrics)
+        stats['uptime_seconds'] = time.time() - self._started
+        stats['mean_batch_size'] = stats['batched_requests'] / stats['batches'] if stats['batches'] else 0.0
+        stats['latency_seconds'] = {op: _percentiles(samples) for op, samples in self._latencies.items()}
+        stats['queue_seconds'] = {op: _percentiles(samples) for op, samples in self._queue_latencies.items()}
+        stats['queued'] = {
+            key[0] if key[1] is None else f"{key[0]}:{key[1]}": queue.qsize() for key, queue in self._queues.items()
+        }
+        stats['pool'] = self.pool.stats()
+        return stats
+
+    async def serve(self, socket_path=None, host='127.0.0.1', port=None):
+        """
+        Serve requests until cancelled, on a Unix socket (the default) or a TCP port.
+
+        Args:
+          socket_path (str, optional): The Unix socket to listen on. Defaults to DEFAULT_SOCKET_PATH.
+          host (str): The host to listen on, when listening on a TCP port.
+          port (int, optional): The TCP port to listen on instead of a Unix socket.
+        """
+        if port is not None:
+            server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_LINE_BYTES)
+        else:
+            socket_path = socket_path or DEFAULT_SOCKET_PATH
+            os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+            if os.path.exists(socket_path):
+                # Left behind by a previous run
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self._handle_connection, socket_path, limit=MAX_LINE_BYTES)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for dispatcher in self._dispatchers:
+                dispatcher.cancel()
+            self._executor.shutdown(wait=False)
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+class RenderServiceError(RuntimeError):
+    pass
+
+
+class RenderClient:
+    """
+    A blocking client for the render service. Each client holds one connection, so use one client per thread.
+
+    Args:
+      socket_path (str, optional): The service's Unix socket. Defaults to DEFAULT_SOCKET_PATH.
+      host (str): The service's host, when connecting over TCP.
+      port (int, optional): The service's TCP port, to connect over TCP instead of a Unix socket.
+      timeout (float, optional): Socket timeout in seconds.
+    """
+
+    def __init__(self, socket_path=None, host='127.0.0.1', port=None, timeout=None):
+        if port is not None:
+            self._socket = socket.create_connection((host, port), timeout=timeout)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(socket_path or DEFAULT_SOCKET_PATH)
+        self._file = self._socket.makefile('rb')
+        self._next_id = 0
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send_many(self, requests):
+        """
+        Send several requests at once (so they can be batched together), and wait for all of their responses.
+
+        Args:
+          requests (list): The request dicts (see the top of this file). Any 'id' is replaced.
+
+        Returns:
+          list: The response dicts, in the same order as the requests.
+        """
+        ids = []
+        lines = []
+        for request in requests:
+            self._next_id += 1
+            ids.append(self._next_id)
+            lines.append(json.dumps({**request, 'id': self._next_id}).encode('utf-8') + b'\n')
+        self._socket.sendall(b''.join(lines))
+
+        responses = {}
+        while len(responses) < len(ids):
+            line = self._file.readline()
+            if not line:
+                raise RenderServiceError("The render service closed the connection")
+            response = json.loads(line)
+            responses[response['id']] = response
+        return [responses[request_id] for request_id in ids]
+
+    def request(self, op, **fields):
+        """
+        Send one request and wait for its result.
+
+        Returns:
+          The response's result.
+
+        Raises:
+          RenderServiceError: If the request failed.
+        """
+        response = self.send_many([{'op': op, **fields}])[0]
+        if not response['ok']:
+            raise RenderServiceError(response['error'])
+        return response['result']
+
+    def render(self, plugin, midi, **options):
+        """
+        Render some MIDI through a plugin.
+
+        Args:
+          plugin (str): The plugin path or 'builtin:<Name>' spec.
+          midi (str or list): A path to a .mid file, or a list of [note, velocity, start_seconds, end_seconds] notes.
+          **options: Any of the other render request fields (eg. preset, parameters, duration, output).
+
+        Returns:
+          numpy.ndarray or dict: The rendered audio, or the 'output' and 'num_samples' if an output file was given.
+        """
+        result = self.request('render', plugin=plugin, midi=midi, **options)
+        if 'audio' not in result:
+            return result
+        return decode_audio(result)
+
+    def state(self, plugin, **options):
+        """
+        Returns:
+          bytes or dict: The plugin's state after applying any preset/state/parameters (see
+            helpers.capture_plugin_state).
+        """
+        result = self.request('state', plugin=plugin, **options)
+        if 'raw_state' in result:
+            return base64.b64decode(result['raw_state'])
+        return result['parameters']
+
+    def parameters(self, plugin, **options):
+        """
+        Returns:
+          dict: The plugin's parameter values after applying any preset/state/parameters.
+        """
+        return self.request('parameters', plugin=plugin, **options)
+
+    def stats(self):
+        return self.request('stats')
+
+
+def decode_audio(result):
+    """
+    Decode the audio from a render response's result.
+
+    Returns:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples).
+    """
+    import numpy as np
+
+    return np.frombuffer(base64.b64decode(result['audio']), dtype=result['dtype']).reshape(result['shape'])
+
+
+def serve_command(args):
+    service = RenderService(
+        max_batch=args.max_batch,
+        batch_window=args.batch_window_ms / 1000,
+        queue_size=args.queue_size,
+        workers_per_plugin=args.workers_per_plugin,
+    )
+    for plugin_spec in args.preload or []:
+        print(f"Preloading {args.workers_per_plugin} instance(s) of {plugin_spec}..")
+        service.preload(plugin_spec, count=args.workers_per_plugin)
+    print(f"Serving on {f'{args.host}:{args.port}' if args.port is not None else args.socket}")
+    try:
+        asyncio.run(service.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+def request_command(args):
+    requests = [json.loads(request) for request in args.requests]
+    with RenderClient(args.socket, args.host, args.port) as client:
+        for response in client.send_many(requests):
+            print(json.dumps(response, indent=2))
+
+
+def build_parser():
+    connection_parser = argparse.ArgumentParser(add_help=False)
+    connection_parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="Unix socket. [Default: %(default)s]")
+    connection_parser.add_argument('--host', default='127.0.0.1', help="[Default: %(default)s]")
+    connection_parser.add_argument('--port', type=int, default=None, help="Use this localhost TCP port instead of the Unix socket.")
+
+    parser = argparse.ArgumentParser(description="A local render service holding warm plugin instances.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser('serve', parents=[connection_parser], help="Run the render service.")
+    serve_parser.add_argument(
+        '--preload',
+        action='append',
+        default=None,
+        help="Plugin path or 'builtin:<Name>' spec to load before serving (may be repeated).",
+    )
+    serve_parser.add_argument('--max-batch', type=int, default=8, help="Most requests per batch. [Default: %(default)s]")
+    serve_parser.add_argument(
+        '--batch-window-ms',
+        type=float,
+        default=2.0,
+        help="Milliseconds to wait for more requests to join a batch. [Default: %(default)s]",
+    )
+    serve_parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=64,
+        help="Most requests queued per plugin before applying backpressure. [Default: %(default)s]",
+    )
+    serve_parser.add_argument(
+        '--workers-per-plugin',
+        type=int,
+        default=1,
+        help="Batches run at once per plugin, each on its own instance. [Default: %(default)s]",
+    )
+    serve_parser.set_defaults(handler=serve_command)
+
+    request_parser = subparsers.add_parser(
+        'request',
+        parents=[connection_parser],
+        help="Send JSON requests to a running service and print the responses.",
+    )
+    request_parser.add_argument('requests', nargs='+', help="Request JSON objects (see the top of render_service.py).")
+    request_parser.set_defaults(handler=request_command)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+# Helpers for rendering MIDI through a plugin, shared by the offline rendering tools.
+#
+# MIDI is normalised to a sorted list of (midi_bytes, timestamp_in_seconds) tuples, which is one of the formats that
+# pedalboard's ExternalPlugin.process accepts directly:
+#   https://spotify.github.io/pedalboard/reference/pedalboard.html#pedalboard.ExternalPlugin.process
+#
+# When the plugin is an effect rather than an instrument (eg. one of pedalboard's built-in plugins standing in for a
+# synth on headless Linux), the MIDI is first turned into a simple sine tone which is then run through the effect.
+
+import json
+from bisect import bisect_left
+
+import numpy as np
+
+from helpers import restore_plugin_state
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+
+def note_events(notes):
+    """
+    Convert a list of notes into MIDI events.
+
+    Args:
+      notes (list): A list of [note, velocity, start_seconds, end_seconds] entries.
+
+    Returns:
+      list: A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+    """
+    events = []
+    for note, velocity, start, end in notes:
+        events.append((bytes([NOTE_ON, int(note), int(velocity)]), float(start)))
+        events.append((bytes([NOTE_OFF, int(note), 0]), float(end)))
+    return sorted(events, key=lambda event: event[1])
+
+
+def normalize_midi_messages(midi_messages):
+    """
+    Normalise MIDI messages into (midi_bytes, timestamp_in_seconds) tuples.
+
+    Args:
+      midi_messages (list): mido.Message objects (with an absolute 'time' in seconds), or (bytes, seconds) tuples.
+
+    Returns:
+      list: A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+    """
+    events = []
+    for message in midi_messages:
+        if isinstance(message, tuple):
+            midi_bytes, time = message
+        else:
+            midi_bytes, time = message.bytes(), message.time
+        events.append((bytes(midi_bytes), float(time)))
+    return sorted(events, key=lambda event: event[1])
+
+
+def load_midi_file(midi_path):
+    """
+    Load the messages from a MIDI file, with absolute timestamps in seconds.
+
+    Args:
+      midi_path (str): The path to the .mid file.
+
+    Returns:
+      list: A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+    """
+    from mido import MidiFile
+
+    events = []
+    time = 0.0
+    # Iterating a MidiFile yields messages with their delta time converted to seconds (using the tempo map)
+    for message in MidiFile(midi_path):
+        time += message.time
+        if not message.is_meta:
+            events.append((bytes(message.bytes()), time))
+    return events
+
+
+def load_midi(midi):
+    """
+    Load MIDI from any of the forms accepted in a render job.
+
+    Args:
+      midi (str or list): A path to a .mid file, or a list of [note, velocity, start_seconds, end_seconds] notes.
+
+    Returns:
+      list: A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+    """
+    if isinstance(midi, str):
+        return load_midi_file(midi)
+    return note_events(midi)
+
+
+def apply_preset(plugin, preset_path):
+    """
+    Apply a preset file to a plugin.
+
+    A '.json' preset holds either a parameter_presets.ParameterPreset or a dict of parameter names to values (set as
+    plugin attributes), and a '.npz' preset a binary ParameterPreset. Anything else is treated as a raw_state blob (eg.
+    as written by synth_vst_loader.py state).
+
+    Args:
+      plugin (pedalboard.Plugin): The plugin to apply the preset to.
+      preset_path (str): The path to the preset file.
+    """
+    if preset_path.endswith('.json'):
+        with open(preset_path) as f:
+            data = json.load(f)
+        from parameter_presets import ParameterPreset, apply_parameter_preset, is_preset_json
+
+        if is_preset_json(data):
+            apply_parameter_preset(plugin, ParameterPreset.from_json(data))
+        else:
+            restore_plugin_state(plugin, data)
+    elif preset_path.endswith('.npz'):
+        from parameter_presets import ParameterPreset, apply_parameter_preset
+
+        apply_parameter_preset(plugin, ParameterPreset.load(preset_path))
+    else:
+        with open(preset_path, 'rb') as f:
+            restore_plugin_state(plugin, f.read())
+
+
+def synthesize_midi_input(midi_events, start_sample, num_samples, sample_rate, num_channels):
+    """
+    Synthesize a simple sine tone for the notes in some MIDI events, to feed into an effect plugin.
+
+    The tone is a pure function of the absolute sample position, so any block of it can be generated on its own and
+    the blocks will join up exactly.
+
+    Args:
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      start_sample (int): The absolute sample position of the first sample to generate.
+      num_samples (int): The number of samples to generate.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+
+    Returns:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples).
+    """
+    output = np.zeros(num_samples, dtype=np.float64)
+    end_sample = start_sample + num_samples
+    active_notes = {}
+    notes = []
+    for midi_bytes, time in midi_events:
+        status = midi_bytes[0] & 0xF0
+        note = midi_bytes[1] if len(midi_bytes) > 1 else None
+        velocity = midi_bytes[2] if len(midi_bytes) > 2 else 0
+        position = int(time * sample_rate)
+        if status == NOTE_ON and velocity > 0:
+            active_notes[note] = (position, velocity)
+        elif status in (NOTE_ON, NOTE_OFF) and note in active_notes:
+            notes.append((note, *active_notes.pop(note), position))
+    notes.extend((note, position, velocity, None) for note, (position, velocity) in active_notes.items())
+
+    for note, note_start, velocity, note_end in notes:
+        first = max(note_start, start_sample)
+        last = end_sample if note_end is None else min(note_end, end_sample)
+        if first >= last:
+            continue
+        frequency = 440.0 * 2.0 ** ((note - 69) / 12.0)
+        positions = np.arange(first - note_start, last - note_start, dtype=np.float64)
+        output[first - start_sample:last - start_sample] += (
+            (velocity / 127.0) * 0.2 * np.sin(2.0 * np.pi * frequency * positions / sample_rate)
+        )
+    return np.repeat(output.astype(np.float32)[np.newaxis, :], num_channels, axis=0)
+
+
+def render_midi(plugin, midi_events, duration, sample_rate, num_channels, buffer_size=8192, reset=True):
+    """
+    Render some MIDI through a plugin.
+
+    Args:
+      plugin (pedalboard.Plugin): An instrument plugin, or an effect plugin to run a sine tone of the notes through.
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      duration (float): The number of seconds of audio to render.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      buffer_size (int): The buffer size the plugin processes audio in.
+      reset (bool): Whether to reset the plugin before rendering.
+
+    Returns:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples).
+    """
+    if plugin.is_instrument:
+        return plugin(
+            midi_events,
+            duration=duration,
+            sample_rate=sample_rate,
+            num_channels=num_channels,
+            buffer_size=buffer_size,
+            reset=reset,
+        )
+    num_samples = int(duration * sample_rate)
+    input_audio = synthesize_midi_input(midi_events, 0, num_samples, sample_rate, num_channels)
+    return plugin(input_audio, sample_rate, buffer_size=buffer_size, reset=reset)
+
+
+def midi_event_positions(midi_events, sample_rate):
+    """
+    Get the sample position of each MIDI event, using the same timestamp -> sample conversion (truncation) that
+    pedalboard uses.
+
+    Args:
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      sample_rate (int): The sample rate.
+
+    Returns:
+      list: The sample position of each event.
+    """
+    return [int(time * sample_rate) for _, time in midi_events]
+
+
+def _block_events(midi_events, event_positions, block_start, block_end, sample_rate):
+    first = bisect_left(event_positions, block_start)
+    last = bisect_left(event_positions, block_end)
+    # Re-time each event relative to the start of the block. The extra quarter sample means the plugin lands the
+    # event on exactly the same sample as it would in a one-shot render, regardless of float rounding.
+    return [
+        (midi_events[i][0], (event_positions[i] - block_start + 0.25) / sample_rate)
+        for i in range(first, last)
+    ]
+
+
+def iter_render_blocks(
+    plugin,
+    midi_events,
+    duration,
+    sample_rate,
+    num_channels,
+    block_size=65536,
+    buffer_size=8192,
+    reset=True,
+):
+    """
+    Render some MIDI through a plugin in fixed-size blocks, keeping the plugin's state across blocks.
+
+    As long as block_size is a multiple of buffer_size, the plugin sees exactly the same sequence of buffers (and MIDI
+    events at the same sample offsets) as a one-shot render_midi call, so the concatenated blocks are bit-identical
+    to it.
+
+    Args:
+      plugin (pedalboard.Plugin): An instrument plugin, or an effect plugin to run a sine tone of the notes through.
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      duration (float): The number of seconds of audio to render.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      block_size (int): The number of samples to render per block.
+      buffer_size (int): The buffer size the plugin processes audio in.
+      reset (bool): Whether to reset the plugin before rendering the first block.
+
+    Yields:
+      numpy.ndarray: A float32 array of shape (num_channels, block_samples) for each block.
+    """
+    if block_size % buffer_size:
+        raise ValueError(f"block_size ({block_size}) must be a multiple of buffer_size ({buffer_size})")
+
+    num_samples = int(duration * sample_rate)
+    event_positions = midi_event_positions(midi_events, sample_rate)
+
+    for block_start in range(0, num_samples, block_size):
+        yield render_midi_segment(
+            plugin,
+            midi_events,
+            event_positions,
+            block_start,
+            min(block_size, num_samples - block_start),
+            sample_rate,
+            num_channels,
+            buffer_size=buffer_size,
+            reset=reset and block_start == 0,
+        )
+
+
+def render_midi_segment(
+    plugin,
+    midi_events,
+    event_positions,
+    start_sample,
+    num_samples,
+    sample_rate,
+    num_channels,
+    buffer_size=8192,
+    reset=False,
+):
+    """
+    Render one segment of some MIDI through a plugin, continuing from the plugin's current state.
+
+    Rendering consecutive segments (resetting only before the first) renders the same audio as a one-shot render,
+    except that the plugin's buffers are split at the segment boundaries, eg. so that parameters can be changed at
+    exact sample positions between segments.
+
+    Args:
+      plugin (pedalboard.Plugin): An instrument plugin, or an effect plugin to run a sine tone of the notes through.
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      event_positions (list): The sample position of each event (see midi_event_positions).
+      start_sample (int): The absolute sample position the segment starts at.
+      num_samples (int): The number of samples to render.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      buffer_size (int): The (maximum) buffer size the plugin processes audio in.
+      reset (bool): Whether to reset the plugin before rendering the segment.
+
+    Returns:
+      numpy.ndarray: A float32 array of shape (num_channels, num_samples).
+    """
+    if plugin.is_instrument:
+        return plugin(
+            _block_events(midi_events, event_positions, start_sample, start_sample + num_samples, sample_rate),
+            duration=(num_samples + 0.25) / sample_rate,
+            sample_rate=sample_rate,
+            num_channels=num_channels,
+            buffer_size=buffer_size,
+            reset=reset,
+        )
+    input_audio = synthesize_midi_input(midi_events, start_sample, num_samples, sample_rate, num_channels)
+    return plugin(input_audio, sample_rate, buffer_size=buffer_size, reset=reset)
+
+
+def render_midi_to_file(
+    plugin,
+    midi_events,
+    output_path,
+    duration,
+    sample_rate,
+    num_channels,
+    block_size=65536,
+    buffer_size=8192,
+    reset=True,
+):
+    """
+    Render some MIDI through a plugin straight to an audio file, one block at a time.
+
+    Peak memory is bounded by the block size rather than the length of the render.
+
+    Args:
+      plugin (pedalboard.Plugin): An instrument plugin, or an effect plugin to run a sine tone of the notes through.
+      midi_events (list): A sorted list of (midi_bytes, timestamp_in_seconds) tuples.
+      output_path (str): The audio file to write.
+      duration (float): The number of seconds of audio to render.
+      sample_rate (int): The sample rate.
+      num_channels (int): The number of output channels.
+      block_size (int): The number of samples to render per block (a multiple of buffer_size).
+      buffer_size (int): The buffer size the plugin processes audio in.
+      reset (bool): Whether to reset the plugin before rendering.
+
+    Returns:
+      int: The number of samples written.
+    """
+    from pedalboard.io import AudioFile
+
+    num_samples_written = 0
+    with AudioFile(output_path, 'w', sample_rate, num_channels) as f:
+        for block in iter_render_blocks(
+            plugin,
+            midi_events,
+            duration,
+            sample_rate,
+            num_channels,
+            block_size=block_size,
+            buffer_size=buffer_size,
+            reset=reset,
+        ):
+            f.write(block)
+            num_samples_written += block.shape[-1]
+    return num_samples_written
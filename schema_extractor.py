@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+
+# Extract the parameter schema of every indexed plugin into a cached SQLite database.
+#
+# Each plugin is loaded in its own subprocess (a few at a time), so a plugin that crashes, hangs or leaks can't take
+# down the extraction: it's recorded as 'crashed', 'timeout' or 'error' and the rest carry on. For every parameter,
+# every property listed in helpers.PARAMETER_PROPERTIES is recorded. Plugins whose bundle mtime hasn't changed since
+# they were last extracted (successfully or not) are skipped, so re-running only loads new or updated plugins.
+#
+# VST3 vs AudioUnit comparisons (like helpers.compare_plugin_parameters, but for every plugin installed in both
+# formats) then run in parallel straight from the database, without loading any plugin again.
+#
+# Layout:
+#   plugins(path, format, name, vendor, mtime, status, error, elapsed_seconds, extracted_at, info)
+#   parameters(plugin_path, position, key, properties)   (properties is a JSON object)
+#
+# Example usage:
+#   python schema_extractor.py extract --timeout 30 --workers 4
+#   python schema_extractor.py extract Vital Serum --force
+#   python schema_extractor.py extract Bundle --plugin-name "Bundle Synth" --force
+#   python schema_extractor.py show Vital
+#   python schema_extractor.py compare --output schema_comparison.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from plugin_index import DEFAULT_INDEX_PATH, PluginIndex
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'poc-audio-pedalboard', 'plugin_schemas.sqlite')
+
+SCHEMA_VERSION = 1
+
+# Passed as the first argument to run this script as an extraction subprocess
+WORKER_COMMAND = '_extract_worker'
+
+# The amount of a failed subprocess's stderr to keep as its error
+MAX_ERROR_LENGTH = 2000
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, type):
+        # eg. the 'type' property
+        return value.__name__
+    return str(value)
+
+
+def extract_plugin_schema(plugin_path, plugin_name=None):
+    """
+    Load a plugin (in this process) and read every property of every one of its parameters.
+
+    Args:
+      plugin_path (str): The path to the plugin.
+      plugin_name (str, optional): The plugin name to load from a plugin file containing multiple plugins.
+
+    Returns:
+      dict: The plugin's 'info' (including the plugin_name it was loaded with), and its 'parameters' as a list of
+        [key, properties] pairs in parameter order.
+    """
+    from pedalboard import load_plugin
+
+    from helpers import PARAMETER_PROPERTIES
+
+    plugin = load_plugin(plugin_path, plugin_name=plugin_name)
+    info = {
+        attribute: _jsonable(getattr(plugin, attribute, None))
+        for attribute in ('name', 'descriptive_name', 'manufacturer_name', 'identifier', 'version', 'category')
+    }
+    info['is_instrument'] = plugin.is_instrument
+    info['is_effect'] = plugin.is_effect
+    info['plugin_name'] = plugin_name
+
+    parameters = []
+    for key, parameter in plugin.parameters.items():
+        properties = {}
+        for property_name in PARAMETER_PROPERTIES:
+            try:
+                properties[property_name] = _jsonable(getattr(parameter, property_name))
+            except Exception:
+                # Some plugins throw from individual property getters, eg. for parameters without a text value
+                properties[property_name] = None
+        parameters.append([key, properties])
+    return {'info': info, 'parameters': parameters}
+
+
+def _worker_main(plugin_path, result_path, plugin_name=None):
+    try:
+        result = extract_plugin_schema(plugin_path, plugin_name)
+    except Exception as e:
+        result = {'error': f"{type(e).__name__}: {e}"}
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def run_extraction_subprocess(plugin_path, timeout, plugin_name=None):
+    """
+    Extract a plugin's schema in a fresh subprocess, so that it can't crash or hang the caller.
+
+    Args:
+      plugin_path (str): The path to the plugin.
+      timeout (float): The number of seconds to wait for the plugin to load and be read before killing it.
+      plugin_name (str, optional): The plugin name to load from a plugin file containing multiple plugins.
+
+    Returns:
+      dict: The 'status' ('ok', 'error', 'timeout' or 'crashed'), the 'elapsed_seconds', and either the extracted
+        'info' and 'parameters' (see extract_plugin_schema) or an 'error' message.
+    """
+    fd, result_path = tempfile.mkstemp(prefix='plugin-schema-', suffix='.json')
+    os.close(fd)
+    command = [sys.executable, os.path.abspath(__file__), WORKER_COMMAND, plugin_path, result_path]
+    if plugin_name is not None:
+        command.append(plugin_name)
+    started = time.perf_counter()
+    try:
+        try:
+            completed = subprocess.run(
+                command,
+                stdin=subprocess.DEVNULL,
+                # Plugins can be chatty on stdout, so only stderr is kept (for the error message)
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return {
+                'status': 'timeout',
+                'elapsed_seconds': time.perf_counter() - started,
+                'error': f"Timed out after {timeout}s",
+            }
+        elapsed = time.perf_counter() - started
+        stderr = completed.stderr.decode('utf-8', errors='replace')[-MAX_ERROR_LENGTH:]
+
+        if completed.returncode < 0:
+            try:
+                signal_name = signal.Signals(-completed.returncode).name
+            except ValueError:
+                signal_name = f"signal {-completed.returncode}"
+            return {'status': 'crashed', 'elapsed_seconds': elapsed, 'error': f"Killed by {signal_name}. {stderr}".strip()}
+
+        try:
+            with open(result_path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            result = {'error': stderr or f"Exited with code {completed.returncode} without a result"}
+        result['status'] = 'error' if 'error' in result else 'ok'
+        result['elapsed_seconds'] = elapsed
+        return result
+    finally:
+        os.remove(result_path)
+
+
+class SchemaDatabase:
+    """
+    The cached parameter schemas of the installed plugins.
+
+    Args:
+      db_path (str): The SQLite database file.
+      read_only (bool): Open the database read-only (eg. from comparison worker processes).
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, read_only=False):
+        self.db_path = db_path
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        else:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self.connection = sqlite3.connect(db_path)
+            self._create_tables()
+
+    def _create_tables(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        with self.connection:
+            if version != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS parameters')
+                self.connection.execute('DROP TABLE IF EXISTS plugins')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS plugins ('
+                ' path TEXT PRIMARY KEY, format TEXT, name TEXT, vendor TEXT, mtime REAL,'
+                ' status TEXT, error TEXT, elapsed_seconds REAL, extracted_at REAL, info TEXT)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS parameters ('
+                ' plugin_path TEXT, position INTEGER, key TEXT, properties TEXT,'
+                ' PRIMARY KEY (plugin_path, key))'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS plugins_by_name ON plugins (name COLLATE NOCASE)')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        self.connection.close()
+
+    def plugin(self, plugin_path):
+        """
+        Get a plugin's extraction record.
+
+        Returns:
+          dict or None: The plugin's path, format, name, vendor, mtime, status, error, elapsed_seconds, extracted_at
+            and info, or None if it hasn't been extracted.
+        """
+        cursor = self.connection.execute('SELECT * FROM plugins WHERE path = ?', (plugin_path,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        record = dict(zip([column[0] for column in cursor.description], row))
+        record['info'] = json.loads(record['info']) if record['info'] else None
+        return record
+
+    def plugins(self, status=None):
+        """
+        List the extracted plugins.
+
+        Args:
+          status (str, optional): Only list the plugins with this status.
+
+        Returns:
+          list: The plugin records (see plugin), sorted by name.
+        """
+        query = 'SELECT path FROM plugins'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        paths = [row[0] for row in self.connection.execute(query + ' ORDER BY name COLLATE NOCASE, path', params)]
+        return [self.plugin(path) for path in paths]
+
+    def needs_extraction(self, entry, retry_failed=False):
+        """
+        Whether a plugin index entry is new, or has changed since it was last extracted.
+
+        Args:
+          entry (dict): The plugin_index.PluginIndex entry.
+          retry_failed (bool): Also retry plugins that previously errored, timed out or crashed.
+        """
+        row = self.connection.execute('SELECT mtime, status FROM plugins WHERE path = ?', (entry['path'],)).fetchone()
+        if row is None or row[0] != entry['mtime']:
+            return True
+        return retry_failed and row[1] != 'ok'
+
+    def record(self, entry, result):
+        """
+        Store the result of extracting a plugin, replacing any previous result.
+
+        Args:
+          entry (dict): The plugin_index.PluginIndex entry.
+          result (dict): The result of run_extraction_subprocess.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM parameters WHERE plugin_path = ?', (entry['path'],))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO plugins VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    entry['path'],
+                    entry['format'],
+                    entry['name'],
+                    entry['vendor'],
+                    entry['mtime'],
+                    result['status'],
+                    result.get('error'),
+                    result['elapsed_seconds'],
+                    time.time(),
+                    json.dumps(result['info']) if 'info' in result else None,
+                ),
+            )
+            self.connection.executemany(
+                'INSERT INTO parameters VALUES (?, ?, ?, ?)',
+                (
+                    (entry['path'], position, key, json.dumps(properties))
+                    for position, (key, properties) in enumerate(result.get('parameters', []))
+                ),
+            )
+
+    def schema(self, plugin_path):
+        """
+        Get a plugin's parameter schema.
+
+        Returns:
+          dict: Parameter key -> properties (see helpers.PARAMETER_PROPERTIES), in parameter order.
+        """
+        return {
+            key: json.loads(properties)
+            for key, properties in self.connection.execute(
+                'SELECT key, properties FROM parameters WHERE plugin_path = ? ORDER BY position', (plugin_path,)
+            )
+        }
+
+    def format_pairs(self):
+        """
+        Find the plugins that were extracted successfully in both VST3 and AudioUnit formats, matched by name.
+
+        Returns:
+          list: (name, vst3_path, au_path) tuples.
+        """
+        return self.connection.execute(
+            'SELECT vst3.name, vst3.path, au.path FROM plugins vst3'
+            ' JOIN plugins au ON au.name = vst3.name COLLATE NOCASE'
+            " WHERE vst3.format = 'VST3' AND au.format = 'AudioUnit' AND vst3.status = 'ok' AND au.status = 'ok'"
+            ' ORDER BY vst3.name COLLATE NOCASE'
+        ).fetchall()
+
+
+def extract_schemas(entries, schema_db, timeout=60.0, workers=None, force=False, retry_failed=False):
+    """
+    Extract the parameter schemas of some plugins into the database, each in its own subprocess.
+
+    Args:
+      entries (list): plugin_index.PluginIndex entries, optionally with a 'plugin_name' to load from a plugin file
+        containing multiple plugins.
+      schema_db (SchemaDatabase): The database to store the schemas in.
+      timeout (float): The number of seconds to allow each plugin before killing it.
+      workers (int, optional): The number of plugins to extract at once. Defaults to the number of CPUs.
+      force (bool): Re-extract every plugin, even those that haven't changed.
+      retry_failed (bool): Re-extract plugins that previously errored, timed out or crashed.
+
+    Yields:
+      tuple: (entry, result) for each extracted plugin, in completion order.
+    """
+    pending = [entry for entry in entries if force or schema_db.needs_extraction(entry, retry_failed)]
+    if not pending:
+        return
+    # The work happens in the subprocesses, so threads are enough to drive them (and keep the database on this thread)
+    with ThreadPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(pending))) as executor:
+        futures = {
+            executor.submit(run_extraction_subprocess, entry['path'], timeout, entry.get('plugin_name')): entry
+            for entry in pending
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            result = future.result()
+            schema_db.record(entry, result)
+            yield entry, result
+
+
+def compare_schemas(vst3_schema, au_schema):
+    """
+    Compare the parameter schemas of the VST3 and AudioUnit versions of a plugin.
+
+    Args:
+      vst3_schema (dict): The VST3 plugin's parameter key -> properties.
+      au_schema (dict): The AudioUnit plugin's parameter key -> properties.
+
+    Returns:
+      dict: The keys 'only_in_vst3' and 'only_in_au', the number of parameters 'in_both', and the properties that
+        'differ' between formats for parameters in both (key -> property -> [vst3_value, au_value]).
+    """
+    in_both = [key for key in vst3_schema if key in au_schema]
+    differ = {}
+    for key in in_both:
+        vst3_properties, au_properties = vst3_schema[key], au_schema[key]
+        different = {
+            property_name: [vst3_properties.get(property_name), au_properties.get(property_name)]
+            for property_name in vst3_properties.keys() | au_properties.keys()
+            if vst3_properties.get(property_name) != au_properties.get(property_name)
+        }
+        if different:
+            differ[key] = dict(sorted(different.items()))
+    return {
+        'only_in_vst3': [key for key in vst3_schema if key not in au_schema],
+        'only_in_au': [key for key in au_schema if key not in vst3_schema],
+        'in_both': len(in_both),
+        'differ': differ,
+    }
+
+
+# Per-process state for comparison workers
+_worker = {}
+
+
+def _init_compare_worker(db_path):
+    _worker['schema_db'] = SchemaDatabase(db_path, read_only=True)
+
+
+def _compare_pair(pair):
+    name, vst3_path, au_path = pair
+    schema_db = _worker['schema_db']
+    comparison = compare_schemas(schema_db.schema(vst3_path), schema_db.schema(au_path))
+    return {'name': name, 'vst3_path': vst3_path, 'au_path': au_path, **comparison}
+
+
+def compare_formats(db_path=DEFAULT_DB_PATH, names=None, workers=None, chunksize=4):
+    """
+    Compare the VST3 and AudioUnit parameter schemas of every plugin installed in both formats, from the database.
+
+    Args:
+      db_path (str): The SQLite database file.
+      names (list, optional): Only compare plugins whose name contains one of these (case insensitive).
+      workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+      chunksize (int): The number of plugins handed to a worker at a time.
+
+    Returns:
+      list: The comparison of each plugin (see compare_schemas, plus its 'name', 'vst3_path' and 'au_path'), sorted
+        by name.
+    """
+    schema_db = SchemaDatabase(db_path, read_only=True)
+    try:
+        pairs = schema_db.format_pairs()
+    finally:
+        schema_db.close()
+    if names:
+        filters = [name.lower() for name in names]
+        pairs = [pair for pair in pairs if any(f in pair[0].lower() for f in filters)]
+    if not pairs:
+        return []
+
+    with multiprocessing.Pool(
+        processes=min(workers or os.cpu_count() or 1, len(pairs)),
+        initializer=_init_compare_worker,
+        initargs=(db_path,),
+    ) as pool:
+        return pool.map(_compare_pair, pairs, chunksize=chunksize)
+
+
+def _summarize_error(error, max_length=200):
+    # Errors (eg. pedalboard's load errors) can span several lines
+    summary = ' '.join((error or '').split())
+    return summary if len(summary) <= max_length else summary[:max_length - 3] + '...'
+
+
+def _filter_entries(plugin_index, names):
+    if not names:
+        return plugin_index.plugins
+    seen = set()
+    entries = []
+    for name in names:
+        for entry in plugin_index.search(name):
+            if entry['path'] not in seen:
+                seen.add(entry['path'])
+                entries.append(entry)
+    return entries
+
+
+def extract_command(args):
+    plugin_index = PluginIndex(args.plugin_index, args.plugin_dir)
+    plugin_index.refresh()
+    entries = _filter_entries(plugin_index, args.names)
+    if args.plugin_name is not None:
+        entries = [dict(entry, plugin_name=args.plugin_name) for entry in entries]
+
+    schema_db = SchemaDatabase(args.db)
+    started = time.perf_counter()
+    counts = {}
+    try:
+        for entry, result in extract_schemas(
+            entries,
+            schema_db,
+            timeout=args.timeout,
+            workers=args.workers,
+            force=args.force,
+            retry_failed=args.retry_failed,
+        ):
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if result['status'] == 'ok':
+                detail = f"{len(result['parameters'])} parameters"
+            else:
+                detail = _summarize_error(result['error'])
+            print(f"  [{result['status']}] {entry['name']} ({entry['format']}, {result['elapsed_seconds']:.1f}s): {detail}")
+    finally:
+        schema_db.close()
+
+    num_extracted = sum(counts.values())
+    summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(
+        f"Extracted {num_extracted} of {len(entries)} plugins ({len(entries) - num_extracted} unchanged) "
+        f"in {time.perf_counter() - started:.1f}s{': ' + summary if summary else ''}"
+    )
+
+
+def show_command(args):
+    schema_db = SchemaDatabase(args.db)
+    try:
+        filters = [name.lower() for name in args.names]
+        for record in schema_db.plugins(status=args.status):
+            if filters and not any(f in record['path'].lower() for f in filters):
+                continue
+            print(f"[{record['status']}] {record['name']} ({record['format']}): {record['path']}")
+            if record['error']:
+                print(f"  Error: {_summarize_error(record['error'])}")
+            if args.parameters:
+                for key, properties in schema_db.schema(record['path']).items():
+                    print(f"  {key}: {json.dumps(properties)}")
+    finally:
+        schema_db.close()
+
+
+def compare_command(args):
+    comparisons = compare_formats(args.db, names=args.names, workers=args.workers)
+    for comparison in comparisons:
+        print(
+            f"{comparison['name']}: {comparison['in_both']} parameters in both, "
+            f"{len(comparison['only_in_vst3'])} only in VST3, {len(comparison['only_in_au'])} only in AU, "
+            f"{len(comparison['differ'])} with differing properties"
+        )
+    print(f"Compared {len(comparisons)} plugins installed as both VST3 and AudioUnit.")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(comparisons, f, indent=2)
+        print(f"Wrote the comparisons to {args.output}")
+
+
+def build_parser():
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument('--db', default=DEFAULT_DB_PATH, help="The schema database. [Default: %(default)s]")
+    common_parser.add_argument(
+        'names',
+        nargs='*',
+        help="Only include plugins whose path contains one of these names. [Default: all plugins]",
+    )
+
+    parser = argparse.ArgumentParser(description="Extract and compare the parameter schemas of the installed plugins.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    extract_parser = subparsers.add_parser(
+        'extract',
+        parents=[common_parser],
+        help="Extract the schemas of new and changed plugins, each in its own subprocess.",
+    )
+    extract_parser.add_argument('--plugin-index', default=DEFAULT_INDEX_PATH, help="[Default: %(default)s]")
+    extract_parser.add_argument(
+        '--plugin-dir',
+        action='append',
+        default=None,
+        help="Plugin directory to index (may be repeated). [Default: the standard plugin directories]",
+    )
+    extract_parser.add_argument(
+        '--plugin-name',
+        default=None,
+        help="Plugin name to load from plugin files containing multiple plugins (recorded in each plugin's info).",
+    )
+    extract_parser.add_argument('--timeout', type=float, default=60.0, help="Seconds allowed per plugin. [Default: %(default)s]")
+    extract_parser.add_argument('--workers', type=int, default=None, help="Plugins extracted at once. [Default: CPU count]")
+    extract_parser.add_argument('--force', action='store_true', help="Re-extract every plugin, even unchanged ones.")
+    extract_parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help="Re-extract plugins that previously errored, timed out or crashed.",
+    )
+    extract_parser.set_defaults(handler=extract_command)
+
+    show_parser = subparsers.add_parser('show', parents=[common_parser], help="Show the extracted plugins.")
+    show_parser.add_argument('--status', default=None, choices=['ok', 'error', 'timeout', 'crashed'])
+    show_parser.add_argument('--parameters', action='store_true', help="Also show every parameter's properties.")
+    show_parser.set_defaults(handler=show_command)
+
+    compare_parser = subparsers.add_parser(
+        'compare',
+        parents=[common_parser],
+        help="Compare the VST3 and AudioUnit schemas of every plugin installed in both formats.",
+    )
+    compare_parser.add_argument('--workers', type=int, default=None, help="Worker processes. [Default: CPU count]")
+    compare_parser.add_argument('--output', default=None, help="Write the full comparisons to this JSON file.")
+    compare_parser.set_defaults(handler=compare_command)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    # <plugin_path> <result_path> [<plugin_name>]
+    if len(sys.argv) in (4, 5) and sys.argv[1] == WORKER_COMMAND:
+        _worker_main(*sys.argv[2:])
+    else:
+        main()
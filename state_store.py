@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+# A content-addressed, deduplicated store for plugin raw_state blobs.
+#
+# Each blob is stored under the SHA-256 of its contents, so identical states are only ever stored once. Later versions
+# of a state are stored as a binary delta against a full base blob (as long as the delta is meaningfully smaller), which
+# keeps histories of states that only differ in a few bytes small on disk and fast to write.
+#
+# Layout:
+#   <root>/objects/<digest[:2]>/<digest>   zlib-compressed full blob ('F') or delta ('D')
+#   <root>/history.jsonl                   one {"digest", "label", "time"} entry per put
+#
+# Example usage:
+#   store = StateStore('states')
+#   initial_digest = store.put(initial_synth_raw_state, label='initial')
+#   new_digest = store.put(new_synth_raw_state, base=initial_digest, label='new')
+#   print(diff_ranges(store.get(initial_digest), store.get(new_digest)))
+#
+#   python state_store.py states synth_raw_state_initial.bin synth_raw_state_new.bin
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+
+FULL_OBJECT = b'F'
+DELTA_OBJECT = b'D'
+
+_COPY_OP = b'C'
+_INSERT_OP = b'I'
+
+# Changed runs separated by fewer unchanged bytes than this are merged, as each delta op costs more than that
+DEFAULT_MERGE_GAP = 16
+
+
+def state_digest(blob):
+    return hashlib.sha256(blob).hexdigest()
+
+
+def _merge_runs(starts, ends, merge_gap):
+    import numpy as np
+
+    if not len(starts):
+        return []
+    # Start a new range wherever the gap since the previous run's end is at least merge_gap
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] >= merge_gap) + 1
+    range_starts = starts[np.concatenate(([0], breaks))]
+    range_ends = ends[np.concatenate((breaks - 1, [len(ends) - 1]))]
+    return list(zip(range_starts.tolist(), range_ends.tolist()))
+
+
+def diff_ranges(old, new, merge_gap=DEFAULT_MERGE_GAP):
+    """
+    Find the byte ranges of a blob that differ from an earlier version of it.
+
+    The blobs are compared byte by byte (vectorised), so each changed run is reported. When the length differs, this
+    is compared against treating the change as a single insertion/deletion (the range between the common prefix and
+    suffix), and whichever reports fewer changed bytes is used.
+
+    Args:
+      old (bytes-like): The earlier blob.
+      new (bytes-like): The later blob.
+      merge_gap (int): Merge changed runs separated by fewer than this many unchanged bytes.
+
+    Returns:
+      list: (start, end) ranges of changed bytes within new.
+    """
+    return _diff(old, new, merge_gap)[0]
+
+
+def _diff(old, new, merge_gap):
+    # Returns the changed ranges, and the length of the common suffix if the change is an insertion/deletion (else None)
+    # numpy is only imported once something is diffed, as importing it costs more than storing most states
+    import numpy as np
+
+    old_bytes = np.frombuffer(old, dtype=np.uint8)
+    new_bytes = np.frombuffer(new, dtype=np.uint8)
+
+    aligned_ranges = _aligned_ranges(old_bytes, new_bytes, merge_gap)
+    if len(old_bytes) == len(new_bytes):
+        return aligned_ranges, None
+
+    prefix_length, suffix_length = _common_prefix_suffix(old_bytes, new_bytes)
+    end = len(new_bytes) - suffix_length
+    shifted_ranges = [(prefix_length, end)] if prefix_length < end else []
+    if _ranges_size(shifted_ranges) < _ranges_size(aligned_ranges):
+        return shifted_ranges, suffix_length
+    return aligned_ranges, None
+
+
+def _ranges_size(ranges):
+    return sum(end - start for start, end in ranges)
+
+
+def _aligned_ranges(old_bytes, new_bytes, merge_gap):
+    import numpy as np
+
+    # Compare byte by byte over the common length, with anything appended to new as one more range
+    common_length = min(len(old_bytes), len(new_bytes))
+    changed = np.concatenate(([False], old_bytes[:common_length] != new_bytes[:common_length], [False]))
+    edges = np.flatnonzero(changed[1:] != changed[:-1])
+    ranges = _merge_runs(edges[0::2], edges[1::2], merge_gap)
+    if len(new_bytes) > common_length:
+        if ranges and common_length - ranges[-1][1] < merge_gap:
+            ranges[-1] = (ranges[-1][0], len(new_bytes))
+        else:
+            ranges.append((common_length, len(new_bytes)))
+    return ranges
+
+
+def _common_prefix_suffix(old_bytes, new_bytes):
+    import numpy as np
+
+    common_length = min(len(old_bytes), len(new_bytes))
+    mismatches = np.flatnonzero(old_bytes[:common_length] != new_bytes[:common_length])
+    prefix_length = int(mismatches[0]) if len(mismatches) else common_length
+
+    max_suffix_length = common_length - prefix_length
+    old_tail = old_bytes[len(old_bytes) - max_suffix_length:][::-1]
+    new_tail = new_bytes[len(new_bytes) - max_suffix_length:][::-1]
+    mismatches = np.flatnonzero(old_tail != new_tail)
+    suffix_length = int(mismatches[0]) if len(mismatches) else max_suffix_length
+    return prefix_length, suffix_length
+
+
+def _delta_ops(old, new, merge_gap):
+    # (op, ...) tuples rebuilding new from old: (_COPY_OP, old_offset, length) or (_INSERT_OP, new_start, new_end)
+    ranges, suffix_length = _diff(old, new, merge_gap)
+    ops = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            ops.append((_COPY_OP, position, start - position))
+        ops.append((_INSERT_OP, start, end))
+        position = end
+
+    if suffix_length is None:
+        # Everything else is unchanged at the same offsets
+        if position < len(new):
+            ops.append((_COPY_OP, position, len(new) - position))
+    else:
+        # Everything after the insertion/deletion is shifted, and copied from the end of old
+        prefix_end = len(new) - suffix_length
+        if prefix_end > position:
+            ops.append((_COPY_OP, position, prefix_end - position))
+        if suffix_length:
+            ops.append((_COPY_OP, len(old) - suffix_length, suffix_length))
+    return ops
+
+
+def encode_delta(old, new, merge_gap=DEFAULT_MERGE_GAP):
+    """
+    Encode new as a binary delta against old.
+
+    Returns:
+      bytes: The (uncompressed) delta.
+    """
+    new_view = memoryview(new)
+    parts = [struct.pack('<Q', len(new))]
+    for op in _delta_ops(old, new, merge_gap):
+        if op[0] == _COPY_OP:
+            parts.append(_COPY_OP + struct.pack('<QQ', op[1], op[2]))
+        else:
+            parts.append(_INSERT_OP + struct.pack('<Q', op[2] - op[1]))
+            parts.append(new_view[op[1]:op[2]])
+    return b''.join(parts)
+
+
+def apply_delta(old, delta):
+    """
+    Rebuild a blob from a base blob and a delta returned by encode_delta.
+
+    Returns:
+      bytes: The rebuilt blob.
+    """
+    old_view = memoryview(old)
+    delta_view = memoryview(delta)
+    (length,) = struct.unpack_from('<Q', delta_view, 0)
+    output = bytearray(length)
+    output_position = 0
+    position = 8
+    while position < len(delta_view):
+        op = delta_view[position:position + 1].tobytes()
+        if op == _COPY_OP:
+            offset, size = struct.unpack_from('<QQ', delta_view, position + 1)
+            position += 17
+            output[output_position:output_position + size] = old_view[offset:offset + size]
+        else:
+            (size,) = struct.unpack_from('<Q', delta_view, position + 1)
+            position += 9
+            output[output_position:output_position + size] = delta_view[position:position + size]
+            position += size
+        output_position += size
+    return bytes(output)
+
+
+class StateStore:
+    """
+    A content-addressed store of raw_state blobs, with later versions stored as deltas.
+
+    Args:
+      root (str): The directory to store objects in.
+      max_delta_ratio (float): Only store a delta if it is at most this fraction of the size of the full blob.
+      merge_gap (int): Merge changed runs separated by fewer than this many unchanged bytes when building deltas.
+    """
+
+    def __init__(self, root, max_delta_ratio=0.5, merge_gap=DEFAULT_MERGE_GAP):
+        self.root = root
+        self.max_delta_ratio = max_delta_ratio
+        self.merge_gap = merge_gap
+        self._last_digest = None
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def __contains__(self, digest):
+        return os.path.exists(self._object_path(digest))
+
+    def _read_object(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            data = f.read()
+        return data[:1], zlib.decompress(data[1:])
+
+    def _write_object(self, digest, kind, payload):
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(kind)
+            f.write(zlib.compress(payload, 1))
+        os.replace(temp_path, path)
+
+    def _full_base(self, digest):
+        # Deltas are always taken against a full object, so rebuilding a blob never chains more than one delta
+        kind, payload = self._read_object(digest)
+        if kind == FULL_OBJECT:
+            return digest, payload
+        base_digest = payload[:64].decode('ascii')
+        return base_digest, self.get(base_digest)
+
+    def put(self, blob, base=None, label=None):
+        """
+        Store a blob, as a delta against a base blob if that is meaningfully smaller.
+
+        Args:
+          blob (bytes-like): The raw_state blob.
+          base (str, optional): The digest of the blob to delta against. Defaults to the previously put blob.
+          label (str, optional): A label recorded alongside the blob in the history.
+
+        Returns:
+          str: The blob's digest.
+        """
+        digest = state_digest(blob)
+        base = base or self._last_digest
+        if digest not in self:
+            kind, payload = FULL_OBJECT, blob
+            if base and base != digest and base in self:
+                base_digest, base_blob = self._full_base(base)
+                delta = encode_delta(base_blob, blob, self.merge_gap)
+                if len(delta) <= len(blob) * self.max_delta_ratio:
+                    kind, payload = DELTA_OBJECT, base_digest.encode('ascii') + delta
+            self._write_object(digest, kind, payload)
+
+        with open(os.path.join(self.root, 'history.jsonl'), 'a') as f:
+            f.write(json.dumps({'digest': digest, 'label': label, 'time': time.time()}) + '\n')
+        self._last_digest = digest
+        return digest
+
+    def get(self, digest):
+        """
+        Returns:
+          bytes: The blob stored under the given digest.
+        """
+        kind, payload = self._read_object(digest)
+        if kind == FULL_OBJECT:
+            return payload
+        base_digest = payload[:64].decode('ascii')
+        return apply_delta(self.get(base_digest), memoryview(payload)[64:])
+
+    def diff(self, old_digest, new_digest, merge_gap=DEFAULT_MERGE_GAP):
+        """
+        Returns:
+          list: The (start, end) ranges of the new blob that differ from the old one (see diff_ranges).
+        """
+        return diff_ranges(self.get(old_digest), self.get(new_digest), merge_gap)
+
+    def history(self):
+        """
+        Returns:
+          list: The {"digest", "label", "time"} entries for every put, oldest first.
+        """
+        history_path = os.path.join(self.root, 'history.jsonl')
+        if not os.path.exists(history_path):
+            return []
+        with open(history_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def stats(self):
+        """
+        Returns:
+          dict: The number of full and delta objects stored, and their total size on disk.
+        """
+        stats = {'full_objects': 0, 'delta_objects': 0, 'bytes_on_disk': 0}
+        objects_dir = os.path.join(self.root, 'objects')
+        for dir_path, _, file_names in os.walk(objects_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                with open(path, 'rb') as f:
+                    kind = f.read(1)
+                stats['full_objects' if kind == FULL_OBJECT else 'delta_objects'] += 1
+                stats['bytes_on_disk'] += os.path.getsize(path)
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store raw_state files in a deduplicated state store.")
+    parser.add_argument('store', help="The state store directory.")
+    parser.add_argument('state_files', nargs='+', help="raw_state files to store, each as a delta of the previous one.")
+    args = parser.parse_args()
+
+    store = StateStore(args.store)
+    previous = None
+    for state_file in args.state_files:
+        with open(state_file, 'rb') as f:
+            blob = f.read()
+        digest = store.put(blob, label=os.path.basename(state_file))
+        print(f"{state_file}: {digest} ({len(blob)} bytes)")
+        if previous:
+            ranges = diff_ranges(previous, blob)
+            print(f"  Changed ranges vs previous: {len(ranges)} ({sum(end - start for start, end in ranges)} bytes)")
+        previous = blob
+    print(f"Store: {store.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,22 +14,24 @@
 #         print(my_plugin.parameters.keys())
 #
 # https://docs.python.org/3/library/argparse.html
+#
+# Each task is a subcommand, which only imports the (heavy) modules it needs, eg. pedalboard and numpy are never
+# imported for --help, or for state work on raw state files that are already on disk:
+#   python synth_vst_loader.py enumerate Vital Serum
+#   python synth_vst_loader.py params --show-editor
+#   python synth_vst_loader.py state --show-editor --state-store states
+#   python synth_vst_loader.py state synth_raw_state_initial.bin synth_raw_state_new.bin --diff
+#   python synth_vst_loader.py render --midi song.mid --output output-vital-audio.wav
+#   python synth_vst_loader.py compare
 
 import argparse
 import os
-from pprint import pprint, pp
 
-from pedalboard import Pedalboard, load_plugin, VST3Plugin, AudioUnitPlugin
-# from pedalboard.io import AudioFile
-from mido import Message
+from plugin_index import DEFAULT_INDEX_PATH
+from profiling import Profiler
 
-from helpers import (
-    filter_installed_plugins_by_names,
-    compare_plugin_parameters,
-    print_parameter_properties,
-    is_vst3_xml,
-    extract_vst3_xml
-)
+DEFAULT_SYNTH_PATH = '/Library/Audio/Plug-Ins/VST3/Vital.vst3'
+# DEFAULT_SYNTH_PATH = '/Library/Audio/Plug-Ins/Components/Serum.component'
 
 
 # Setting up argparse
@@ -44,105 +46,69 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
-parser = argparse.ArgumentParser(description="Load and compare synth plugins.")
-parser.add_argument(
-    '--synth-path',
-    type=str,
-    default='/Library/Audio/Plug-Ins/VST3/Vital.vst3',
-    # default='/Library/Audio/Plug-Ins/Components/Serum.component',
-    help="Path to the synth plugin file. [Default: %(default)s]",
-)
-parser.add_argument(
-    '--enumerate-plugins',
-    type=str2bool,
-    nargs='?',
-    const=True,  # If arg passed with no value, treat it as True
-    default=True,
-    choices=[True, False],
-    help="Enumerate and display synth plugins. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--enumerate-params',
-    type=str2bool,
-    nargs='?',
-    const=True,  # If arg passed with no value, treat it as True
-    default=False,
-    choices=[True, False],
-    help="Enumerate and display synth parameters. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--output-state',
-    type=str2bool,
-    nargs='?',
-    const=True,  # If arg passed with no value, treat it as True
-    default=False,
-    choices=[True, False],
-    help="Output the state of the synth. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--out-state-file-initial',
-    type=str,
-    default='synth_raw_state_initial.bin',
-    help="Filename to save the initial raw state. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--out-state-file-new',
-    type=str,
-    default='synth_raw_state_new.bin',
-    help="Filename to save the new raw state. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--out-state-file-initial-xml',
-    type=str,
-    default='synth_raw_state_initial.xml',
-    help="Filename to save the initial raw state XML part. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--out-state-file-new-xml',
-    type=str,
-    default='synth_raw_state_new.xml',
-    help="Filename to save the new raw state XML part. [Default: %(default)s]"
-)
-parser.add_argument(
-    '--force',
-    type=str2bool,
-    nargs='?',
-    const=True,  # If arg passed with no value, treat it as True
-    default=False,
-    choices=[True, False],
-    help="Force overwrite of existing files. [Default: %(default)s]"
-)
-args = parser.parse_args()
-
-print("Args:")
-for key, value in vars(args).items():
-    print(f"  {key}: {value},")
-print()
-
-if args.output_state:
+def add_bool_argument(parser, name, default, help):
+    parser.add_argument(
+        name,
+        type=str2bool,
+        nargs='?',
+        const=True,  # If arg passed with no value, treat it as True
+        default=default,
+        choices=[True, False],
+        help=f"{help} [Default: %(default)s]",
+    )
+
+
+def import_helpers(profiler):
+    # Imported on demand, as importing helpers imports pedalboard. When profiling, its functions are wrapped so that
+    # they are timed too (so they must be called via the module, rather than imported by name).
+    with profiler.phase('import_modules'):
+        import helpers
+    profiler.wrap_module(helpers)
+    return helpers
+
+
+def load_synth_plugin(args, profiler):
+    helpers = import_helpers(profiler)
+    print(f"Loading synth plugin ({args.synth_path})..")
+    with profiler.phase('load_plugin'):
+        synth_plugin = helpers.load_plugin_from_spec(args.synth_path)
+    # Built-in plugins have no .name
+    synth_name = getattr(synth_plugin, 'name', type(synth_plugin).__name__)
+    print(f"  Synth plugin loaded: {synth_name}")
+    print(f"  Synth plugin is instrument? {synth_plugin.is_instrument}")
+    print(f"  Synth plugin is effect? {synth_plugin.is_effect}")
+    profiler.metadata.update({'synth_path': args.synth_path, 'synth_name': synth_name})
+    return synth_plugin
+
+
+def show_synth_editor(synth_plugin, profiler):
+    print("Showing synth GUI..")
+    with profiler.phase('show_editor'):
+        synth_plugin.show_editor()
+
+
+def check_output_files(paths, force):
     # Check if the output files already exist. Warn if --force is specified, otherwise raise an error.
-    existing_files = [
-        f for f in [
-            args.out_state_file_initial,
-            args.out_state_file_initial_xml,
-            args.out_state_file_new,
-            args.out_state_file_new_xml
-        ]
-        if os.path.exists(f)
-    ]
+    existing_files = [f for f in paths if os.path.exists(f)]
     if existing_files:
-        if args.force:
+        if force:
             print(f"Warning: The following files will be overwritten due to --force: {', '.join(existing_files)}")
         else:
             raise FileExistsError(
                 f"The following files already exist: {', '.join(existing_files)}. Use --force to overwrite."
             )
 
-if args.enumerate_plugins:
-    # Filter the locally installed audio plugins by the provided names
-    filter_installed_plugins_by_names(
-        ['Vital', 'Serum']
-    )
+
+def enumerate_command(args, profiler):
+    helpers = import_helpers(profiler)
+    with profiler.phase('import_modules'):
+        from plugin_index import PluginIndex
+
+    with profiler.phase('enumerate_plugins'):
+        # Filter the locally installed audio plugins by the provided names
+        plugin_index = PluginIndex(args.plugin_index)
+        plugin_index.refresh()
+        helpers.filter_installed_plugins_by_names(args.names, plugin_index=plugin_index)
 
     # eg.
     #   Vital
@@ -154,130 +120,461 @@ if args.enumerate_plugins:
     #     VST2: /Library/Audio/Plug-Ins/VST/Serum.vst
     #     AU:   /Library/Audio/Plug-Ins/Components/Serum.component
 
-# Compare the plugin parameters between the VST3 and AudioUnit versions of a plugin, showing the differences and similarities
-# compare_plugin_parameters(
-#   "/Library/Audio/Plug-Ins/VST3/Vital.vst3",
-#   "/Library/Audio/Plug-Ins/Components/Vital.component"
-# )
-
-print(f"Loading synth plugin ({args.synth_path})..")
-synth_plugin = load_plugin(args.synth_path)
-print(f"  Synth plugin loaded: {synth_plugin.name}")
-print(f"  Synth plugin is instrument? {synth_plugin.is_instrument}")
-print(f"  Synth plugin is effect? {synth_plugin.is_effect}")
-# assert synth_plugin.is_instrument
-
-# # TODO: remove this hacky code
-# pprint(dir(synth_plugin))
-# pprint(synth_plugin._parameters)
-
-# # TODO: remove this hacky code
-# first_synth_param = synth_plugin.parameters[list(synth_plugin.parameters.keys())[0]]
-# # pprint(dir(first_synth_param))
-# print_parameter_properties(first_synth_param)
-# # print_parameter_properties(synth_plugin.parameters['verb_wet'])
-
-# print("Synth plugin parameters:")
-# pprint(synth_plugin.parameters)
-
-if args.output_state:
-    print("Capturing initial raw state of the synth..")
-    initial_synth_raw_state = synth_plugin.raw_state
 
-if args.enumerate_params:
-    print("Capturing initial state of synth params..")
-    initial_synth_params = {key: synth_plugin.parameters[key].raw_value for key in synth_plugin.parameters.keys()}
+def save_parameter_preset(synth_plugin, synth_param_layout, preset_path, profiler):
+    with profiler.phase('import_modules'):
+        from parameter_presets import ParameterPreset
 
-print("Showing synth GUI..")
-synth_plugin.show_editor()
+    with profiler.phase('save_preset'):
+        ParameterPreset.capture(synth_plugin, synth_param_layout).save(preset_path)
+    print(f"Saved the synth params to {preset_path}")
+
+
+def params_command(args, profiler):
+    synth_plugin = load_synth_plugin(args, profiler)
+    with profiler.phase('import_modules'):
+        from parameter_snapshot import ParameterLayout
+
+    if args.load_preset:
+        with profiler.phase('import_modules'):
+            from parameter_presets import ParameterPreset, PresetApplier
+
+        with profiler.phase('load_preset'):
+            preset_applier = PresetApplier(synth_plugin)
+            num_written = preset_applier.apply(ParameterPreset.load(args.load_preset))
+        print(f"Applied {args.load_preset} ({num_written} params changed)")
+        # Reuse the applier's layout rather than building another
+        synth_param_layout = preset_applier.layout
+    else:
+        synth_param_layout = None
+
+    print("Capturing initial state of synth params..")
+    with profiler.phase('capture_parameters'):
+        synth_param_layout = synth_param_layout or ParameterLayout(synth_plugin)
+        initial_synth_params = synth_param_layout.capture()
+
+    if not args.show_editor:
+        print(f"Number of parameters: {len(initial_synth_params)}")
+        for key, value in initial_synth_params.to_dict().items():
+            print(f"Parameter: {key}, Value: {value}")
+        if args.save_preset:
+            save_parameter_preset(synth_plugin, synth_param_layout, args.save_preset, profiler)
+        return
+
+    if args.record_automation:
+        with profiler.phase('import_modules'):
+            from automation_recorder import AutomationRecorder
+
+        # Record every parameter movement while the GUI is shown, not just the end result
+        with AutomationRecorder(synth_plugin, rate=args.automation_rate) as recorder:
+            show_synth_editor(synth_plugin, profiler)
+        with profiler.phase('save_automation'):
+            automation_lane = recorder.lane()
+            automation_lane.save(args.record_automation)
+        print(f"Recorded {len(automation_lane)} parameter changes to {args.record_automation}")
+    else:
+        show_synth_editor(synth_plugin, profiler)
 
-if args.enumerate_params:
     print("Capturing state of synth params after showing GUI..")
-    new_synth_params = {key: synth_plugin.parameters[key].raw_value for key in synth_plugin.parameters.keys()}
+    with profiler.phase('capture_parameters'):
+        # A fresh layout, as the plugin may have added or removed parameters while its GUI was shown
+        synth_param_layout = ParameterLayout(synth_plugin)
+        new_synth_params = synth_param_layout.capture()
 
     # Calculate the differences
-    synth_param_diffs = {
-        key: {'before': initial_synth_params[key], 'after': new_synth_params[key]}
-        for key in initial_synth_params
-        if key in new_synth_params and initial_synth_params[key] != new_synth_params[key]
-    }
-
-    # Check for keys that exist only in one of the dictionaries
-    missing_in_new = {key for key in initial_synth_params if key not in new_synth_params}
-    missing_in_initial = {key for key in new_synth_params if key not in initial_synth_params}
+    with profiler.phase('diff_parameters'):
+        synth_param_diffs = initial_synth_params.diff(new_synth_params)
 
     # Output warnings for missing keys
-    if missing_in_new:
+    if synth_param_diffs.missing_in_after:
         print(
             "Warning: These keys were in the initial parameters, but are missing in the new parameters:",
-            missing_in_new
+            synth_param_diffs.missing_in_after
         )
-    if missing_in_initial:
+    if synth_param_diffs.missing_in_before:
         print(
             "Warning: These keys were not in the initial parameters, but are in the new parameters:",
-            missing_in_initial
+            synth_param_diffs.missing_in_before
         )
 
     # Print out the differences
     print(f"Number of parameters before: {len(initial_synth_params)}")
     print(f"Number of parameters after: {len(new_synth_params)}")
     print(f"Number of parameters changed: {len(synth_param_diffs)}")
-    for key, value in synth_param_diffs.items():
-        print(
-            f"Parameter: {key} ({synth_plugin.parameters[key].name}), Before: {value['before']}, After: {value['after']}")
-
-if args.output_state:
-    print("Capturing new raw state of the synth after showing GUI..")
-    new_synth_raw_state = synth_plugin.raw_state
-
-    # Output details about the raw synth state
-    print(f"Raw synth state length before: {len(initial_synth_raw_state)}")
-    print(f"Raw synth state length after: {len(new_synth_raw_state)}")
-    # TODO: calculate the diff between initial_synth_raw_state and new_synth_raw_state?
-
-    # Write the initial and new raw states to files
-    with open(args.out_state_file_initial, 'wb') as f:
-        f.write(initial_synth_raw_state)
-        print(f"Initial raw state written to {args.out_state_file_initial}")
-
-    with open(args.out_state_file_new, 'wb') as f:
-        f.write(new_synth_raw_state)
-        print(f"New raw state written to {args.out_state_file_new}")
-
-    # Check and extract XML from initial state
-    if is_vst3_xml(initial_synth_raw_state):
-        initial_synth_state_xml = extract_vst3_xml(initial_synth_raw_state)
-        with open(args.out_state_file_initial_xml, 'w') as f:
-            f.write(initial_synth_state_xml)
-            print(f"Initial raw state XML written to {args.out_state_file_initial_xml}")
-    else:
-        print("Initial state does not look like VST3 XML.")
-
-    # Check and extract XML from new state
-    if is_vst3_xml(new_synth_raw_state):
-        new_synth_state_xml = extract_vst3_xml(new_synth_raw_state)
-        with open(args.out_state_file_new_xml, 'w') as f:
-            f.write(new_synth_state_xml)
-            print(f"New raw state XML written to {args.out_state_file_new_xml}")
-    else:
-        print("New state does not look like VST3 XML.")
+    for key, before, after in synth_param_diffs.changes():
+        # Built-in plugins have no .parameters, and their keys are already their names
+        name = synth_plugin.parameters[key].name if synth_param_layout.is_external else key
+        print(f"Parameter: {key} ({name}), Before: {before}, After: {after}")
+
+    if args.save_preset:
+        save_parameter_preset(synth_plugin, synth_param_layout, args.save_preset, profiler)
+
+
+def describe_raw_state(label, raw_state, xml_path, profiler):
+    with profiler.phase('import_modules'):
+        from vst3_state import vst3_xml_view, iter_vst3_xml_parameters
+
+    print(f"{label} raw state length: {len(raw_state)}")
+
+    # Check and extract XML from the state
+    with profiler.phase('extract_xml'):
+        synth_state_xml = vst3_xml_view(raw_state)
+    if synth_state_xml is None:
+        print(f"{label} state does not look like VST3 XML.")
+        return
+
+    if xml_path:
+        # Written straight from a view of the raw state, without copying or decoding it
+        with profiler.phase('write_xml_files'), open(xml_path, 'wb') as f:
+            f.write(synth_state_xml)
+            print(f"{label} raw state XML written to {xml_path}")
+    synth_state_xml.release()
+
+    try:
+        with profiler.phase('parse_xml'):
+            num_xml_params = sum(1 for _ in iter_vst3_xml_parameters(raw_state))
+        print(f"  {label} raw state XML contains {num_xml_params} parameters")
+    except ValueError as e:
+        print(f"  Warning: Could not parse the {label.lower()} raw state XML: {e}")
+
+
+def compare_raw_states(initial_synth_raw_state, new_synth_raw_state, profiler):
+    with profiler.phase('import_modules'):
+        from state_store import diff_ranges
+
+    with profiler.phase('diff_raw_state'):
+        raw_state_diff_ranges = diff_ranges(initial_synth_raw_state, new_synth_raw_state)
+    print(
+        f"Raw synth state changed ranges: {len(raw_state_diff_ranges)} "
+        f"({sum(end - start for start, end in raw_state_diff_ranges)} bytes)"
+    )
+    for start, end in raw_state_diff_ranges[:10]:
+        print(f"  [{start}:{end}]")
+
+
+def store_raw_states(raw_states, state_store_path, profiler):
+    with profiler.phase('import_modules'):
+        from state_store import StateStore
+
+    with profiler.phase('state_store'):
+        state_store = StateStore(state_store_path)
+        digests = []
+        for label, raw_state in raw_states:
+            digests.append(state_store.put(raw_state, base=digests[-1] if digests else None, label=label))
+    print(
+        f"Raw states stored in {state_store_path}: "
+        + ', '.join(f"{label}={digest}" for (label, _), digest in zip(raw_states, digests))
+    )
 
-# TODO: see json serialisation for parameters stuff here:
-#   save as json (basic): https://github.com/spotify/pedalboard/issues/187#issuecomment-1375662525
-#   save as json (more robust): https://github.com/spotify/pedalboard/issues/187#issuecomment-1376205304
-#   load from json: https://github.com/spotify/pedalboard/issues/187#issuecomment-1692655527
 
+def state_command(args, profiler):
+    if args.state_files:
+        # Work on raw state files that are already on disk, without loading the plugin
+        raw_states = []
+        for path in args.state_files:
+            with profiler.phase('read_state_files'), open(path, 'rb') as f:
+                raw_states.append((path, f.read()))
+        for path, raw_state in raw_states:
+            describe_raw_state(path, raw_state, f"{path}.xml" if args.extract_xml else None, profiler)
+        if args.diff:
+            if len(raw_states) != 2:
+                raise ValueError("--diff needs exactly two raw state files.")
+            compare_raw_states(raw_states[0][1], raw_states[1][1], profiler)
+        if args.state_store:
+            store_raw_states(raw_states, args.state_store, profiler)
+        return
+
+    output_files = [args.out_state_file_initial, args.out_state_file_initial_xml]
+    if args.show_editor:
+        output_files += [args.out_state_file_new, args.out_state_file_new_xml]
+    check_output_files(output_files, args.force)
+
+    synth_plugin = load_synth_plugin(args, profiler)
+    if not hasattr(synth_plugin, 'raw_state'):
+        raise ValueError(f"{args.synth_path} has no raw state (only VST3 and AudioUnit plugins do).")
 
-# sample_rate = 44100
-# num_channels = 2  # Stereo output
+    print("Capturing initial raw state of the synth..")
+    with profiler.phase('capture_raw_state'):
+        initial_synth_raw_state = synth_plugin.raw_state
+    raw_states = [('initial', initial_synth_raw_state)]
+
+    if args.show_editor:
+        show_synth_editor(synth_plugin, profiler)
+
+        print("Capturing new raw state of the synth after showing GUI..")
+        with profiler.phase('capture_raw_state'):
+            new_synth_raw_state = synth_plugin.raw_state
+        raw_states.append(('new', new_synth_raw_state))
+
+        # Output details about the raw synth state
+        print(f"Raw synth state length before: {len(initial_synth_raw_state)}")
+        print(f"Raw synth state length after: {len(new_synth_raw_state)}")
+        compare_raw_states(initial_synth_raw_state, new_synth_raw_state, profiler)
+
+    if args.state_store:
+        store_raw_states(raw_states, args.state_store, profiler)
+
+    # Write the raw states to files
+    with profiler.phase('write_state_files'):
+        with open(args.out_state_file_initial, 'wb') as f:
+            f.write(initial_synth_raw_state)
+            print(f"Initial raw state written to {args.out_state_file_initial}")
+
+        if args.show_editor:
+            with open(args.out_state_file_new, 'wb') as f:
+                f.write(new_synth_raw_state)
+                print(f"New raw state written to {args.out_state_file_new}")
+
+    describe_raw_state('Initial', initial_synth_raw_state, args.out_state_file_initial_xml, profiler)
+    if args.show_editor:
+        describe_raw_state('New', new_synth_raw_state, args.out_state_file_new_xml, profiler)
+
+
+def render_command(args, profiler):
+    check_output_files([args.output], args.force)
+    synth_plugin = load_synth_plugin(args, profiler)
+    with profiler.phase('import_modules'):
+        from rendering import apply_preset, load_midi, note_events, render_midi_to_file
+
+    if args.preset:
+        with profiler.phase('apply_preset'):
+            apply_preset(synth_plugin, args.preset)
+
+    with profiler.phase('load_midi'):
+        # Without a MIDI file, render a single middle C for a second
+        midi_events = load_midi(args.midi) if args.midi else note_events([[60, 100, 0.0, 1.0]])
+
+    print(f"Rendering {args.duration}s of audio to {args.output}..")
+    with profiler.phase('render'):
+        num_samples = render_midi_to_file(
+            synth_plugin,
+            midi_events,
+            args.output,
+            duration=args.duration,
+            sample_rate=args.sample_rate,
+            num_channels=args.num_channels,
+        )
+    print(f"  {num_samples} samples written to {args.output}")
+
+
+def compare_command(args, profiler):
+    helpers = import_helpers(profiler)
+    # Compare the plugin parameters between the VST3 and AudioUnit versions of a plugin, showing the differences and similarities
+    with profiler.phase('compare_plugins'):
+        helpers.compare_plugin_parameters(args.vst3_path, args.au_path)
+
+
+def build_parser():
+    # Options shared by every subcommand
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument(
+        '--profile',
+        type=str,
+        nargs='?',
+        const='synth_vst_loader_profile.json',  # If arg passed with no value, use this report filename
+        default=None,
+        help="Time each phase of the run (and the helpers functions), writing a JSON report to this file. [Default: %(default)s]"
+    )
+    add_bool_argument(
+        common_parser,
+        '--profile-memory',
+        False,
+        "With --profile, also record the memory allocated by each phase (via tracemalloc).",
+    )
+    add_bool_argument(
+        common_parser,
+        '--profile-cprofile',
+        False,
+        "With --profile, also include the top functions from a cProfile of the run.",
+    )
+
+    synth_parser = argparse.ArgumentParser(add_help=False)
+    synth_parser.add_argument(
+        '--synth-path',
+        type=str,
+        default=DEFAULT_SYNTH_PATH,
+        help="Path to the synth plugin file, or 'builtin:<Name>' for a built-in pedalboard plugin. [Default: %(default)s]",
+    )
 
-# # Render some audio by passing MIDI to Vital:
-# midi_messages = [Message("note_on", note=60), Message("note_off", note=60, time=1)]
-# audio = vital_synth(midi_messages, duration=1, sample_rate=sample_rate, num_channels=num_channels)
+    parser = argparse.ArgumentParser(description="Load and compare synth plugins.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    enumerate_parser = subparsers.add_parser(
+        'enumerate',
+        parents=[common_parser],
+        help="Enumerate and display the installed plugins matching some names.",
+    )
+    enumerate_parser.add_argument(
+        'names',
+        nargs='*',
+        default=['Vital', 'Serum'],
+        help="Plugin names to filter by. [Default: Vital Serum]",
+    )
+    enumerate_parser.add_argument(
+        '--plugin-index',
+        type=str,
+        default=DEFAULT_INDEX_PATH,
+        help="Path to the persistent installed plugin index. [Default: %(default)s]",
+    )
+    enumerate_parser.set_defaults(handler=enumerate_command)
+
+    params_parser = subparsers.add_parser(
+        'params',
+        parents=[common_parser, synth_parser],
+        help="Enumerate and display the synth's parameters.",
+    )
+    add_bool_argument(
+        params_parser,
+        '--show-editor',
+        False,
+        "Show the synth GUI, then display the parameters that were changed in it.",
+    )
+    params_parser.add_argument(
+        '--record-automation',
+        type=str,
+        default=None,
+        help="With --show-editor, record every parameter change made in the GUI to this .npz automation lane (see automation_recorder.py). [Default: %(default)s]",
+    )
+    params_parser.add_argument(
+        '--automation-rate',
+        type=float,
+        default=100.0,
+        help="How many times per second to sample the parameters for --record-automation. [Default: %(default)s]",
+    )
+    params_parser.add_argument(
+        '--load-preset',
+        type=str,
+        default=None,
+        help="Apply a parameter preset (.json or .npz, see parameter_presets.py) to the synth first. [Default: %(default)s]",
+    )
+    params_parser.add_argument(
+        '--save-preset',
+        type=str,
+        default=None,
+        help="Save the synth's params (after any GUI changes) as a parameter preset (.json, or .npz for binary). [Default: %(default)s]",
+    )
+    params_parser.set_defaults(handler=params_command)
+
+    state_parser = subparsers.add_parser(
+        'state',
+        parents=[common_parser, synth_parser],
+        help="Output the raw state of the synth, or inspect raw state files.",
+    )
+    state_parser.add_argument(
+        'state_files',
+        nargs='*',
+        help="Raw state files to inspect instead of loading the synth (eg. synth_raw_state_new.bin).",
+    )
+    add_bool_argument(
+        state_parser,
+        '--show-editor',
+        False,
+        "Show the synth GUI, then also output the new raw state, and how it changed.",
+    )
+    add_bool_argument(state_parser, '--diff', False, "Show the changed byte ranges between two raw state files.")
+    add_bool_argument(state_parser, '--extract-xml', False, "Write the XML part of each raw state file to <file>.xml.")
+    state_parser.add_argument(
+        '--out-state-file-initial',
+        type=str,
+        default='synth_raw_state_initial.bin',
+        help="Filename to save the initial raw state. [Default: %(default)s]"
+    )
+    state_parser.add_argument(
+        '--out-state-file-new',
+        type=str,
+        default='synth_raw_state_new.bin',
+        help="Filename to save the new raw state. [Default: %(default)s]"
+    )
+    state_parser.add_argument(
+        '--out-state-file-initial-xml',
+        type=str,
+        default='synth_raw_state_initial.xml',
+        help="Filename to save the initial raw state XML part. [Default: %(default)s]"
+    )
+    state_parser.add_argument(
+        '--out-state-file-new-xml',
+        type=str,
+        default='synth_raw_state_new.xml',
+        help="Filename to save the new raw state XML part. [Default: %(default)s]"
+    )
+    state_parser.add_argument(
+        '--state-store',
+        type=str,
+        default=None,
+        help="Also store the raw states in this deduplicated state store directory (see state_store.py). [Default: %(default)s]"
+    )
+    add_bool_argument(state_parser, '--force', False, "Force overwrite of existing files.")
+    state_parser.set_defaults(handler=state_command)
+
+    render_parser = subparsers.add_parser(
+        'render',
+        parents=[common_parser, synth_parser],
+        help="Render some MIDI through the synth to an audio file.",
+    )
+    render_parser.add_argument('--midi', type=str, default=None, help="MIDI file to render. [Default: a middle C]")
+    render_parser.add_argument(
+        '--preset',
+        type=str,
+        default=None,
+        help="Raw state (.bin) or parameters (.json) preset to apply first. [Default: %(default)s]",
+    )
+    render_parser.add_argument(
+        '--output',
+        type=str,
+        default='output-vital-audio.wav',
+        help="Audio file to write. [Default: %(default)s]",
+    )
+    render_parser.add_argument('--duration', type=float, default=1.0, help="[Default: %(default)s]")
+    render_parser.add_argument('--sample-rate', type=int, default=44100, help="[Default: %(default)s]")
+    render_parser.add_argument('--num-channels', type=int, default=2, help="[Default: %(default)s]")
+    add_bool_argument(render_parser, '--force', False, "Force overwrite of existing files.")
+    render_parser.set_defaults(handler=render_command)
+
+    compare_parser = subparsers.add_parser(
+        'compare',
+        parents=[common_parser],
+        help="Compare the parameters of the VST3 and AudioUnit versions of a plugin.",
+    )
+    compare_parser.add_argument('--vst3-path', type=str, default='/Library/Audio/Plug-Ins/VST3/Vital.vst3')
+    compare_parser.add_argument('--au-path', type=str, default='/Library/Audio/Plug-Ins/Components/Vital.component')
+    compare_parser.set_defaults(handler=compare_command)
+
+    return parser
+
+
+def main():
+    profiler = Profiler()
+    with profiler.phase('parse_args'):
+        args = build_parser().parse_args()
+
+    profiler.enabled = args.profile is not None
+    if profiler.enabled:
+        profiler.start(trace_memory=args.profile_memory, cprofile=args.profile_cprofile)
+
+    print("Args:")
+    for key, value in vars(args).items():
+        if key != 'handler':
+            print(f"  {key}: {value},")
+    print()
+
+    args.handler(args, profiler)
+
+    if profiler.enabled:
+        profiler.metadata['command'] = args.command
+        profiler.write_report(args.profile)
+        print(f"Profile report written to {args.profile}")
+
+
+if __name__ == '__main__':
+    main()
+
+# JSON serialisation of parameters is implemented in parameter_presets.py (see params --save-preset / --load-preset),
+# based on the approaches discussed here:
+#   save as json (basic): https://github.com/spotify/pedalboard/issues/187#issuecomment-1375662525
+#   save as json (more robust): https://github.com/spotify/pedalboard/issues/187#issuecomment-1376205304
+#   load from json: https://github.com/spotify/pedalboard/issues/187#issuecomment-1692655527
 
-# # Write the rendered audio to a file
-# with AudioFile("output-vital-audio.wav", "w", sample_rate, num_channels) as f:
-#     f.write(audio)
 
 # Print out the parameter keys supported by the synth plugin
 # print(synth_plugin.parameters.keys())
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+
+# A columnar, memory-mapped index of a library of Vital (.vital) presets.
+#
+# Vital presets are JSON files that hold the synth's parameters under their 'settings' key (see the notes at the bottom
+# of synth_vst_loader.py). This parses them in parallel into a (presets x parameters) float32 matrix stored as a raw
+# memory-mapped file, with one column per parameter, and reindexing only re-parses files whose mtime/size and hash
+# have changed.
+#
+# The columns can instead be aligned to a plugin's parameter names. The .vital settings keys don't match the plugin's
+# parameter names (eg. 'osc_1_level' vs 'oscillator_1_level', 'chorus_on' vs 'chorus_switch'), so each column is read
+# from the settings key given by vital_setting_key. Settings hold values in Vital's own units, so given the parameters'
+# (min, max) ranges, aligned columns are also normalised linearly into 0..1. That is only an approximation of the
+# plugin's raw_value for parameters whose range the plugin skews, so rows are comparable with (not identical to) a
+# ParameterSnapshot of the plugin. Aligned columns that no preset has a settings key for are reported by update.
+#
+# Layout:
+#   <index_dir>/index.json   the columns, their settings keys and value ranges, per-column ranges, and each row's path,
+#                            mtime, size and sha1
+#   <index_dir>/matrix.f32   the float32 matrix, row-major (missing parameters are NaN)
+#
+# Example usage:
+#   python vital_preset_index.py update vital-index ~/Music/Vital
+#   python vital_preset_index.py update vital-index-aligned ~/Music/Vital --plugin /Library/Audio/Plug-Ins/VST3/Vital.vst3
+#   python vital_preset_index.py query vital-index --where filter_1_on=1 --where filter_1_cutoff=60:80
+#   python vital_preset_index.py nearest vital-index "~/Music/Vital/Factory/Presets/Plucked String.vital" -k 5
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import warnings
+
+import numpy as np
+
+INDEX_VERSION = 2
+
+# Prefixes of the plugin's parameter names that are abbreviated in .vital settings keys
+VITAL_KEY_PREFIXES = [
+    ('oscillator_', 'osc_'),
+    ('envelope_', 'env_'),
+    ('random_lfo_', 'random_'),
+]
+
+# Plugin parameter names whose .vital settings keys don't follow from VITAL_KEY_PREFIXES and the '_switch' -> '_on'
+# rename
+VITAL_KEY_OVERRIDES = {
+    'macro_1': 'macro_control_1',
+    'macro_2': 'macro_control_2',
+    'macro_3': 'macro_control_3',
+    'macro_4': 'macro_control_4',
+    'chorus_mix': 'chorus_dry_wet',
+    'delay_mix': 'delay_dry_wet',
+    'flanger_mix': 'flanger_dry_wet',
+    'phaser_mix': 'phaser_dry_wet',
+    'reverb_mix': 'reverb_dry_wet',
+}
+PRESET_EXTENSION = '.vital'
+
+
+def find_presets(preset_dirs):
+    """
+    Find the .vital presets within some directories (recursively).
+
+    Returns:
+      list: The sorted preset paths.
+    """
+    preset_paths = []
+    for preset_dir in preset_dirs:
+        for dir_path, _, file_names in os.walk(preset_dir):
+            preset_paths.extend(
+                os.path.abspath(os.path.join(dir_path, file_name))
+                for file_name in file_names if file_name.lower().endswith(PRESET_EXTENSION)
+            )
+    return sorted(preset_paths)
+
+
+def vital_setting_key(parameter_name):
+    """
+    Get the .vital settings key that holds a plugin parameter's value.
+
+    Args:
+      parameter_name (str): The plugin's parameter name (eg. 'oscillator_1_switch').
+
+    Returns:
+      str: The settings key (eg. 'osc_1_on').
+    """
+    if parameter_name in VITAL_KEY_OVERRIDES:
+        return VITAL_KEY_OVERRIDES[parameter_name]
+    key = parameter_name
+    for prefix, replacement in VITAL_KEY_PREFIXES:
+        if key.startswith(prefix):
+            key = replacement + key[len(prefix):]
+            break
+    if key.endswith('_switch'):
+        key = key[:-len('_switch')] + '_on'
+    return key
+
+
+def plugin_value_ranges(plugin):
+    """
+    Get the (min, max) range of each of a plugin's parameters, to normalise aligned columns with.
+
+    Returns:
+      dict: Parameter name -> (min_value, max_value), for the parameters with a numeric range.
+    """
+    ranges = {}
+    for key, parameter in plugin.parameters.items():
+        low, high = getattr(parameter, 'min_value', None), getattr(parameter, 'max_value', None)
+        if isinstance(low, (int, float)) and isinstance(high, (int, float)) and high > low:
+            ranges[key] = (float(low), float(high))
+    return ranges
+
+
+def read_preset_settings(data):
+    """
+    Read the numeric settings from the contents of a .vital preset.
+
+    Args:
+      data (bytes): The preset file contents.
+
+    Returns:
+      dict: The numeric settings (non-numeric ones, eg. wavetables and modulations, are skipped).
+    """
+    settings = json.loads(data).get('settings', {})
+    return {
+        key: float(value) for key, value in settings.items()
+        if isinstance(value, (int, float))
+    }
+
+
+def _parse_preset(task):
+    # Returns (path, sha1, settings), with settings None if the file is unchanged since it was last indexed
+    preset_path, previous_sha1 = task
+    try:
+        with open(preset_path, 'rb') as f:
+            data = f.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if sha1 == previous_sha1:
+            return preset_path, sha1, None
+        return preset_path, sha1, read_preset_settings(data)
+    except (OSError, ValueError) as e:
+        return preset_path, None, f"{type(e).__name__}: {e}"
+
+
+class VitalPresetIndex:
+    """
+    A columnar index of Vital presets.
+
+    Args:
+      index_dir (str): The directory the index is stored in.
+      parameter_names (list, optional): Plugin parameter names to align the matrix columns to, eg.
+        list(synth_plugin.parameters.keys()). Each column is read from the settings key given by vital_setting_key.
+        Defaults to the existing index's columns, extended with any new settings found.
+      value_ranges (dict, optional): Parameter name -> (min, max), to normalise aligned columns into 0..1 with (see
+        plugin_value_ranges).
+    """
+
+    def __init__(self, index_dir, parameter_names=None, value_ranges=None):
+        self.index_dir = index_dir
+        self.parameter_names = list(parameter_names) if parameter_names is not None else None
+        self.source_keys = {}
+        self.value_ranges = {}
+        if self.parameter_names is not None:
+            self.source_keys = {name: vital_setting_key(name) for name in self.parameter_names}
+            value_ranges = value_ranges or {}
+            self.value_ranges = {
+                name: list(value_ranges[name]) for name in self.parameter_names if name in value_ranges
+            }
+        self._mapping_changed = False
+        self.columns = []
+        self.rows = []
+        self.column_min = np.empty(0, dtype=np.float32)
+        self.column_max = np.empty(0, dtype=np.float32)
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self._load()
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.index_dir, 'index.json')
+
+    @property
+    def _matrix_path(self):
+        return os.path.join(self.index_dir, 'matrix.f32')
+
+    def _load(self):
+        if not os.path.exists(self._index_path):
+            self._set_columns(self.parameter_names or [])
+            return
+        with open(self._index_path) as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            self._set_columns(self.parameter_names or [])
+            return
+        self._set_columns(data['columns'])
+        if self.parameter_names is None:
+            self.source_keys = data['source_keys']
+            self.value_ranges = data['value_ranges']
+        else:
+            # Rows parsed with a different key mapping or normalisation can't be reused
+            self._mapping_changed = (
+                data['source_keys'] != self.source_keys or data['value_ranges'] != self.value_ranges
+            )
+        self.rows = data['rows']
+        self.column_min = np.array(data['column_min'], dtype=np.float32)
+        self.column_max = np.array(data['column_max'], dtype=np.float32)
+        if self.rows and self.columns:
+            self.matrix = np.memmap(
+                self._matrix_path,
+                dtype=np.float32,
+                mode='r',
+                shape=(len(self.rows), len(self.columns)),
+            )
+        else:
+            self.matrix = np.empty((len(self.rows), len(self.columns)), dtype=np.float32)
+
+    def _set_columns(self, columns):
+        self.columns = list(columns)
+        self.column_index = {key: i for i, key in enumerate(self.columns)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def paths(self):
+        return [row['path'] for row in self.rows]
+
+    def update(self, preset_dirs, workers=None, chunksize=16):
+        """
+        Incrementally (re)index the presets within some directories.
+
+        Files whose mtime and size are unchanged are not read again, and files whose hash is unchanged are not parsed
+        again; their rows are copied across from the existing matrix.
+
+        Args:
+          preset_dirs (list): The directories to index.
+          workers (int, optional): The number of parsing processes. Defaults to the number of CPUs.
+          chunksize (int): The number of files handed to a worker at a time.
+
+        Returns:
+          dict: Counts of the added, changed, unchanged, removed and failed presets, and the 'unmatched' aligned
+            columns that no preset had a settings key for.
+        """
+        previous_rows = {row['path']: (i, row) for i, row in enumerate(self.rows)}
+        preset_paths = find_presets(preset_dirs)
+        stats = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+
+        # Presets whose mtime/size haven't changed are reused as is, the rest are (re)hashed and parsed in parallel
+        rows = {}
+        reused_rows = {}
+        tasks = []
+        for preset_path in preset_paths:
+            stat = os.stat(preset_path)
+            row = {'path': preset_path, 'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': None}
+            previous = None if self._mapping_changed else previous_rows.get(preset_path)
+            if previous and previous[1]['mtime'] == row['mtime'] and previous[1]['size'] == row['size']:
+                row['sha1'] = previous[1]['sha1']
+                reused_rows[preset_path] = previous[0]
+                stats['unchanged'] += 1
+            else:
+                tasks.append((preset_path, previous[1]['sha1'] if previous else None))
+            rows[preset_path] = row
+
+        parsed_settings = {}
+        if tasks:
+            with multiprocessing.Pool(processes=min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+                for preset_path, sha1, settings in pool.imap_unordered(_parse_preset, tasks, chunksize=chunksize):
+                    if sha1 is None:
+                        print(f"Warning: Could not index {preset_path}: {settings}")
+                        del rows[preset_path]
+                        stats['failed'] += 1
+                        continue
+                    rows[preset_path]['sha1'] = sha1
+                    if settings is None:
+                        reused_rows[preset_path] = previous_rows[preset_path][0]
+                        stats['unchanged'] += 1
+                    else:
+                        parsed_settings[preset_path] = settings
+                        stats['changed' if preset_path in previous_rows else 'added'] += 1
+        stats['removed'] = len(set(previous_rows) - set(rows))
+
+        columns = self.parameter_names
+        if columns is None:
+            known_columns = set(self.columns)
+            new_columns = sorted({
+                key for settings in parsed_settings.values() for key in settings if key not in known_columns
+            })
+            columns = self.columns + new_columns
+
+        self._write(columns, [rows[path] for path in preset_paths if path in rows], reused_rows, parsed_settings)
+        self._mapping_changed = False
+
+        stats['unmatched'] = []
+        if self.parameter_names is not None and self.rows:
+            stats['unmatched'] = [key for key, low in zip(self.columns, self.column_min) if np.isnan(low)]
+            if stats['unmatched']:
+                print(
+                    f"Warning: {len(stats['unmatched'])} of {len(self.columns)} aligned columns have no matching "
+                    f"settings key in any preset (add them to VITAL_KEY_OVERRIDES): {stats['unmatched'][:10]}"
+                )
+        return stats
+
+    def settings_row(self, settings, columns=None):
+        """
+        Map a preset's settings onto the index's columns (normalising aligned columns).
+
+        Args:
+          settings (dict): The preset's settings, as returned by read_preset_settings.
+          columns (list, optional): The columns to map onto. Defaults to the index's columns.
+
+        Returns:
+          numpy.ndarray: A float32 row (missing parameters are NaN).
+        """
+        columns = self.columns if columns is None else columns
+        row = np.full(len(columns), np.nan, dtype=np.float32)
+        for i, column in enumerate(columns):
+            value = settings.get(self.source_keys.get(column, column))
+            if value is None:
+                continue
+            value_range = self.value_ranges.get(column)
+            if value_range:
+                low, high = value_range
+                value = min(max((value - low) / (high - low), 0.0), 1.0)
+            row[i] = value
+        return row
+
+    def _write(self, columns, rows, reused_rows, parsed_settings):
+        os.makedirs(self.index_dir, exist_ok=True)
+        column_index = {key: i for i, key in enumerate(columns)}
+        # Map the existing matrix's columns onto the new ones
+        previous_columns = [i for i, key in enumerate(self.columns) if key in column_index]
+        new_columns = [column_index[self.columns[i]] for i in previous_columns]
+
+        temp_matrix_path = f"{self._matrix_path}.tmp"
+        matrix = np.full((len(rows), len(columns)), np.nan, dtype=np.float32)
+        if rows and columns:
+            matrix = np.memmap(temp_matrix_path, dtype=np.float32, mode='w+', shape=(len(rows), len(columns)))
+            matrix[:] = np.nan
+            reused = [(i, reused_rows[row['path']]) for i, row in enumerate(rows) if row['path'] not in parsed_settings]
+            if reused:
+                # Copy all the reused rows across in one go
+                new_rows, previous_rows = (np.array(indices) for indices in zip(*reused))
+                matrix[np.ix_(new_rows, new_columns)] = self.matrix[np.ix_(previous_rows, previous_columns)]
+            for i, row in enumerate(rows):
+                settings = parsed_settings.get(row['path'])
+                if settings:
+                    matrix[i] = self.settings_row(settings, columns)
+            matrix.flush()
+
+        with warnings.catch_warnings():
+            # Columns that no preset has a value for stay NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            column_min = np.nanmin(matrix, axis=0) if rows else np.full(len(columns), np.nan, dtype=np.float32)
+            column_max = np.nanmax(matrix, axis=0) if rows else np.full(len(columns), np.nan, dtype=np.float32)
+
+        # Release the old mapping before replacing the file underneath it
+        self.matrix = None
+        if rows and columns:
+            del matrix
+            os.replace(temp_matrix_path, self._matrix_path)
+
+        temp_index_path = f"{self._index_path}.tmp"
+        with open(temp_index_path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'columns': columns,
+                'source_keys': self.source_keys,
+                'value_ranges': self.value_ranges,
+                'column_min': [None if np.isnan(v) else float(v) for v in column_min],
+                'column_max': [None if np.isnan(v) else float(v) for v in column_max],
+                'rows': rows,
+            }, f)
+        os.replace(temp_index_path, self._index_path)
+        self._load()
+
+    def filter(self, conditions):
+        """
+        Find the presets whose parameters match some conditions.
+
+        Args:
+          conditions (dict): Parameter name -> value, or (min, max) range where either bound may be None.
+
+        Returns:
+          numpy.ndarray: The indices of the matching rows.
+        """
+        mask = np.ones(len(self.rows), dtype=bool)
+        for key, condition in conditions.items():
+            column = self.matrix[:, self.column_index[key]]
+            if isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            else:
+                mask &= column == condition
+        return np.flatnonzero(mask)
+
+    def _normalized(self, values, column_indices):
+        low = np.nan_to_num(np.array(self.column_min, dtype=np.float32)[column_indices])
+        span = np.nan_to_num(np.array(self.column_max, dtype=np.float32)[column_indices]) - low
+        span[span == 0] = 1.0
+        # Missing parameters count as the column's minimum
+        return np.nan_to_num((values - low) / span)
+
+    def nearest(self, query, k=10, columns=None):
+        """
+        Find the k presets nearest to a query, by euclidean distance over (min/max normalised) parameters.
+
+        Args:
+          query (int, dict or numpy.ndarray): A row index, a dict of parameter values, or a full row of values.
+          k (int): The number of neighbours to return.
+          columns (list, optional): The parameter names to compare. Defaults to all of them.
+
+        Returns:
+          list: (row_index, distance) tuples, nearest first.
+        """
+        column_indices = (
+            np.arange(len(self.columns)) if columns is None else np.array([self.column_index[key] for key in columns])
+        )
+        if isinstance(query, dict):
+            vector = np.full(len(self.columns), np.nan, dtype=np.float32)
+            for key, value in query.items():
+                vector[self.column_index[key]] = value
+        elif isinstance(query, (int, np.integer)):
+            vector = np.asarray(self.matrix[query])
+        else:
+            vector = np.asarray(query, dtype=np.float32)
+
+        points = self._normalized(self.matrix[:, column_indices], column_indices)
+        target = self._normalized(vector[column_indices], column_indices)
+        distances = np.sqrt(np.sum((points - target) ** 2, axis=1))
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k] if k else np.empty(0, dtype=int)
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(int(i), float(distances[i])) for i in nearest]
+
+
+def _parse_condition(condition):
+    # key=value or key=min:max (either bound may be empty)
+    key, _, value = condition.partition('=')
+    if ':' in value:
+        low, _, high = value.partition(':')
+        return key, (float(low) if low else None, float(high) if high else None)
+    return key, float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query a library of Vital presets.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help="(Re)index the presets in some directories.")
+    update_parser.add_argument('index_dir')
+    update_parser.add_argument('preset_dirs', nargs='+')
+    update_parser.add_argument('--workers', type=int, default=None, help="[Default: CPU count]")
+    update_parser.add_argument(
+        '--plugin',
+        default=None,
+        help="Align the columns to this plugin's parameter names, normalised to 0..1 (eg. /Library/Audio/Plug-Ins/VST3/Vital.vst3).",
+    )
+
+    query_parser = subparsers.add_parser('query', help="List the presets matching some parameter conditions.")
+    query_parser.add_argument('index_dir')
+    query_parser.add_argument('--where', action='append', default=[], help="key=value or key=min:max")
+
+    nearest_parser = subparsers.add_parser('nearest', help="List the presets nearest to a preset.")
+    nearest_parser.add_argument('index_dir')
+    nearest_parser.add_argument('preset_path')
+    nearest_parser.add_argument('-k', type=int, default=10, help="[Default: %(default)s]")
+    nearest_parser.add_argument('--columns', nargs='+', default=None, help="Only compare these parameters.")
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        parameter_names = value_ranges = None
+        if args.plugin:
+            from helpers import load_plugin_from_spec
+
+            plugin = load_plugin_from_spec(args.plugin)
+            parameter_names = list(plugin.parameters.keys())
+            value_ranges = plugin_value_ranges(plugin)
+        index = VitalPresetIndex(args.index_dir, parameter_names, value_ranges)
+        stats = index.update(args.preset_dirs, workers=args.workers)
+        stats['unmatched'] = len(stats['unmatched'])
+        print(f"Indexed {len(index)} presets x {len(index.columns)} parameters: {stats}")
+
+    elif args.command == 'query':
+        index = VitalPresetIndex(args.index_dir)
+        for row in index.filter(dict(_parse_condition(condition) for condition in args.where)):
+            print(index.rows[row]['path'])
+
+    elif args.command == 'nearest':
+        index = VitalPresetIndex(args.index_dir)
+        with open(args.preset_path, 'rb') as f:
+            query = index.settings_row(read_preset_settings(f.read()))
+        for row, distance in index.nearest(query, k=args.k, columns=args.columns):
+            print(f"{distance:.4f}  {index.rows[row]['path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# Zero-copy, streaming parsing of the XML embedded in a VST3 plugin's raw_state.
+#
+# JUCE-based plugins store their state with copyXmlToBinary, which writes an 8-byte header (the magic 'VC2!' and the
+# length of the XML as little-endian uint32s), then the XML, then a null byte. Rather than slicing and decoding the
+# whole blob (see helpers.extract_vst3_xml), these functions work on a memoryview of the state and feed it to an expat
+# parser a chunk at a time, yielding parameter/value pairs as they are parsed. Neither the blob nor the whole XML
+# document is ever copied or decoded into a Python string, and character data between elements is skipped without
+# being decoded.
+#
+# expat does still decode every attribute of each element into a str (for the start element handler), and JUCE-based
+# plugins (eg. Vital) keep large data such as base64 wavetables in attributes. Only one element's attributes are
+# alive at a time, but pass max_value_length to skip oversized values rather than keeping them in the results.
+#
+# The state can be any bytes-like object, including an mmap of a raw_state file written by synth_vst_loader.py state.
+#
+# Example usage:
+#   for parameter_id, value in iter_vst3_xml_parameters(synth_plugin.raw_state):
+#       print(parameter_id, value)
+#
+#   with mapped_state_file('synth_raw_state_new.bin') as raw_state:
+#       parameters = dict(iter_vst3_xml_parameters(raw_state))
+#
+#   python vst3_state.py synth_raw_state_new.bin
+
+import argparse
+import json
+import mmap
+import struct
+from contextlib import contextmanager, closing
+from xml.parsers import expat
+
+JUCE_XML_MAGIC = 0x21324356  # 'VC2!'
+HEADER_SIZE = 8
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Attribute names that identify a parameter element, and the attribute holding its value
+# eg. JUCE's AudioProcessorValueTreeState: <PARAM id="cutoff" value="0.5"/>
+PARAMETER_ID_ATTRIBUTES = ('id', 'name', 'key')
+PARAMETER_VALUE_ATTRIBUTE = 'value'
+
+
+def vst3_xml_view(raw_state):
+    """
+    Get a zero-copy view of the XML within a VST3 raw state.
+
+    Args:
+      raw_state (bytes-like): The raw state (bytes, bytearray, mmap, memoryview, ...).
+
+    Returns:
+      memoryview or None: A view of the XML bytes, or None if the state doesn't look like VST3 XML.
+    """
+    state = memoryview(raw_state).cast('B')
+    if len(state) <= HEADER_SIZE + 5 or state[HEADER_SIZE:HEADER_SIZE + 5] != b'<?xml':
+        return None
+
+    magic, xml_size = struct.unpack_from('<II', state, 0)
+    if magic == JUCE_XML_MAGIC and 0 < xml_size <= len(state) - HEADER_SIZE:
+        # The size includes the trailing null byte
+        xml_end = HEADER_SIZE + xml_size - 1
+    elif state[-1] == 0x00:
+        xml_end = len(state) - 1
+    else:
+        return None
+    return state[HEADER_SIZE:xml_end]
+
+
+def _parse_value(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def iter_vst3_xml_parameters(raw_state, chunk_size=DEFAULT_CHUNK_SIZE, convert_values=True, max_value_length=None):
+    """
+    Stream-parse the XML within a VST3 raw state, yielding its parameter/value pairs.
+
+    A parameter is any element with a 'value' attribute and an 'id' (or 'name'/'key') attribute.
+
+    Args:
+      raw_state (bytes-like): The raw state (bytes, bytearray, mmap, memoryview, ...).
+      chunk_size (int): The number of bytes fed to the parser at a time.
+      convert_values (bool): Convert numeric values to floats.
+      max_value_length (int, optional): Skip parameters whose values are longer than this many characters (eg.
+        embedded wavetables), rather than yielding them.
+
+    Yields:
+      tuple: (parameter_id, value) pairs, in document order.
+
+    Raises:
+      ValueError: If the state doesn't look like VST3 XML, or the XML is malformed.
+    """
+    xml = vst3_xml_view(raw_state)
+    if xml is None:
+        raise ValueError("The raw state does not look like VST3 XML.")
+
+    pending = []
+
+    def start_element(name, attributes):
+        value = attributes.get(PARAMETER_VALUE_ATTRIBUTE)
+        if value is None or (max_value_length is not None and len(value) > max_value_length):
+            return
+        for id_attribute in PARAMETER_ID_ATTRIBUTES:
+            if id_attribute in attributes:
+                pending.append((attributes[id_attribute], _parse_value(value) if convert_values else value))
+                return
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    try:
+        for start in range(0, len(xml), chunk_size):
+            parser.Parse(xml[start:start + chunk_size], False)
+            yield from pending
+            pending.clear()
+        parser.Parse(b'', True)
+        yield from pending
+    except expat.ExpatError as e:
+        raise ValueError(f"Malformed VST3 state XML: {e}") from e
+    finally:
+        # Release the view, so that an underlying mmap can be closed
+        xml.release()
+
+
+@contextmanager
+def mapped_state_file(path):
+    """
+    Memory-map a raw state file (eg. as written by synth_vst_loader.py state) for zero-copy parsing.
+
+    Args:
+      path (str): The path to the raw state file.
+
+    Yields:
+      mmap.mmap: The read-only mapped file. Any parameter generators over it must be exhausted or closed before the
+        with block exits, as the file can't be unmapped while views of it exist.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapped
+    finally:
+        mapped.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the parameters in a VST3 raw state file's embedded XML.")
+    parser.add_argument('state_file', help="The raw state file (eg. synth_raw_state_new.bin).")
+    parser.add_argument('--json', action='store_true', help="Output the parameters as a JSON object.")
+    parser.add_argument(
+        '--max-value-length',
+        type=int,
+        default=None,
+        help="Skip parameters with values longer than this many characters (eg. embedded wavetables).",
+    )
+    args = parser.parse_args()
+
+    # The parameters generator is closed before the mmap, so that it releases its view of the mmap first
+    with mapped_state_file(args.state_file) as raw_state, closing(
+        iter_vst3_xml_parameters(raw_state, max_value_length=args.max_value_length)
+    ) as parameters:
+        if args.json:
+            print(json.dumps(dict(parameters), indent=2))
+        else:
+            for parameter_id, value in parameters:
+                print(f"{parameter_id}: {value}")
+
+
+if __name__ == '__main__':
+    main()